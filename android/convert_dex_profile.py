@@ -5,11 +5,23 @@
 # found in the LICENSE file.
 
 import argparse
+import bisect
 import collections
+import hashlib
+import itertools
+import json
 import logging
+import os
 import re
+import shutil
 import subprocess
 import sys
+import tempfile
+import zlib
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'gyp'))
+
+from util import file_cache
 
 DEX_CLASS_NAME_RE = re.compile(r'\'L(?P<class_name>[^;]+);\'')
 DEX_METHOD_NAME_RE = re.compile(r'\'(?P<method_name>[^\']+)\'')
@@ -53,6 +65,9 @@ TYPE_DESCRIPTOR_RE = re.compile(
     r'[VZBSCIJFD]'
     r')')
 
+# Must be changed whenever parsing or the format of cache entries changes.
+_MAPPING_CACHE_VERSION = '1'
+
 DOT_NOTATION_MAP = {
     '': '',
     'boolean': 'Z',
@@ -81,22 +96,79 @@ class Method(object):
     return 'Method<{}->{}({}){}>'.format(self.class_name, self.name,
         self.param_types or '', self.return_type or '')
 
-  def __cmp__(self, other):
-    return cmp((self.class_name, self.name, self.param_types, self.return_type),
-        (other.class_name, other.name, other.param_types, other.return_type))
+  def _Key(self):
+    return (self.class_name, self.name, self.param_types, self.return_type)
+
+  def __eq__(self, other):
+    return self._Key() == other._Key()
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __lt__(self, other):
+    return self._Key() < other._Key()
 
   def __hash__(self):
     # only hash name and class_name since other fields may not be set yet.
     return hash((self.name, self.class_name))
 
 
+class _LineIndex(object):
+  """Looks up methods that share a name by the line numbers mapped to them.
+
+  Args:
+    methods_and_lines: List of (Method, line numbers) tuples. Lookups return
+        methods in the order of this list.
+  """
+
+  def __init__(self, methods_and_lines):
+    self._methods = [method for method, _ in methods_and_lines]
+
+    # Every (line, method index), sorted by line.
+    lines = sorted((line, i) for i, (_, line_numbers)
+                   in enumerate(methods_and_lines) for line in line_numbers)
+    self._lines = [line for line, _ in lines]
+    self._line_methods = [i for _, i in lines]
+
+    # The (first line, last line, method index) of each method, sorted by first
+    # line, along with the running maximum of last lines.
+    ranges = sorted((min(line_numbers), max(line_numbers), i)
+                    for i, (_, line_numbers) in enumerate(methods_and_lines))
+    self._range_starts = [start for start, _, _ in ranges]
+    self._range_ends = [end for _, end, _ in ranges]
+    self._range_methods = [i for _, _, i in ranges]
+    self._max_range_ends = list(itertools.accumulate(self._range_ends, max))
+
+  def _Methods(self, indices):
+    return [self._methods[i] for i in sorted(set(indices))]
+
+  def MethodsWithLinesIn(self, line_start, line_end):
+    """Returns methods mapped to any line in [line_start, line_end]."""
+    lo = bisect.bisect_left(self._lines, line_start)
+    hi = bisect.bisect_right(self._lines, line_end)
+    return self._Methods(self._line_methods[lo:hi])
+
+  def MethodsOverlapping(self, line_start, line_end):
+    """Returns methods whose first to last lines overlap the given range."""
+    # All ranges before |lo| end before |line_start|, and all ranges from |hi|
+    # start after |line_end|.
+    lo = bisect.bisect_left(self._max_range_ends, line_start)
+    hi = bisect.bisect_right(self._range_starts, line_end)
+    return self._Methods(self._range_methods[i] for i in range(lo, hi)
+                         if self._range_ends[i] >= line_start)
+
+
 class Class(object):
   def __init__(self, name):
     self.name = name
-    self._methods = []
+    # {method name: [(Method, line numbers)]}
+    self._methods_by_name = collections.defaultdict(list)
+    # {method name: _LineIndex}, created by FindMethodsAtLine().
+    self._line_indices = {}
 
   def AddMethod(self, method, line_numbers):
-    self._methods.append((method, set(line_numbers)))
+    self._methods_by_name[method.name].append((method, list(line_numbers)))
+    self._line_indices.pop(method.name, None)
 
   def FindMethodsAtLine(self, method_name, line_start, line_end=None):
     """Searches through dex class for a method given a name and line numbers
@@ -106,6 +178,9 @@ class Class(object):
     hints as to which function in the class is being looked for), returns a list
     of possible matches (or none if none are found).
 
+    Methods mapped to any of the hinted lines are preferred over methods whose
+    lines merely span them.
+
     Args:
       method_name: name of method being searched for
       line_start: start of hint range for lines in this method
@@ -115,44 +190,30 @@ class Class(object):
       A list of Method objects that could match the hints given, or None if no
       method is found.
     """
-    found_methods = []
-    if line_end is None:
-      hint_lines = set([line_start])
-    else:
-      hint_lines = set(range(line_start, line_end+1))
-
-    named_methods = [(method, l) for method, l in self._methods
-                     if method.name == method_name]
-
-    if len(named_methods) == 1:
-      return [method for method, l in named_methods]
-    if len(named_methods) == 0:
+    named_methods = self._methods_by_name.get(method_name)
+    if not named_methods:
       return None
+    if len(named_methods) == 1:
+      return [named_methods[0][0]]
 
-    for method, line_numbers in named_methods:
-      if not hint_lines.isdisjoint(line_numbers):
-        found_methods.append(method)
-
-    if len(found_methods) > 0:
-      if len(found_methods) > 1:
-        logging.warning('ambigous methods in dex %s at lines %s in class "%s"',
-            found_methods, hint_lines, self.name)
-      return found_methods
-
-    for method, line_numbers in named_methods:
-      if (max(hint_lines) >= min(line_numbers)
-          and min(hint_lines) <= max(line_numbers)):
-        found_methods.append(method)
-
-    if len(found_methods) > 0:
-      if len(found_methods) > 1:
-        logging.warning('ambigous methods in dex %s at lines %s in class "%s"',
-            found_methods, hint_lines, self.name)
-      return found_methods
-    else:
+    if line_end is None:
+      line_end = line_start
+    line_index = self._line_indices.get(method_name)
+    if line_index is None:
+      line_index = _LineIndex(named_methods)
+      self._line_indices[method_name] = line_index
+
+    found_methods = (line_index.MethodsWithLinesIn(line_start, line_end)
+                     or line_index.MethodsOverlapping(line_start, line_end))
+    if not found_methods:
       logging.warning('No method named "%s" in class "%s" is '
-                      'mapped to lines %s', method_name, self.name, hint_lines)
+                      'mapped to lines %d-%d', method_name, self.name,
+                      line_start, line_end)
       return None
+    if len(found_methods) > 1:
+      logging.warning('ambigous methods in dex %s at lines %d-%d in class "%s"',
+          found_methods, line_start, line_end, self.name)
+    return found_methods
 
 
 class Profile(object):
@@ -197,6 +258,16 @@ class ProguardMapping(object):
   def GetClassMapping(self, from_class):
     return self._class_mapping.get(from_class, from_class)
 
+  def IterMethodMappings(self):
+    """Yields every (from_method, to_method) pair."""
+    for from_method, to_methods in self._method_mapping.items():
+      for to_method in to_methods:
+        yield from_method, to_method
+
+  def IterClassMappings(self):
+    """Yields every (from_class, to_class) pair."""
+    return iter(self._class_mapping.items())
+
   def MapTypeDescriptor(self, type_descriptor):
     match = TYPE_DESCRIPTOR_RE.search(type_descriptor)
     assert match is not None
@@ -230,7 +301,19 @@ class MalformedProfileException(MalformedLineException):
 
 
 def _RunDexDump(dexdump_path, dex_file_path):
-  return subprocess.check_output([dexdump_path, dex_file_path]).splitlines()
+  """Yields lines of dexdump output as they are written.
+
+  The output of large dex files is hundreds of MB, so it is parsed while
+  dexdump runs rather than being read into memory first.
+  """
+  cmd = [dexdump_path, dex_file_path]
+  process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                             universal_newlines=True)
+  with process.stdout:
+    for line in process.stdout:
+      yield line
+  if process.wait():
+    raise subprocess.CalledProcessError(process.returncode, cmd)
 
 
 def _ReadFile(file_path):
@@ -292,7 +375,8 @@ def ProcessDex(dex_dump):
   inside their respective Class objects.
 
   Args:
-    dex_dump: An array of lines of dexdump output
+    dex_dump: An iterable of lines of dexdump output, such as the generator
+              returned by _RunDexDump().
 
   Returns:
     A dict that maps from class names in type descriptor format (but without the
@@ -477,8 +561,106 @@ def ProcessProfile(input_profile, proguard_mapping):
   return profile
 
 
+def _WriteMappingCacheEntry(mapping, path):
+  """Writes the pairs of |mapping| (which also give its reverse) to |path|.
+
+  Strings are stored once, in a table, and referred to by index. Methods are
+  four indices: class name, name, param types and return type.
+  """
+  strings = {}
+
+  def index(value):
+    return strings.setdefault(value, len(strings))
+
+  classes = []
+  for from_class, to_class in mapping.IterClassMappings():
+    classes += [index(from_class), index(to_class)]
+  methods = []
+  for from_method, to_method in mapping.IterMethodMappings():
+    for method in (from_method, to_method):
+      methods += [index(method.class_name), index(method.name),
+                  index(method.param_types), index(method.return_type)]
+  data = json.dumps({
+      'strings': sorted(strings, key=strings.get),
+      'classes': classes,
+      'methods': methods,
+  }, separators=(',', ':'))
+  with open(path, 'wb') as f:
+    f.write(zlib.compress(data.encode('utf-8')))
+
+
+def _ReadMappingCacheEntry(path):
+  """Returns the (mapping, reverse_mapping) written by _WriteMappingCacheEntry.
+  """
+  with open(path, 'rb') as f:
+    data = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+  strings = data['strings']
+  mapping = ProguardMapping()
+  reverse_mapping = ProguardMapping()
+  classes = data['classes']
+  for i in range(0, len(classes), 2):
+    from_class, to_class = strings[classes[i]], strings[classes[i + 1]]
+    mapping.AddClassMapping(from_class, to_class)
+    reverse_mapping.AddClassMapping(to_class, from_class)
+
+  methods_by_indices = {}
+
+  def method_at(offset):
+    indices = tuple(data['methods'][offset:offset + 4])
+    method = methods_by_indices.get(indices)
+    if method is None:
+      class_name, name, param_types, return_type = (strings[i] for i in indices)
+      method = Method(name, class_name, param_types, return_type)
+      methods_by_indices[indices] = method
+    return method
+
+  for offset in range(0, len(data['methods']), 8):
+    from_method, to_method = method_at(offset), method_at(offset + 4)
+    mapping.AddMethodMapping(from_method, to_method)
+    reverse_mapping.AddMethodMapping(to_method, from_method)
+  return mapping, reverse_mapping
+
+
+def LoadProguardMapping(dex_file, proguard_mapping, dexdump_path, cache=None):
+  """Parses a proguard mapping file with the dex file that it describes.
+
+  Args:
+    dex_file: path to the dex file matching the mapping.
+    proguard_mapping: path to the proguard mapping file.
+    dexdump_path: path to the dexdump utility.
+    cache: an optional util.file_cache.FileCache. The parsed mapping is
+      stored in it, keyed by the contents of |dex_file| and |proguard_mapping|,
+      so that neither needs to be parsed again.
+
+  Returns:
+    The (mapping, reverse_mapping) returned by ProcessProguardMapping().
+  """
+  if cache is None:
+    return ProcessProguardMapping(
+        _ReadFile(proguard_mapping),
+        ProcessDex(_RunDexDump(dexdump_path, dex_file)))
+
+  digest = hashlib.sha1(_MAPPING_CACHE_VERSION.encode('utf-8'))
+  file_cache.HashFile(proguard_mapping, digest)
+  file_cache.HashFile(dex_file, digest)
+  cache_key = digest.hexdigest()
+  temp_dir = tempfile.mkdtemp()
+  try:
+    entry_path = os.path.join(temp_dir, 'mapping')
+    if cache.Get(cache_key, entry_path):
+      return _ReadMappingCacheEntry(entry_path)
+    mappings = ProcessProguardMapping(
+        _ReadFile(proguard_mapping),
+        ProcessDex(_RunDexDump(dexdump_path, dex_file)))
+    _WriteMappingCacheEntry(mappings[0], entry_path)
+    cache.Put(cache_key, entry_path)
+    return mappings
+  finally:
+    shutil.rmtree(temp_dir)
+
+
 def ObfuscateProfile(nonobfuscated_profile, dex_file, proguard_mapping,
-                     dexdump_path, output_filename):
+                     dexdump_path, output_filename, cache=None):
   """Helper method for obfuscating a profile.
 
   Args:
@@ -488,10 +670,11 @@ def ObfuscateProfile(nonobfuscated_profile, dex_file, proguard_mapping,
       in the dex file.
     dexdump_path: path to the dexdump utility.
     output_filename: output filename in which to write the obfuscated profile.
+    cache: an optional util.file_cache.FileCache for the parsed mapping (see
+      LoadProguardMapping()).
   """
-  dexinfo = ProcessDex(_RunDexDump(dexdump_path, dex_file))
-  _, reverse_mapping = ProcessProguardMapping(
-      _ReadFile(proguard_mapping), dexinfo)
+  _, reverse_mapping = LoadProguardMapping(dex_file, proguard_mapping,
+                                           dexdump_path, cache=cache)
   obfuscated_profile = ProcessProfile(
       _ReadFile(nonobfuscated_profile), reverse_mapping)
   obfuscated_profile.WriteToFile(output_filename)
@@ -539,9 +722,8 @@ def main(args):
     log_level = logging.ERROR
   logging.basicConfig(format='%(levelname)s: %(message)s', level=log_level)
 
-  dex = ProcessDex(_RunDexDump(options.dexdump_path, options.dex_path))
-  proguard_mapping, reverse_proguard_mapping = ProcessProguardMapping(
-      _ReadFile(options.proguard_mapping_path), dex)
+  proguard_mapping, reverse_proguard_mapping = LoadProguardMapping(
+      options.dex_path, options.proguard_mapping_path, options.dexdump_path)
   if options.obfuscate:
     profile = ProcessProfile(
         _ReadFile(options.input_profile_path),
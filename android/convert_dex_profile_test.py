@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import convert_dex_profile
+
+_DEX_DUMP = """
+Class #0            -
+  Class descriptor  : 'La;'
+  Direct methods    -
+    #0              : (in La;)
+      name          : 'a'
+      type          : '()V'
+      positions     :
+        0x0000 line=10
+        0x0002 line=12
+      locals        :
+    #1              : (in La;)
+      name          : 'a'
+      type          : '(I)V'
+      positions     :
+        0x0000 line=20
+        0x0004 line=24
+      locals        :
+  Virtual methods   -
+    #0              : (in La;)
+      name          : 'b'
+      type          : '(Lb;)Z'
+      positions     :
+        0x0000 line=30
+      locals        :
+Class #1            -
+  Class descriptor  : 'Lb;'
+  Direct methods    -
+    #0              : (in Lb;)
+      name          : 'a'
+      type          : '()Ljava/lang/String;'
+      positions     :
+        0x0000 line=5
+      locals        :
+""".splitlines(True)
+
+_PROGUARD_MAPPING = """\
+org.chromium.Foo -> a:
+    int mField -> c
+    10:12:void run() -> a
+    20:24:void run(int) -> a
+    21:21:void inlined() -> a
+    21:21:void run(int) -> a
+    30:30:boolean check(org.chromium.Bar) -> b
+    void unmapped(org.chromium.Bar[]) -> d
+org.chromium.Bar -> b:
+    5:5:java.lang.String name() -> a
+""".splitlines(True)
+
+
+def _Pairs(mapping):
+  return (sorted(mapping.IterClassMappings()),
+          sorted(mapping.IterMethodMappings()))
+
+
+class LineIndexTest(unittest.TestCase):
+
+  def testMatchesBruteForce(self):
+    rand = random.Random(0)
+    for _ in range(100):
+      methods_and_lines = []
+      for i in range(rand.randint(1, 6)):
+        method = convert_dex_profile.Method('m%d' % i, 'La;')
+        lines = [rand.randint(1, 40) for _ in range(rand.randint(1, 4))]
+        methods_and_lines.append((method, lines))
+      index = convert_dex_profile._LineIndex(methods_and_lines)
+      for _ in range(20):
+        start = rand.randint(0, 42)
+        end = start + rand.randint(0, 5)
+        self.assertEqual(
+            [m for m, lines in methods_and_lines
+             if any(start <= l <= end for l in lines)],
+            index.MethodsWithLinesIn(start, end))
+        self.assertEqual(
+            [m for m, lines in methods_and_lines
+             if min(lines) <= end and max(lines) >= start],
+            index.MethodsOverlapping(start, end))
+
+
+class MappingCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def testCacheEntryMatchesProcessProguardMapping(self):
+    mapping, reverse_mapping = convert_dex_profile.ProcessProguardMapping(
+        _PROGUARD_MAPPING, convert_dex_profile.ProcessDex(_DEX_DUMP))
+    # Overloads are told apart by their lines, and inlinings are skipped.
+    self.assertEqual(
+        [convert_dex_profile.Method('run', 'Lorg/chromium/Foo;', 'I', 'V')],
+        list(mapping.GetMethodMapping(
+            convert_dex_profile.Method('a', 'La;', 'I', 'V'))))
+
+    entry_path = os.path.join(self.temp_dir, 'mapping')
+    convert_dex_profile._WriteMappingCacheEntry(mapping, entry_path)
+    cached_mapping, cached_reverse_mapping = (
+        convert_dex_profile._ReadMappingCacheEntry(entry_path))
+    self.assertEqual(_Pairs(mapping), _Pairs(cached_mapping))
+    self.assertEqual(_Pairs(reverse_mapping), _Pairs(cached_reverse_mapping))
+    self.assertEqual(5, len(_Pairs(cached_mapping)[1]))
+
+
+if __name__ == '__main__':
+  unittest.main()
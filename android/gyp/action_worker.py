@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Runs android/gyp scripts in long-lived worker processes.
+
+Usage (as run by ninja):
+  action_worker.py path/to/script.py [script args...]
+
+For small actions, starting the interpreter and importing build_utils and
+friends takes most of the time. This client forwards the invocation to a
+server that has already executed |script|'s top-level code (and so imported
+its modules). For each invocation, the server forks and the child runs the
+script as __main__ with the client's argv and stdio file descriptors. This
+means that outputs, depfiles (including python deps) and exit codes are the
+same as when running the script directly.
+
+One server is started for each (interpreter, script, cwd, environment). A
+server exits when it has been idle for _IDLE_TIMEOUT_SECONDS, or when any
+module it loaded has changed on disk. When no usable server is running, the
+client starts one in the background and runs the script directly.
+
+This module must only import system modules. Python dependencies written to
+depfiles are computed from sys.modules, which the forked children inherit.
+Modules needed only by the server are imported by it, to keep the client
+fast to start.
+"""
+
+import hashlib
+import os
+import signal
+import socket
+import sys
+
+_IDLE_TIMEOUT_SECONDS = 300
+
+# A client that finds no server creates a lock file before starting one, so
+# that a burst of clients does not start a server each. Locks older than this
+# are assumed to belong to a server that failed to start.
+_STARTUP_LOCK_TIMEOUT_SECONDS = 60
+
+# Overrides the directory that server sockets are created in.
+_SOCKET_DIR_ENV_VAR = 'ANDROID_ACTION_WORKER_DIR'
+
+
+def _SocketPath(script_path):
+  socket_dir = os.environ.get(_SOCKET_DIR_ENV_VAR) or os.path.join(
+      os.environ.get('TMPDIR', '/tmp'),
+      'android_action_worker-%d' % os.getuid())
+  if not os.path.isdir(socket_dir):
+    os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+  key = hashlib.sha1()
+  for value in (sys.executable, script_path, os.getcwd()):
+    key.update(os.fsencode(value) + b'\0')
+  for name, value in sorted(os.environ.items()):
+    # The shell sets $_ to the path of the command being run.
+    if name != '_':
+      key.update(os.fsencode(name) + b'=' + os.fsencode(value) + b'\0')
+  # Unix socket paths are limited to ~100 characters, so use a short hash.
+  return os.path.join(socket_dir, key.hexdigest()[:24] + '.sock')
+
+
+# Protocol: The client connects and sends one byte along with its stdin,
+# stdout and stderr file descriptors, followed by its NUL-separated argv,
+# prefixed by its length and a newline. The server replies with lines of
+# "pid <pid>" once the script is running and "exit <code>" when it is done, or
+# just "stale" if the server needs to be restarted.
+def _WriteRequest(sock, argv):
+  socket.send_fds(sock, [b'\0'], [0, 1, 2])
+  payload = b'\0'.join(os.fsencode(a) for a in argv)
+  sock.sendall(b'%d\n' % len(payload) + payload)
+
+
+def _ReadRequest(conn):
+  """Returns a tuple of (argv, fds), or (None, fds) for malformed requests."""
+  _, fds, _, _ = socket.recv_fds(conn, 1, 3)
+  reader = conn.makefile('rb')
+  length = reader.readline()
+  if len(fds) != 3 or not length.strip().isdigit():
+    return None, fds
+  payload = reader.read(int(length))
+  argv = [os.fsdecode(a) for a in payload.split(b'\0')] if payload else []
+  return argv, fds
+
+
+def _WriteReply(sock, reply):
+  sock.sendall(reply.encode() + b'\n')
+
+
+def _ReadReply(reader):
+  """Returns a (kind, value) tuple, or (None, None) upon disconnection."""
+  parts = reader.readline().split()
+  if not parts:
+    return None, None
+  return parts[0].decode(), int(parts[1]) if len(parts) > 1 else None
+
+
+def _ExitCodeFromSystemExit(e):
+  # Mirrors how the interpreter handles an uncaught SystemExit.
+  if e.code is None:
+    return 0
+  if isinstance(e.code, int):
+    return e.code
+  sys.stderr.write(str(e.code) + '\n')
+  return 1
+
+
+def _RunScriptInChild(code, script_path, argv):
+  """Runs |code| as __main__. Never returns."""
+  import builtins
+  import traceback
+  import types
+
+  exit_code = 0
+  try:
+    module = types.ModuleType('__main__')
+    module.__file__ = script_path
+    module.__builtins__ = builtins
+    # Also replace aliases, e.g. multiprocessing's __mp_main__.
+    old_main = sys.modules['__main__']
+    for name, value in list(sys.modules.items()):
+      if value is old_main:
+        sys.modules[name] = module
+    sys.argv = [script_path] + argv
+    exec(code, module.__dict__)
+  except SystemExit as e:
+    exit_code = _ExitCodeFromSystemExit(e)
+  except BaseException:  # pylint: disable=broad-except
+    traceback.print_exc()
+    exit_code = 1
+  try:
+    sys.stdout.flush()
+    sys.stderr.flush()
+  finally:
+    os._exit(exit_code)
+
+
+def _ModuleMtimes():
+  ret = {}
+  for module in list(sys.modules.values()):
+    path = getattr(module, '__file__', None)
+    if path and path not in ret:
+      try:
+        ret[path] = os.stat(path).st_mtime_ns
+      except OSError:
+        pass
+  return ret
+
+
+class _Server(object):
+  """Accepts requests on |socket_path| and runs |script_path| for each."""
+
+  def __init__(self, socket_path, script_path):
+    self._socket_path = socket_path
+    self._script_path = script_path
+    self._code = None
+    self._module_mtimes = None
+    self._listener = None
+    self._socket_inode = None
+    # Map of pid -> client connection.
+    self._children = {}
+
+  def _Preload(self):
+    import builtins
+    import types
+
+    # The script is not in sys.modules, so its mtime is recorded separately.
+    # It is stat()ed before being read so that later edits are never missed.
+    script_mtime = os.stat(self._script_path).st_mtime_ns
+    with open(self._script_path) as f:
+      self._code = compile(f.read(), self._script_path, 'exec')
+    # Like the interpreter does for scripts.
+    sys.path[0] = os.path.dirname(self._script_path)
+    sys.argv = [self._script_path]
+    # Run top-level code (imports and definitions), but not the main block.
+    module = types.ModuleType('__action_worker_preload__')
+    module.__file__ = self._script_path
+    module.__builtins__ = builtins
+    exec(self._code, module.__dict__)
+    self._module_mtimes = _ModuleMtimes()
+    self._module_mtimes[self._script_path] = script_mtime
+
+  def _ModulesChanged(self):
+    for path, mtime in self._module_mtimes.items():
+      try:
+        if os.stat(path).st_mtime_ns != mtime:
+          return True
+      except OSError:
+        return True
+    return False
+
+  def _Listen(self):
+    self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Bind to a temporary name and rename into place so that clients never
+    # connect before listen() has been called.
+    temp_path = '%s.%d.tmp' % (self._socket_path, os.getpid())
+    self._listener.bind(temp_path)
+    self._listener.listen(64)
+    os.rename(temp_path, self._socket_path)
+    self._socket_inode = os.stat(self._socket_path).st_ino
+    _RemoveStartupLock(self._socket_path)
+
+  def _HandleConnection(self, conn):
+    try:
+      argv, fds = _ReadRequest(conn)
+    except OSError:
+      conn.close()
+      return
+    try:
+      if argv is None:
+        conn.close()
+        return
+      if self._ModulesChanged():
+        _WriteReply(conn, 'stale')
+        conn.close()
+        self._Shutdown()
+        return
+      sys.stdout.flush()
+      sys.stderr.flush()
+      pid = os.fork()
+      if pid == 0:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        self._listener.close()
+        for fd in (0, 1, 2):
+          os.dup2(fds[fd], fd)
+        for fd in fds:
+          os.close(fd)
+        conn.close()
+        _RunScriptInChild(self._code, self._script_path, argv)
+      self._children[pid] = conn
+      _WriteReply(conn, 'pid %d' % pid)
+    finally:
+      for fd in fds:
+        os.close(fd)
+
+  def _ReapChildren(self):
+    while self._children:
+      try:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+      except ChildProcessError:
+        break
+      if pid == 0:
+        break
+      conn = self._children.pop(pid, None)
+      if conn is None:
+        continue
+      if os.WIFSIGNALED(status):
+        exit_code = -os.WTERMSIG(status)
+      else:
+        exit_code = os.WEXITSTATUS(status)
+      try:
+        _WriteReply(conn, 'exit %d' % exit_code)
+      except OSError:
+        pass
+      conn.close()
+
+  def _Shutdown(self):
+    # Let new clients fall back to starting a new server right away. Another
+    # server may have replaced our socket if clients raced to start one.
+    try:
+      if os.stat(self._socket_path).st_ino == self._socket_inode:
+        os.unlink(self._socket_path)
+    except OSError:
+      pass
+    self._listener.close()
+    self._listener = None
+
+  def Run(self):
+    import selectors
+
+    try:
+      self._Preload()
+    except BaseException:
+      _RemoveStartupLock(self._socket_path)
+      raise
+    self._Listen()
+
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_write, False)
+    signal.set_wakeup_fd(wakeup_write)
+    signal.signal(signal.SIGCHLD, lambda *_: None)
+
+    selector = selectors.DefaultSelector()
+    selector.register(self._listener, selectors.EVENT_READ)
+    selector.register(wakeup_read, selectors.EVENT_READ)
+    while self._listener or self._children:
+      timeout = None if self._children else _IDLE_TIMEOUT_SECONDS
+      events = selector.select(timeout)
+      if not events and not self._children:
+        self._Shutdown()
+        break
+      for key, _ in events:
+        if key.fileobj == wakeup_read:
+          os.read(wakeup_read, 4096)
+        elif self._listener:
+          conn, _ = self._listener.accept()
+          self._HandleConnection(conn)
+          if not self._listener:
+            selector.unregister(key.fileobj)
+      self._ReapChildren()
+
+
+def _RemoveStartupLock(socket_path):
+  try:
+    os.unlink(socket_path + '.lock')
+  except OSError:
+    pass
+
+
+def _StartServer(socket_path, script_path):
+  import time
+
+  lock_path = socket_path + '.lock'
+  try:
+    lock_age = time.time() - os.path.getmtime(lock_path)
+    if lock_age > _STARTUP_LOCK_TIMEOUT_SECONDS:
+      _RemoveStartupLock(socket_path)
+  except OSError:
+    pass
+  try:
+    os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+  except OSError:
+    # Another client is already starting a server.
+    return
+  # Double-fork so that the server is not a child of the script that this
+  # process is about to exec.
+  pid = os.fork()
+  if pid:
+    os.waitpid(pid, 0)
+    return
+  try:
+    os.setsid()
+    if os.fork() == 0:
+      devnull = os.open(os.devnull, os.O_RDWR)
+      for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+      os.execv(sys.executable, [
+          sys.executable, os.path.abspath(__file__), '--serve', socket_path,
+          script_path])
+  finally:
+    os._exit(0)
+
+
+def _RunDirectly(script_path, argv):
+  os.execv(sys.executable, [sys.executable, script_path] + argv)
+
+
+def _RunClient(script_path, argv):
+  socket_path = _SocketPath(script_path)
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(socket_path)
+    _WriteRequest(sock, argv)
+    reader = sock.makefile('rb')
+    kind, pid = _ReadReply(reader)
+  except OSError:
+    kind = None
+  if kind != 'pid':
+    # No server, or a stale one that is shutting down. Start one for next
+    # time.
+    sock.close()
+    _StartServer(socket_path, script_path)
+    _RunDirectly(script_path, argv)
+
+  # Make interrupting the client (e.g. ninja being killed) stop the action.
+  def forward_signal(signum, _):
+    try:
+      os.kill(pid, signum)
+    except OSError:
+      pass
+  for signum in (signal.SIGINT, signal.SIGTERM):
+    signal.signal(signum, forward_signal)
+
+  kind, exit_code = _ReadReply(reader)
+  if kind != 'exit':
+    sys.stderr.write('action_worker: Lost connection to server for %s\n' %
+                     script_path)
+    return 1
+  if exit_code < 0:
+    # Terminate the same way the child did.
+    signal.signal(-exit_code, signal.SIG_DFL)
+    os.kill(os.getpid(), -exit_code)
+  return exit_code
+
+
+def main(argv):
+  if argv and argv[0] == '--serve':
+    _Server(argv[1], argv[2]).Run()
+    return 0
+  if not argv:
+    sys.stderr.write(__doc__)
+    return 1
+  return _RunClient(os.path.abspath(argv[0]), argv[1:])
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+_ACTION_WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'action_worker.py')
+
+# Prints its version and the pid of its parent, which is the server when run by
+# one.
+_SCRIPT = '''import os
+import sys
+
+if __name__ == '__main__':
+  sys.stdout.write('%s %%d' %% os.getppid())
+'''
+
+
+class ActionWorkerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.script_path = os.path.join(self.temp_dir, 'script.py')
+    self.env = dict(os.environ)
+    self.env['ANDROID_ACTION_WORKER_DIR'] = os.path.join(self.temp_dir, 'w')
+    self.server_pids = set()
+
+  def tearDown(self):
+    for pid in self.server_pids:
+      try:
+        os.kill(pid, signal.SIGTERM)
+      except OSError:
+        pass
+    shutil.rmtree(self.temp_dir)
+
+  def _WriteScript(self, version, mtime):
+    with open(self.script_path, 'w') as f:
+      f.write(_SCRIPT % version)
+    os.utime(self.script_path, (mtime, mtime))
+
+  def _Run(self):
+    """Returns (version, whether a server ran the script)."""
+    output = subprocess.check_output(
+        [sys.executable, _ACTION_WORKER, self.script_path],
+        cwd=self.temp_dir, env=self.env).decode()
+    version, ppid = output.split()
+    ppid = int(ppid)
+    if ppid != os.getpid():
+      self.server_pids.add(ppid)
+    return version, ppid != os.getpid()
+
+  def _RunWhenServed(self):
+    """Runs the script until a server runs it, and returns its version."""
+    deadline = time.time() + 30
+    while time.time() < deadline:
+      version, served = self._Run()
+      if served:
+        return version
+      time.sleep(0.1)
+    self.fail('No server started.')
+    return None
+
+  def testRestartsWhenScriptChanges(self):
+    self._WriteScript('v1', 1000)
+    self.assertEqual(('v1', False), self._Run())
+    self.assertEqual('v1', self._RunWhenServed())
+
+    self._WriteScript('v2', 2000)
+    # The stale server declines, and the client runs the script directly.
+    self.assertEqual(('v2', False), self._Run())
+    self.assertEqual('v2', self._RunWhenServed())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -273,12 +273,8 @@ def main(args):
          zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as out_apk:
 
       def copy_resource(zipinfo, out_dir=''):
-        compress = zipinfo.compress_type != zipfile.ZIP_STORED
-        build_utils.AddToZipHermetic(
-            out_apk,
-            out_dir + zipinfo.filename,
-            data=resource_apk.read(zipinfo.filename),
-            compress=compress)
+        build_utils.CopyZipEntryHermetic(
+            out_apk, resource_apk, zipinfo, out_dir + zipinfo.filename)
 
       # Make assets come before resources in order to maintain the same file
       # ordering as GYP / aapt. http://crbug.com/561862
@@ -299,12 +295,14 @@ def main(args):
       # 3. Dex files
       if options.dex_file and options.dex_file.endswith('.zip'):
         with zipfile.ZipFile(options.dex_file, 'r') as dex_zip:
-          for dex in (d for d in dex_zip.namelist() if d.endswith('.dex')):
-            build_utils.AddToZipHermetic(
-                out_apk,
-                apk_dex_dir + dex,
-                data=dex_zip.read(dex),
-                compress=not options.uncompress_dex)
+          for info in dex_zip.infolist():
+            if info.filename.endswith('.dex'):
+              build_utils.CopyZipEntryHermetic(
+                  out_apk,
+                  dex_zip,
+                  info,
+                  apk_dex_dir + info.filename,
+                  compress=not options.uncompress_dex)
       elif options.dex_file:
         build_utils.AddToZipHermetic(
             out_apk,
@@ -345,7 +343,8 @@ def main(args):
       # Prebuilt jars may contain class files which we shouldn't include.
       for java_resource in options.java_resources:
         with zipfile.ZipFile(java_resource, 'r') as java_resource_jar:
-          for apk_path in java_resource_jar.namelist():
+          for info in java_resource_jar.infolist():
+            apk_path = info.filename
             apk_path_lower = apk_path.lower()
 
             if apk_path_lower.startswith('meta-inf/'):
@@ -355,10 +354,12 @@ def main(args):
             if apk_path_lower.endswith('.class'):
               continue
 
-            build_utils.AddToZipHermetic(
+            build_utils.CopyZipEntryHermetic(
                 out_apk,
+                java_resource_jar,
+                info,
                 apk_root_dir + apk_path,
-                data=java_resource_jar.read(apk_path))
+                compress=True)
 
     if options.format == 'apk':
       finalize_apk.FinalizeApk(options.apksigner_path, options.zipalign_path,
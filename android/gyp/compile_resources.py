@@ -15,6 +15,7 @@ This will crunch images with aapt2.
 import argparse
 import collections
 import contextlib
+import hashlib
 import multiprocessing.pool
 import os
 import re
@@ -27,6 +28,7 @@ from xml.etree import ElementTree
 
 
 from util import build_utils
+from util import file_cache
 from util import resource_utils
 
 # Name of environment variable that can be used to force this script to
@@ -34,6 +36,14 @@ from util import resource_utils
 # temporary ones.
 _ENV_DEBUG_VARIABLE = 'ANDROID_DEBUG_TEMP_RESOURCES_DIR'
 
+# When set, outputs of slow tools are cached in sub-directories of this
+# directory, and reused by all targets (and builds) with identical inputs.
+_CACHE_DIR = os.environ.get('COMPILE_RESOURCES_CACHE_DIR')
+
+# Size limit of each cache within _CACHE_DIR.
+_CACHE_MAX_SIZE_MB = int(os.environ.get('COMPILE_RESOURCES_CACHE_MAX_SIZE_MB',
+                                        4096))
+
 # Import jinja2 from third_party/jinja2
 sys.path.insert(1, os.path.join(build_utils.DIR_SOURCE_ROOT, 'third_party'))
 from jinja2 import Template # pylint: disable=F0401
@@ -599,16 +609,47 @@ def _CreateKeepPredicate(resource_dirs, resource_blacklist_regex,
   return drawable_predicate
 
 
+def _GetCache(name):
+  """Returns the FileCache called |name|, or None if caching is disabled."""
+  if not _CACHE_DIR:
+    return None
+  return file_cache.FileCache(os.path.join(_CACHE_DIR, name),
+                              _CACHE_MAX_SIZE_MB * 2**20)
+
+
+def _HashDirectory(directory, salt):
+  """Returns a digest of |salt| and the paths and contents of |directory|."""
+  digest = hashlib.sha1(salt.encode())
+  for path in sorted(_IterFiles(directory)):
+    digest.update(b'\0' + os.path.relpath(path, directory).encode() + b'\0')
+    file_cache.HashFile(path, digest)
+  return digest.hexdigest()
+
+
 def _ConvertToWebP(webp_binary, png_files):
   renamed_paths = dict()
-  pool = multiprocessing.pool.ThreadPool(10)
+  webp_flags = ['-mt', '-quiet', '-m', '6', '-q', '100', '-lossless']
+
+  cache = _GetCache('webp')
+  if cache:
+    webp_digest = hashlib.sha1()
+    file_cache.HashFile(webp_binary, webp_digest)
+    cache_salt = '\0'.join([webp_digest.hexdigest()] + webp_flags)
+
+  pool = multiprocessing.pool.ThreadPool(multiprocessing.cpu_count())
   def convert_image(png_path_tuple):
     png_path, original_dir = png_path_tuple
     root = os.path.splitext(png_path)[0]
     webp_path = root + '.webp'
-    args = [webp_binary, png_path, '-mt', '-quiet', '-m', '6', '-q', '100',
-        '-lossless', '-o', webp_path]
-    subprocess.check_call(args)
+    if cache:
+      digest = hashlib.sha1(cache_salt.encode())
+      file_cache.HashFile(png_path, digest)
+      cache_key = digest.hexdigest()
+    if not cache or not cache.Get(cache_key, webp_path):
+      args = [webp_binary, png_path] + webp_flags + ['-o', webp_path]
+      subprocess.check_call(args)
+      if cache:
+        cache.Put(cache_key, webp_path)
     os.remove(png_path)
     renamed_paths[os.path.relpath(webp_path, original_dir)] = os.path.relpath(
         png_path, original_dir)
@@ -617,6 +658,8 @@ def _ConvertToWebP(webp_binary, png_files):
                            if not _PNG_WEBP_BLACKLIST_PATTERN.match(f[0])])
   pool.close()
   pool.join()
+  if cache:
+    cache.Trim()
   return renamed_paths
 
 
@@ -629,9 +672,25 @@ def _CompileDeps(aapt2_path, dep_subdirs, temp_dir):
       # TODO(wnwen): Turn this on once aapt2 forces 9-patch to be crunched.
       # '--no-crunch',
   ]
+
+  # Partials are keyed by the contents of the directory being compiled, which
+  # differ from the dependency's zip when resources are renamed or filtered.
+  cache = _GetCache('aapt2_partials')
+  if cache:
+    aapt2_digest = hashlib.sha1()
+    file_cache.HashFile(aapt2_path, aapt2_digest)
+    cache_salt = '\0'.join([aapt2_digest.hexdigest()] +
+                           partial_compile_command[1:])
+
   pool = multiprocessing.pool.ThreadPool(10)
   def compile_partial(directory):
     dirname = os.path.basename(directory)
+    sorted_partial_path = os.path.join(partials_dir, dirname + '.sorted.zip')
+    if cache:
+      cache_key = _HashDirectory(directory, cache_salt)
+      if cache.Get(cache_key, sorted_partial_path):
+        return sorted_partial_path
+
     partial_path = os.path.join(partials_dir, dirname + '.zip')
     compile_command = (partial_compile_command +
                        ['--dir', directory, '-o', partial_path])
@@ -643,14 +702,17 @@ def _CompileDeps(aapt2_path, dep_subdirs, temp_dir):
 
     # Sorting the files in the partial ensures deterministic output from the
     # aapt2 link step which uses order of files in the partial.
-    sorted_partial_path = os.path.join(partials_dir, dirname + '.sorted.zip')
     _SortZip(partial_path, sorted_partial_path)
 
+    if cache:
+      cache.Put(cache_key, sorted_partial_path)
     return sorted_partial_path
 
   partials = pool.map(compile_partial, dep_subdirs)
   pool.close()
   pool.join()
+  if cache:
+    cache.Trim()
   return partials
 
 
@@ -668,6 +730,22 @@ def _CreateResourceInfoFile(
     info_file.writelines(sorted(lines))
 
 
+# Names of shared resource strings, for _FilterStringsFile().
+_filter_strings_whitelist = None
+
+
+def _InitFilterStringsWorker(shared_names_whitelist):
+  global _filter_strings_whitelist
+  _filter_strings_whitelist = shared_names_whitelist
+
+
+def _FilterStringsFile(job):
+  """Keeps only shared strings in a file, or only non-shared ones."""
+  path, keep_shared = job
+  resource_utils.FilterAndroidResourceStringsXml(
+      path, lambda x: (x in _filter_strings_whitelist) == keep_shared)
+
+
 def _RemoveUnwantedLocalizedStrings(dep_subdirs, options):
   """Remove localized strings that should not go into the final output.
 
@@ -720,17 +798,31 @@ def _RemoveUnwantedLocalizedStrings(dep_subdirs, options):
 
   # For any locale in B but not in A, only keep the shared
   # resource strings in each file.
+  filter_jobs = []
   for locale in shared_resources_locales - wanted_locales:
     for path in locale_to_files_map[locale]:
-      resource_utils.FilterAndroidResourceStringsXml(
-          path, lambda x: x in shared_names_whitelist)
+      filter_jobs.append((path, True))
 
   # For any locale in A but not in B, only keep the strings
   # that are _not_ from shared resources in the file.
   for locale in wanted_locales - shared_resources_locales:
     for path in locale_to_files_map[locale]:
-      resource_utils.FilterAndroidResourceStringsXml(
-          path, lambda x: x not in shared_names_whitelist)
+      filter_jobs.append((path, False))
+
+  _InitFilterStringsWorker(shared_names_whitelist)
+  if len(filter_jobs) > 1 and multiprocessing.cpu_count() > 1:
+    # Parsing is CPU bound, so use processes rather than threads.
+    pool = multiprocessing.Pool(
+        initializer=_InitFilterStringsWorker,
+        initargs=(shared_names_whitelist,))
+    try:
+      pool.map(_FilterStringsFile, filter_jobs, chunksize=4)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    for job in filter_jobs:
+      _FilterStringsFile(job)
 
 
 def _PackageApk(options, dep_subdirs, temp_dir, gen_dir, r_txt_path):
@@ -855,13 +947,10 @@ def _ExtractIdResources(rtxt_path):
   Returns:
     List of id resources in the form of id/<resource_name>
   """
-  id_resources = []
-  with open(rtxt_path) as rtxt:
-    for line in rtxt:
-      if ' id ' in line:
-        resource_name = line.split()[2]
-        id_resources.append('id/{}'.format(resource_name))
-  return id_resources
+  return [
+      'id/{}'.format(name)
+      for name in resource_utils.GetRTxtResourceNamesOfType(rtxt_path, 'id')
+  ]
 
 
 @contextlib.contextmanager
@@ -4,8 +4,10 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import hashlib
 import json
 import logging
+import multiprocessing.pool
 import optparse
 import os
 import re
@@ -15,11 +17,23 @@ import tempfile
 import zipfile
 
 from util import build_utils
+from util import file_cache
+from util import jvm_worker
 
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), os.path.pardir))
 
 import convert_dex_profile
 
+# When set, each input jar is dexed separately, and the resulting intermediate
+# dex files are cached in this directory and reused by all targets (and builds)
+# that dex identical jars. The output is then created by merging them, so only
+# changed jars are re-dexed. Parsed ProGuard mappings for --dexlayout-profile
+# are cached there too.
+_CACHE_DIR = os.environ.get('DEX_CACHE_DIR')
+
+# Size limit of _CACHE_DIR.
+_CACHE_MAX_SIZE_MB = int(os.environ.get('DEX_CACHE_MAX_SIZE_MB', 4096))
+
 
 def _CheckFilePathEndsWithJar(parser, file_path):
   if not file_path.endswith(".jar"):
@@ -161,9 +175,61 @@ def _NoClassFiles(jar_paths):
 
 
 def _RunD8(dex_cmd, input_paths, output_path):
-  dex_cmd += ['--output', output_path]
+  dex_cmd = dex_cmd + ['--output', output_path]
   dex_cmd += input_paths
-  build_utils.CheckOutput(dex_cmd, print_stderr=False)
+  jvm_worker.CheckOutput(dex_cmd, print_stderr=False)
+
+
+def _GetCache():
+  if not _CACHE_DIR:
+    return None
+  return file_cache.FileCache(_CACHE_DIR, _CACHE_MAX_SIZE_MB * 2**20)
+
+
+def _CreateIntermediateDexFiles(dex_cmd, d8_flags, d8_jar_path, jar_paths,
+                                temp_dir):
+  """Dexes each of |jar_paths| separately, reusing cached results.
+
+  Args:
+    dex_cmd: Command to run D8, without main dex flags.
+    d8_flags: The flags within |dex_cmd|.
+    d8_jar_path: Path of the jar that contains D8.
+    jar_paths: Jars to dex.
+    temp_dir: Directory to write intermediate dex files to.
+
+  Returns:
+    The inputs for merging, in the order of |jar_paths|: the intermediate dex
+    archive of each jar with class files, and the other jars (e.g. .dex.jar
+    files, which are already dexed) as they are.
+  """
+  cache = _GetCache()
+  d8_digest = hashlib.sha1()
+  file_cache.HashFile(d8_jar_path, d8_digest)
+  cache_salt = '\0'.join([d8_digest.hexdigest()] + d8_flags)
+  intermediate_dir = os.path.join(temp_dir, 'intermediate_dex')
+  os.mkdir(intermediate_dir)
+
+  def dex_jar(index_and_path):
+    index, jar_path = index_and_path
+    if _NoClassFiles([jar_path]):
+      return jar_path
+    digest = hashlib.sha1(cache_salt.encode())
+    file_cache.HashFile(jar_path, digest)
+    cache_key = digest.hexdigest()
+    dex_archive_path = os.path.join(intermediate_dir, '%d.zip' % index)
+    if not cache.Get(cache_key, dex_archive_path):
+      _RunD8(dex_cmd + ['--intermediate'], [jar_path], dex_archive_path)
+      cache.Put(cache_key, dex_archive_path)
+    return dex_archive_path
+
+  pool = multiprocessing.pool.ThreadPool(multiprocessing.cpu_count())
+  # Results are in the order of |jar_paths| regardless of which jars are dexed
+  # first, so that the merged output is deterministic.
+  ret = pool.map(dex_jar, enumerate(jar_paths))
+  pool.close()
+  pool.join()
+  cache.Trim()
+  return ret
 
 
 def _EnvWithArtLibPath(binary_path):
@@ -320,15 +386,22 @@ def main(args):
     input_paths.append(options.main_dex_list_path)
     
   if os.path.exists(options.d8_jar_path):
-    dex_cmd = ['java', '-jar', options.d8_jar_path, '--no-desugaring']
+    d8_jar_path = options.d8_jar_path
+    dex_cmd = ['java', '-jar', d8_jar_path]
   else:
-    dex_cmd = ['java', '-cp', options.r8_jar_path, 'com.android.tools.r8.D8', '--no-desugaring']
-  if options.multi_dex:
-    dex_cmd += ['--main-dex-list', options.main_dex_list_path]
+    d8_jar_path = options.r8_jar_path
+    dex_cmd = ['java', '-cp', d8_jar_path, 'com.android.tools.r8.D8']
+  d8_flags = ['--no-desugaring']
   if options.release:
-    dex_cmd += ['--release']
+    d8_flags += ['--release']
   if options.min_api:
-    dex_cmd += ['--min-api', options.min_api]
+    d8_flags += ['--min-api', options.min_api]
+  dex_cmd += d8_flags
+  # The main dex list applies to the output as a whole, so it is only passed
+  # when merging intermediate dex files.
+  merge_cmd = list(dex_cmd)
+  if options.multi_dex:
+    merge_cmd += ['--main-dex-list', options.main_dex_list_path]
 
   is_dex = options.dex_path.endswith('.dex')
   is_jar = options.dex_path.endswith('.jar')
@@ -345,7 +418,12 @@ def main(args):
       # .dex files can't specify a name for D8. Instead, we output them to a
       # temp directory then move them after the command has finished running
       # (see _MoveTempDexFile). For other files, tmp_dex_dir is None.
-      _RunD8(dex_cmd, paths, tmp_dex_dir)
+      if _CACHE_DIR:
+        dex_inputs = _CreateIntermediateDexFiles(dex_cmd, d8_flags,
+                                                 d8_jar_path, paths, tmp_dir)
+      else:
+        dex_inputs = paths
+      _RunD8(merge_cmd, dex_inputs, tmp_dex_dir)
 
     tmp_dex_output = os.path.join(tmp_dir, 'tmp_dex_output')
     if is_dex:
@@ -361,7 +439,7 @@ def main(args):
         convert_dex_profile.ObfuscateProfile(
             options.dexlayout_profile, tmp_dex_output,
             options.proguard_mapping_path, options.dexdump_path,
-            matching_profile)
+            matching_profile, cache=_GetCache())
       else:
         logging.warning('No obfuscation for %s', options.dexlayout_profile)
         matching_profile = options.dexlayout_profile
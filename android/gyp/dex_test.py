@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import dex
+
+
+class DexTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self._old_cache_dir = dex._CACHE_DIR
+    self._old_run_d8 = dex._RunD8
+    dex._CACHE_DIR = os.path.join(self.temp_dir, 'cache')
+    self.d8_calls = []
+
+    def run_d8(dex_cmd, input_paths, output_path):
+      self.d8_calls.append((dex_cmd, input_paths))
+      with zipfile.ZipFile(output_path, 'w') as z:
+        z.writestr('classes.dex', '\n'.join(input_paths))
+
+    dex._RunD8 = run_d8
+
+  def tearDown(self):
+    dex._CACHE_DIR = self._old_cache_dir
+    dex._RunD8 = self._old_run_d8
+    shutil.rmtree(self.temp_dir)
+
+  def _WriteJar(self, name, entries):
+    path = os.path.join(self.temp_dir, name)
+    with zipfile.ZipFile(path, 'w') as z:
+      for entry in entries:
+        z.writestr(entry, entry)
+    return path
+
+  def _CreateIntermediateDexFiles(self, jar_paths):
+    temp_dir = tempfile.mkdtemp(dir=self.temp_dir)
+    return dex._CreateIntermediateDexFiles(['d8'], [], self.d8_jar_path,
+                                           jar_paths, temp_dir)
+
+  def testCreateIntermediateDexFilesKeepsDexInputs(self):
+    self.d8_jar_path = self._WriteJar('d8.jar', ['D8.class'])
+    a_jar = self._WriteJar('a.jar', ['org/A.class'])
+    lib_dex_jar = self._WriteJar('lib.dex.jar', ['classes.dex'])
+    b_jar = self._WriteJar('b.jar', ['org/B.class', 'README'])
+    empty_jar = self._WriteJar('empty.jar', [])
+    jar_paths = [a_jar, lib_dex_jar, b_jar, empty_jar]
+
+    merge_inputs = self._CreateIntermediateDexFiles(jar_paths)
+    self.assertEqual(4, len(merge_inputs))
+    self.assertEqual([lib_dex_jar, empty_jar],
+                     [merge_inputs[1], merge_inputs[3]])
+    # Only jars with class files are dexed.
+    self.assertEqual([(['d8', '--intermediate'], [a_jar]),
+                      (['d8', '--intermediate'], [b_jar])],
+                     sorted(self.d8_calls))
+    for path, jar_path in ((merge_inputs[0], a_jar), (merge_inputs[2], b_jar)):
+      with zipfile.ZipFile(path) as z:
+        self.assertEqual(jar_path, z.read('classes.dex').decode())
+
+    # Cached intermediate dex files are reused.
+    self.d8_calls = []
+    merge_inputs = self._CreateIntermediateDexFiles(jar_paths)
+    self.assertEqual([], self.d8_calls)
+    self.assertEqual([lib_dex_jar, empty_jar],
+                     [merge_inputs[1], merge_inputs[3]])
+    with zipfile.ZipFile(merge_inputs[2]) as z:
+      self.assertEqual(b_jar, z.read('classes.dex').decode())
+
+
+if __name__ == '__main__':
+  unittest.main()
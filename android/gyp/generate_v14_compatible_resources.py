@@ -20,6 +20,8 @@ Please refer to http://crbug.com/235118 for the details.
 """
 
 import codecs
+import collections
+import multiprocessing
 import optparse
 import os
 import re
@@ -55,6 +57,12 @@ ATTRIBUTES_TO_MAP = dict(['android:' + k, 'android:' + v] for k, v
 ATTRIBUTES_TO_MAP_REVERSED = dict([v, k] for k, v
                                   in ATTRIBUTES_TO_MAP.items())
 
+# Conversions only run in a pool when there are at least this many jobs, since
+# starting workers costs more than converting a few files. Actions already run
+# in parallel with each other, so each one uses at most _MAX_WORKERS processes.
+_MIN_JOBS_FOR_POOL = 64
+_MAX_WORKERS = 4
+
 
 def IterateXmlElements(node):
   """minidom helper function that iterates all the element nodes.
@@ -108,19 +116,19 @@ def HasStyleResource(dom):
               list(root_node.getElementsByTagName('style')))
 
 
-def ErrorIfStyleResourceExistsInDir(input_dir):
-  """If a style resource is in input_dir, raises an exception."""
-  for input_filename in build_utils.FindInDirectory(input_dir, '*.xml'):
-    dom = ParseAndReportErrors(input_filename)
-    if HasStyleResource(dom):
-      # Allow style file in third_party to exist in non-v17 directories so long
-      # as they do not contain deprecated attributes.
-      if not 'third_party' in input_dir or (
-          GenerateV14StyleResourceDom(dom, input_filename)):
-        raise Exception('error: style file ' + input_filename +
-                        ' should be under ' + input_dir +
-                        '-v17 directory. Please refer to '
-                        'http://crbug.com/243952 for the details.')
+def ErrorIfStyleResource(input_filename, input_dir):
+  """If input_filename, from input_dir, is a style resource, raises an
+  exception."""
+  dom = ParseAndReportErrors(input_filename)
+  if HasStyleResource(dom):
+    # Allow style file in third_party to exist in non-v17 directories so long
+    # as they do not contain deprecated attributes.
+    if not 'third_party' in input_dir or (
+        GenerateV14StyleResourceDom(dom, input_filename)):
+      raise Exception('error: style file ' + input_filename +
+                      ' should be under ' + input_dir +
+                      '-v17 directory. Please refer to '
+                      'http://crbug.com/243952 for the details.')
 
 
 def GenerateV14LayoutResourceDom(dom, filename, assert_not_deprecated=True):
@@ -218,22 +226,113 @@ def GenerateV14StyleResource(input_filename, output_v14_filename):
   WriteDomToFile(dom, output_v14_filename)
 
 
-def GenerateV14LayoutResourcesInDir(input_dir, output_v14_dir, output_v17_dir):
-  """Convert layout resources to API 14 compatible resources in input_dir."""
-  for input_filename in build_utils.FindInDirectory(input_dir, '*.xml'):
-    rel_filename = os.path.relpath(input_filename, input_dir)
-    output_v14_filename = os.path.join(output_v14_dir, rel_filename)
-    output_v17_filename = os.path.join(output_v17_dir, rel_filename)
-    GenerateV14LayoutResource(input_filename, output_v14_filename,
-                              output_v17_filename)
+# A conversion of a single input file. |kind| is one of:
+#   'layout': GenerateV14LayoutResource().
+#   'style': GenerateV14StyleResource().
+#   'check': ErrorIfStyleResource(), which has no outputs.
+_Task = collections.namedtuple(
+    '_Task', ('kind', 'input_path', 'input_dir', 'output_v14_path',
+              'output_v17_path'))
+
+
+def _GetTask(res_dir, res_v14_dir, input_path):
+  """Returns the _Task for a file in res_dir, or None if it is not converted.
+
+  Only depends on the path, so that it also works for deleted files.
+  """
+  rel_path = os.path.relpath(input_path, res_dir)
+  pieces = rel_path.split(os.sep)
+  if len(pieces) < 2 or not input_path.endswith('.xml'):
+    return None
+  name = pieces[0]
+  rel_filename = os.path.join(*pieces[1:])
+
+  dir_pieces = name.split('-')
+  resource_type = dir_pieces[0]
+  qualifiers = dir_pieces[1:]
+
+  api_level_qualifier_index = -1
+  api_level_qualifier = ''
+  for index, qualifier in enumerate(qualifiers):
+    if re.match('v[0-9]+$', qualifier):
+      api_level_qualifier_index = index
+      api_level_qualifier = qualifier
+      break
+
+  # Android pre-v17 API doesn't support RTL. Skip.
+  if 'ldrtl' in qualifiers:
+    return None
+
+  input_dir = os.path.abspath(os.path.join(res_dir, name))
+  input_path = os.path.join(input_dir, rel_filename)
+
+  # We also need to copy the original v17 resource to *-v17 directory
+  # because the generated v14 resource will hide the original resource.
+  output_v14_dir = os.path.join(res_v14_dir, name)
+  output_v17_dir = os.path.join(res_v14_dir, name + '-v17')
+
+  # We only convert layout resources under layout*/, xml*/,
+  # and style resources under values*/.
+  if resource_type in ('layout', 'xml'):
+    if not api_level_qualifier:
+      return _Task('layout', input_path, input_dir,
+                   os.path.join(output_v14_dir, rel_filename),
+                   os.path.join(output_v17_dir, rel_filename))
+
+  elif resource_type == 'values':
+    if api_level_qualifier == 'v17':
+      output_qualifiers = qualifiers[:]
+      del output_qualifiers[api_level_qualifier_index]
+      output_v14_dir = os.path.join(res_v14_dir,
+                                    '-'.join([resource_type] +
+                                             output_qualifiers))
+      return _Task('style', input_path, input_dir,
+                   os.path.join(output_v14_dir, rel_filename), None)
+    elif not api_level_qualifier:
+      return _Task('check', input_path, input_dir, None, None)
+  return None
+
+
+def _ListTasks(res_dir, res_v14_dir):
+  tasks = []
+  for name in os.listdir(res_dir):
+    input_dir = os.path.join(res_dir, name)
+    if not os.path.isdir(input_dir):
+      continue
+    for input_filename in build_utils.FindInDirectory(input_dir, '*.xml'):
+      task = _GetTask(res_dir, res_v14_dir, input_filename)
+      if task:
+        tasks.append(task)
+  return tasks
+
+
+def _RunTasks(tasks):
+  """Runs tasks that write the same outputs, in order."""
+  for task in tasks:
+    if task.kind == 'layout':
+      GenerateV14LayoutResource(task.input_path, task.output_v14_path,
+                                task.output_v17_path)
+    elif task.kind == 'style':
+      GenerateV14StyleResource(task.input_path, task.output_v14_path)
+    else:
+      ErrorIfStyleResource(task.input_path, task.input_dir)
+
+
+def _RunTasksInPool(tasks):
+  """Runs _RunTasks() in a pool worker."""
+  try:
+    _RunTasks(tasks)
+  except SystemExit:
+    # Raised by ParseAndReportErrors(). It would kill the worker without
+    # reporting a result, so turn it into an exception.
+    raise Exception('Failed to parse XML file in: %s' %
+                    ', '.join(t.input_path for t in tasks))
 
 
-def GenerateV14StyleResourcesInDir(input_dir, output_v14_dir):
-  """Convert style resources to API 14 compatible resources in input_dir."""
-  for input_filename in build_utils.FindInDirectory(input_dir, '*.xml'):
-    rel_filename = os.path.relpath(input_filename, input_dir)
-    output_v14_filename = os.path.join(output_v14_dir, rel_filename)
-    GenerateV14StyleResource(input_filename, output_v14_filename)
+def _DeleteOutputs(task):
+  for path in (task.output_v14_path, task.output_v17_path):
+    if path and os.path.exists(path):
+      os.unlink(path)
 
 
 def ParseArgs():
@@ -262,50 +361,69 @@ def ParseArgs():
   return options
 
 def GenerateV14Resources(res_dir, res_v14_dir):
-  for name in os.listdir(res_dir):
-    if not os.path.isdir(os.path.join(res_dir, name)):
-      continue
+  GenerateV14ResourcesForDirs([res_dir], res_v14_dir)
 
-    dir_pieces = name.split('-')
-    resource_type = dir_pieces[0]
-    qualifiers = dir_pieces[1:]
 
-    api_level_qualifier_index = -1
-    api_level_qualifier = ''
-    for index, qualifier in enumerate(qualifiers):
-      if re.match('v[0-9]+$', qualifier):
-        api_level_qualifier_index = index
-        api_level_qualifier = qualifier
-        break
+def GenerateV14ResourcesForDirs(res_dirs, res_v14_dir, changed_paths=None):
+  """Generates v14 compatible resources for res_dirs into res_v14_dir.
 
-    # Android pre-v17 API doesn't support RTL. Skip.
-    if 'ldrtl' in qualifiers:
-      continue
+  When several of res_dirs have a file that is converted to the same output,
+  the last one wins.
 
-    input_dir = os.path.abspath(os.path.join(res_dir, name))
-
-    # We also need to copy the original v17 resource to *-v17 directory
-    # because the generated v14 resource will hide the original resource.
-    output_v14_dir = os.path.join(res_v14_dir, name)
-    output_v17_dir = os.path.join(res_v14_dir, name + '-v17')
-
-    # We only convert layout resources under layout*/, xml*/,
-    # and style resources under values*/.
-    if resource_type in ('layout', 'xml'):
-      if not api_level_qualifier:
-        GenerateV14LayoutResourcesInDir(input_dir, output_v14_dir,
-                                        output_v17_dir)
-
-    elif resource_type == 'values':
-      if api_level_qualifier == 'v17':
-        output_qualifiers = qualifiers[:]
-        del output_qualifiers[api_level_qualifier_index]
-        output_v14_dir = os.path.join(res_v14_dir,
-                                      '-'.join([resource_type] +
-                                               output_qualifiers))
-        GenerateV14StyleResourcesInDir(input_dir, output_v14_dir)
-      elif not api_level_qualifier:
-        ErrorIfStyleResourceExistsInDir(input_dir)
+  Args:
+    res_dirs: List of resource directories.
+    res_v14_dir: Output directory.
+    changed_paths: If None, all files are converted. Otherwise, res_v14_dir
+      must hold the outputs of a previous call with the same res_dirs, and
+      changed_paths lists the files that were added, modified or deleted since
+      then. Only their outputs are updated.
+  """
+  all_tasks = []
+  for res_dir in res_dirs:
+    all_tasks.extend(_ListTasks(res_dir, res_v14_dir))
+
+  if changed_paths is None:
+    tasks = all_tasks
+  else:
+    changed_paths = set(os.path.abspath(p) for p in changed_paths)
+    stale_tasks = []
+    for res_dir in res_dirs:
+      abs_res_dir = os.path.abspath(res_dir) + os.sep
+      for path in changed_paths:
+        if path.startswith(abs_res_dir):
+          task = _GetTask(res_dir, res_v14_dir, path)
+          if task:
+            stale_tasks.append(task)
+    # Outputs of deleted files must go, and those of other files that write
+    # the same outputs must be regenerated in order.
+    stale_outputs = set(t.output_v14_path for t in stale_tasks
+                        if t.output_v14_path)
+    for task in stale_tasks:
+      _DeleteOutputs(task)
+    tasks = [
+        t for t in all_tasks
+        if t.input_path in changed_paths or t.output_v14_path in stale_outputs
+    ]
+
+  # Tasks with the same outputs run in order, in the same job.
+  jobs = collections.OrderedDict()
+  for task in tasks:
+    key = task.output_v14_path or task.input_path
+    jobs.setdefault(key, []).append(task)
+  jobs = list(jobs.values())
+
+  num_workers = min(multiprocessing.cpu_count(), _MAX_WORKERS)
+  if len(jobs) >= _MIN_JOBS_FOR_POOL and num_workers > 1:
+    # Parsing is CPU bound, so use processes rather than threads.
+    pool = multiprocessing.Pool(num_workers)
+    try:
+      pool.map(_RunTasksInPool, jobs, chunksize=8)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    for job in jobs:
+      _RunTasks(job)
 
 
 def main():
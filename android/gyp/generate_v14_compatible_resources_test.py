@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import generate_v14_compatible_resources
+
+_LAYOUT = """<?xml version="1.0" encoding="utf-8"?>
+<LinearLayout xmlns:android="http://schemas.android.com/apk/res/android"
+    android:%s="4dp" />
+"""
+
+_STYLE = """<?xml version="1.0" encoding="utf-8"?>
+<resources xmlns:android="http://schemas.android.com/apk/res/android">
+  <style name="%s">
+    <item name="android:paddingStart">4dp</item>
+  </style>
+</resources>
+"""
+
+
+class GenerateV14CompatibleResourcesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.res_dirs = [self._Path('res1'), self._Path('res2')]
+    self._Write('res1/layout/a.xml', _LAYOUT % 'paddingStart')
+    self._Write('res1/layout/b.xml', _LAYOUT % 'paddingEnd')
+    # Converted to the same outputs as res1/layout/b.xml, which it overrides.
+    self._Write('res2/layout/b.xml', _LAYOUT % 'layout_marginStart')
+    self._Write('res1/values-v17/styles.xml', _STYLE % 'Style1')
+    self._Write('res2/values/strings.xml', '<resources/>')
+    self.v14_dir = self._Path('v14')
+    os.mkdir(self.v14_dir)
+    generate_v14_compatible_resources.GenerateV14ResourcesForDirs(
+        self.res_dirs, self.v14_dir)
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def _Path(self, name):
+    return os.path.join(self.temp_dir, name)
+
+  def _Write(self, name, contents):
+    path = self._Path(name)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+      f.write(contents)
+    return path
+
+  def _ReadTree(self, root):
+    """Returns a dict of relative path -> contents of the files in |root|."""
+    ret = {}
+    for dirpath, _, filenames in os.walk(root):
+      for filename in filenames:
+        path = os.path.join(dirpath, filename)
+        with open(path) as f:
+          ret[os.path.relpath(path, root)] = f.read()
+    return ret
+
+  def _CheckIncremental(self, changed_paths):
+    generate_v14_compatible_resources.GenerateV14ResourcesForDirs(
+        self.res_dirs, self.v14_dir, changed_paths)
+    full_dir = tempfile.mkdtemp(dir=self.temp_dir)
+    generate_v14_compatible_resources.GenerateV14ResourcesForDirs(
+        self.res_dirs, full_dir)
+    self.assertEqual(self._ReadTree(full_dir), self._ReadTree(self.v14_dir))
+    return self._ReadTree(self.v14_dir)
+
+  def testFullGeneration(self):
+    outputs = self._ReadTree(self.v14_dir)
+    self.assertEqual(
+        ['layout-v17/a.xml', 'layout-v17/b.xml', 'layout/a.xml',
+         'layout/b.xml', 'values/styles.xml'],
+        sorted(outputs))
+    self.assertIn('paddingLeft', outputs['layout/a.xml'])
+    self.assertIn('layout_marginLeft', outputs['layout/b.xml'])
+
+  def testUnchanged(self):
+    self._CheckIncremental([])
+
+  def testFileAdded(self):
+    c = self._Write('res2/layout/c.xml', _LAYOUT % 'paddingEnd')
+    d = self._Write('res2/values-v17/styles.xml', _STYLE % 'Style2')
+    outputs = self._CheckIncremental([c, d])
+    self.assertIn('paddingRight', outputs['layout/c.xml'])
+
+  def testFileChanged(self):
+    a = self._Write('res1/layout/a.xml', _LAYOUT % 'drawableEnd')
+    # Overridden by res2/layout/b.xml.
+    b = self._Write('res1/layout/b.xml', _LAYOUT % 'drawableStart')
+    outputs = self._CheckIncremental([a, b])
+    self.assertIn('drawableRight', outputs['layout/a.xml'])
+    self.assertIn('layout_marginLeft', outputs['layout/b.xml'])
+
+  def testFileRemoved(self):
+    a = self._Path('res1/layout/a.xml')
+    os.unlink(a)
+    styles = self._Path('res1/values-v17/styles.xml')
+    os.unlink(styles)
+    outputs = self._CheckIncremental([a, styles])
+    self.assertNotIn('layout/a.xml', outputs)
+
+  def testOverridingFileRemoved(self):
+    b = self._Path('res2/layout/b.xml')
+    os.unlink(b)
+    outputs = self._CheckIncremental([b])
+    self.assertIn('paddingRight', outputs['layout/b.xml'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -17,69 +17,222 @@ rebuilt when this jar changes. I.e. any change to the jar that would require a
 rebuild, will have a corresponding change in the TOC file.
 """
 
+import multiprocessing
 import optparse
 import os
-import re
 import sys
 import zipfile
 
 from util import build_utils
+from util import class_file_utils
 from util import md5_check
 
+# Bump when the format of TOC files changes, so that they are regenerated.
+_TOC_VERSION = 1
 
-def GetClassesInZipFile(zip_file):
-  classes = []
-  files = zip_file.namelist()
-  for f in files:
-    if f.endswith('.class'):
-      # f is of the form org/chromium/base/Class$Inner.class
-      classes.append(f.replace('/', '.')[:-6])
-  return classes
-
-
-def CallJavap(classpath, classes):
-  javap_cmd = [
-      'javap',
-      '-package',  # Show public/protected/package.
-      # -verbose is required to get constant values (which can be inlined in
-      # dependents).
-      '-verbose',
-      '-J-XX:NewSize=4m',
-      '-classpath', classpath
-      ] + classes
-  return build_utils.CheckOutput(javap_cmd)
-
-
-def ExtractToc(disassembled_classes):
-  # javap output is structured by indent (2-space) levels.
-  good_patterns = [
-      '^[^ ]', # This includes all class/function/member signatures.
-      '^  SourceFile:',
-      '^  minor version:',
-      '^  major version:',
-      '^  Constant value:',
-      ]
-  bad_patterns = [
-      '^const #', # Matches the constant pool (i.e. literals used in the class).
-    ]
-
-  def JavapFilter(line):
-    return (re.match('|'.join(good_patterns), line) and
-        not re.match('|'.join(bad_patterns), line))
-  toc = list(filter(JavapFilter, disassembled_classes.split('\n')))
-
-  return '\n'.join(toc)
+_PRIMITIVE_TYPES = {
+    'B': 'byte',
+    'C': 'char',
+    'D': 'double',
+    'F': 'float',
+    'I': 'int',
+    'J': 'long',
+    'S': 'short',
+    'V': 'void',
+    'Z': 'boolean',
+}
 
+_ACC_SYNCHRONIZED = 0x0020
+_ACC_VOLATILE = 0x0040
+_ACC_TRANSIENT = 0x0080
+_ACC_VARARGS = 0x0080
+_ACC_NATIVE = 0x0100
+_ACC_INTERFACE = 0x0200
+_ACC_ABSTRACT = 0x0400
+_ACC_STRICT = 0x0800
+
+_CLASS_MODIFIERS = (
+    (class_file_utils.ACC_PUBLIC, 'public'),
+    (_ACC_ABSTRACT, 'abstract'),
+    (class_file_utils.ACC_FINAL, 'final'),
+)
+_FIELD_MODIFIERS = (
+    (class_file_utils.ACC_PUBLIC, 'public'),
+    (class_file_utils.ACC_PROTECTED, 'protected'),
+    (class_file_utils.ACC_STATIC, 'static'),
+    (class_file_utils.ACC_FINAL, 'final'),
+    (_ACC_VOLATILE, 'volatile'),
+    (_ACC_TRANSIENT, 'transient'),
+)
+_METHOD_MODIFIERS = (
+    (class_file_utils.ACC_PUBLIC, 'public'),
+    (class_file_utils.ACC_PROTECTED, 'protected'),
+    (class_file_utils.ACC_STATIC, 'static'),
+    (class_file_utils.ACC_FINAL, 'final'),
+    (_ACC_SYNCHRONIZED, 'synchronized'),
+    (_ACC_NATIVE, 'native'),
+    (_ACC_ABSTRACT, 'abstract'),
+    (_ACC_STRICT, 'strictfp'),
+)
+
+# Jars with fewer classes are not worth starting processes for.
+_MIN_CLASSES_FOR_POOL = 200
+
+
+def _FormatClassName(name):
+  return name.replace('/', '.')
+
+
+def _FormatModifiers(access_flags, modifiers):
+  return [name for flag, name in modifiers if access_flags & flag]
+
+
+def _ParseType(descriptor, offset):
+  """Returns the Java type at |offset| of |descriptor|, and the next offset."""
+  start = offset
+  while descriptor[offset] == '[':
+    offset += 1
+  dimensions = offset - start
+  if descriptor[offset] == 'L':
+    end = descriptor.index(';', offset)
+    java_type = _FormatClassName(descriptor[offset + 1:end])
+    offset = end + 1
+  else:
+    java_type = _PRIMITIVE_TYPES[descriptor[offset]]
+    offset += 1
+  return java_type + '[]' * dimensions, offset
+
+
+def _ParseMethodDescriptor(descriptor):
+  """Returns the parameter types and the return type of a method."""
+  param_types = []
+  offset = 1
+  while descriptor[offset] != ')':
+    param_type, offset = _ParseType(descriptor, offset)
+    param_types.append(param_type)
+  return_type, _ = _ParseType(descriptor, offset + 1)
+  return param_types, return_type
+
+
+def _FormatConstantValue(descriptor, value):
+  if descriptor == 'J':
+    return 'long {}l'.format(value)
+  if descriptor == 'F':
+    return 'float {!r}f'.format(value)
+  if descriptor == 'D':
+    return 'double {!r}d'.format(value)
+  if descriptor == 'Ljava/lang/String;':
+    return 'String {}'.format(value)
+  # Booleans, bytes, chars and shorts are stored as ints.
+  return 'int {}'.format(value)
 
-def UpdateToc(jar_path, toc_path):
-  classes = GetClassesInZipFile(zipfile.ZipFile(jar_path))
-  toc = ''
-  if len(classes) != 0:
-    javap_output = CallJavap(classpath=jar_path, classes=classes)
-    toc = ExtractToc(javap_output)
 
-  with open(toc_path, 'w') as tocfile:
-    tocfile.write(toc)
+def _FormatField(field):
+  line = _FormatModifiers(field.access_flags, _FIELD_MODIFIERS)
+  line.append(_ParseType(field.descriptor, 0)[0])
+  ret = [' '.join(line) + ' ' + field.name + ';']
+  if field.signature:
+    ret.append('  Signature: ' + field.signature)
+  if field.constant_value is not None:
+    ret.append('  Constant value: ' +
+               _FormatConstantValue(field.descriptor, field.constant_value))
+  return ret
+
+
+def _FormatMethod(class_name, method):
+  if method.name == '<clinit>':
+    return ['static {};']
+  line = _FormatModifiers(method.access_flags, _METHOD_MODIFIERS)
+  param_types, return_type = _ParseMethodDescriptor(method.descriptor)
+  if method.access_flags & _ACC_VARARGS and param_types:
+    param_types[-1] = param_types[-1][:-2] + '...'
+  if method.name == '<init>':
+    line.append(class_name)
+  else:
+    line.extend((return_type, method.name))
+  signature = ' '.join(line) + '(' + ', '.join(param_types) + ')'
+  if method.exceptions:
+    signature += ' throws ' + ', '.join(
+        _FormatClassName(e) for e in method.exceptions)
+  ret = [signature + ';']
+  if method.signature:
+    ret.append('  Signature: ' + method.signature)
+  return ret
+
+
+def ExtractClassToc(class_data):
+  """Returns the TOC of the contents of a .class file.
+
+  This has the same information as the javap -package -verbose output that
+  TOCs used to be filtered from: the class and the signatures of its
+  non-private members, constant values, the source file and the class file
+  version.
+  """
+  class_file = class_file_utils.ParseClassFile(class_data)
+  class_name = _FormatClassName(class_file.name)
+  is_interface = class_file.access_flags & _ACC_INTERFACE
+  line = _FormatModifiers(class_file.access_flags, _CLASS_MODIFIERS)
+  if is_interface:
+    # Interfaces are always abstract.
+    line = [m for m in line if m != 'abstract']
+    line.extend(('interface', class_name))
+    if class_file.interfaces:
+      line.append('extends ' + ', '.join(
+          _FormatClassName(i) for i in class_file.interfaces))
+  else:
+    line.extend(('class', class_name))
+    if class_file.super_name and class_file.super_name != 'java/lang/Object':
+      line.append('extends ' + _FormatClassName(class_file.super_name))
+    if class_file.interfaces:
+      line.append('implements ' + ', '.join(
+          _FormatClassName(i) for i in class_file.interfaces))
+
+  toc = []
+  if class_file.source_file:
+    toc.append('Compiled from "{}"'.format(class_file.source_file))
+  toc.append(' '.join(line))
+  if class_file.signature:
+    toc.append('  Signature: ' + class_file.signature)
+  toc.append('  minor version: {}'.format(class_file.minor_version))
+  toc.append('  major version: {}'.format(class_file.major_version))
+  toc.append('{')
+  for field in class_file.fields:
+    if not field.access_flags & class_file_utils.ACC_PRIVATE:
+      toc.extend(_FormatField(field))
+  for method in class_file.methods:
+    if not method.access_flags & class_file_utils.ACC_PRIVATE:
+      toc.extend(_FormatMethod(class_name, method))
+  toc.append('}')
+  return '\n'.join(toc) + '\n'
+
+
+def _IterClassTocs(jar_path):
+  """Yields the TOCs of the classes in |jar_path|, in the order of the jar.
+
+  Class files are read straight from the jar, and parsed in parallel for
+  large jars.
+  """
+  with zipfile.ZipFile(jar_path) as zip_file:
+    infos = [i for i in zip_file.infolist() if i.filename.endswith('.class')]
+    class_datas = (zip_file.read(i) for i in infos)
+    if (len(infos) < _MIN_CLASSES_FOR_POOL or
+        multiprocessing.cpu_count() <= 1):
+      for class_data in class_datas:
+        yield ExtractClassToc(class_data)
+      return
+    pool = multiprocessing.Pool()
+    try:
+      for toc in pool.imap(ExtractClassToc, class_datas, chunksize=50):
+        yield toc
+    finally:
+      pool.terminate()
+
+
+def UpdateToc(jar_path, toc_path):
+  with open(toc_path, 'w', encoding='utf-8',
+            errors='surrogatepass') as tocfile:
+    for toc in _IterClassTocs(jar_path):
+      tocfile.write(toc)
 
 
 def DoJarToc(options):
@@ -90,6 +243,7 @@ def DoJarToc(options):
       lambda: UpdateToc(jar_path, toc_path),
       record_path=record_path,
       input_paths=[jar_path],
+      input_strings=[_TOC_VERSION],
       force=not os.path.exists(toc_path),
       )
   build_utils.Touch(toc_path, fail_if_missing=True)
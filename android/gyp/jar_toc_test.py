@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import jar_toc
+from util.class_file_utils_test import _ClassFileBuilder
+
+
+def _ConstantValue(b, index):
+  return b.Attribute('ConstantValue', struct.pack('>H', index))
+
+
+def _Signature(b, signature):
+  return b.Attribute('Signature', struct.pack('>H', b.Utf8(signature)))
+
+
+def _Code(b, size=12):
+  return b.Attribute('Code', b'\x00' * size)
+
+
+def _BuildClass(int_value=-5, run_access=0x1, code_size=12):
+  b = _ClassFileBuilder()
+  fields = [
+      b.Member(0x19, 'INT', 'I', [_ConstantValue(b, b.Integer(int_value))]),
+      b.Member(0x19, 'LONG', 'J', [_ConstantValue(b, b.Long(2**40))]),
+      b.Member(0x19, 'FLOAT', 'F', [_ConstantValue(b, b.Float(1.5))]),
+      b.Member(0x19, 'DOUBLE', 'D', [_ConstantValue(b, b.Double(0.25))]),
+      b.Member(0x1c, 'STR', 'Ljava/lang/String;',
+               [_ConstantValue(b, b.String('a b'))]),
+      b.Member(0x2, 'mPrivate', 'I'),
+      b.Member(0x0, 'mList', 'Ljava/util/List;',
+               [_Signature(b, 'Ljava/util/List<TT;>;')]),
+  ]
+  methods = [
+      b.Member(0x8, '<clinit>', '()V', [_Code(b)]),
+      b.Member(0x1, '<init>', '(I)V', [_Code(b)]),
+      b.Member(0x81, 'format',
+               '(Ljava/lang/String;[Ljava/lang/Object;)Ljava/lang/String;',
+               [_Code(b)]),
+      b.Member(run_access, 'run', '()V', [
+          _Code(b, code_size),
+          b.Attribute('Exceptions', struct.pack(
+              '>HH', 1, b.Class('java/io/IOException'))),
+      ]),
+      b.Member(0x1, 'get', '([[I)Ljava/lang/Object;',
+               [_Code(b), _Signature(b, '<U:Ljava/lang/Object;>([[I)TU;')]),
+      b.Member(0x124, 'nat', '(ZC)J'),
+      b.Member(0x2, 'secret', '()V', [_Code(b)]),
+  ]
+  return b.Build(
+      0x21, 'org/a/Foo', 'org/a/Base', ['java/lang/Runnable'], fields, methods,
+      [b.Attribute('SourceFile', struct.pack('>H', b.Utf8('Foo.java'))),
+       _Signature(b, '<T:Ljava/lang/Object;>Lorg/a/Base;Ljava/lang/Runnable;')])
+
+
+def _BuildInterface():
+  b = _ClassFileBuilder()
+  methods = [b.Member(0x401, 'close', '()V')]
+  return b.Build(0x601, 'org/a/Iface', 'java/lang/Object',
+                 ['java/io/Closeable'], [], methods, [])
+
+
+class JarTocTest(unittest.TestCase):
+
+  def testExtractClassToc(self):
+    self.assertEqual('\n'.join([
+        'Compiled from "Foo.java"',
+        'public class org.a.Foo extends org.a.Base '
+        'implements java.lang.Runnable',
+        '  Signature: <T:Ljava/lang/Object;>Lorg/a/Base;Ljava/lang/Runnable;',
+        '  minor version: 0',
+        '  major version: 52',
+        '{',
+        'public static final int INT;',
+        '  Constant value: int -5',
+        'public static final long LONG;',
+        '  Constant value: long 1099511627776l',
+        'public static final float FLOAT;',
+        '  Constant value: float 1.5f',
+        'public static final double DOUBLE;',
+        '  Constant value: double 0.25d',
+        'protected static final java.lang.String STR;',
+        '  Constant value: String a b',
+        'java.util.List mList;',
+        '  Signature: Ljava/util/List<TT;>;',
+        'static {};',
+        'public org.a.Foo(int);',
+        'public java.lang.String format(java.lang.String, '
+        'java.lang.Object...);',
+        'public void run() throws java.io.IOException;',
+        'public java.lang.Object get(int[][]);',
+        '  Signature: <U:Ljava/lang/Object;>([[I)TU;',
+        'protected synchronized native long nat(boolean, char);',
+        '}',
+    ]) + '\n', jar_toc.ExtractClassToc(_BuildClass()))
+
+  def testExtractClassTocOfInterface(self):
+    self.assertEqual('\n'.join([
+        'public interface org.a.Iface extends java.io.Closeable',
+        '  minor version: 0',
+        '  major version: 52',
+        '{',
+        'public abstract void close();',
+        '}',
+    ]) + '\n', jar_toc.ExtractClassToc(_BuildInterface()))
+
+  def testTocChangesOnlyWithApi(self):
+    toc = jar_toc.ExtractClassToc(_BuildClass())
+    # Method bodies are not part of the API.
+    self.assertEqual(toc, jar_toc.ExtractClassToc(_BuildClass(code_size=20)))
+    self.assertNotEqual(toc, jar_toc.ExtractClassToc(_BuildClass(int_value=6)))
+    self.assertNotEqual(toc,
+                        jar_toc.ExtractClassToc(_BuildClass(run_access=0x4)))
+    private_toc = jar_toc.ExtractClassToc(_BuildClass(run_access=0x2))
+    self.assertNotIn(' run()', private_toc)
+
+  def testUpdateToc(self):
+    temp_dir = tempfile.mkdtemp()
+    try:
+      jar_path = os.path.join(temp_dir, 'a.jar')
+      with zipfile.ZipFile(jar_path, 'w') as z:
+        z.writestr('org/a/Iface.class', _BuildInterface())
+        z.writestr('org/a/res.txt', 'not a class')
+        z.writestr('org/a/Foo.class', _BuildClass())
+      toc_path = os.path.join(temp_dir, 'a.jar.TOC')
+      jar_toc.UpdateToc(jar_path, toc_path)
+      with open(toc_path) as f:
+        self.assertEqual(
+            jar_toc.ExtractClassToc(_BuildInterface()) +
+            jar_toc.ExtractClassToc(_BuildClass()), f.read())
+    finally:
+      shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+  unittest.main()
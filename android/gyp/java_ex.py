@@ -4,8 +4,11 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import collections
 import distutils.spawn
+import hashlib
 import itertools
+import json
 import logging
 import multiprocessing
 import optparse
@@ -16,6 +19,7 @@ import sys
 import zipfile
 
 from util import build_utils
+from util import class_file_utils
 from util import md5_check
 from util import jar_info_utils
 
@@ -26,6 +30,13 @@ sys.path.insert(
     os.path.join(build_utils.DIR_SOURCE_ROOT, 'third_party', 'colorama', 'src'))
 import colorama
 
+# To only recompile the sources that changed and the sources that depend on
+# them, set the environment variable:
+#     ANDROID_JAVAC_INCREMENTAL=1
+_INCREMENTAL = os.environ.get('ANDROID_JAVAC_INCREMENTAL') == '1'
+
+# Bump when the format of _IncrementalState files changes.
+_INCREMENTAL_STATE_VERSION = 1
 
 ERRORPRONE_WARNINGS_TO_TURN_OFF = [
   # TODO(crbug.com/834807): Follow steps in bug
@@ -159,28 +170,225 @@ def ProcessJavacOutput(output):
   return '\n'.join(map(ApplyColors, list(filter(ApplyFilters, output.decode().split('\n')))))
 
 
-def _ExtractClassFiles(jar_path, dest_dir, java_files):
-  """Extracts all .class files not corresponding to |java_files|."""
-  # Two challenges exist here:
-  # 1. |java_files| have prefixes that are not represented in the the jar paths.
-  # 2. A single .java file results in multiple .class files when it contains
-  #    nested classes.
-  # Here's an example:
-  #   source path: ../../base/android/java/src/org/chromium/Foo.java
-  #   jar paths: org/chromium/Foo.class, org/chromium/Foo$Inner.class
-  # To extract only .class files not related to the given .java files, we strip
-  # off ".class" and "$*.class" and use a substring match against java_files.
+def _ExtractClassFiles(jar_path, dest_dir, excluded_classes):
+  """Extracts all .class files except for those of |excluded_classes|."""
   def extract_predicate(path):
-    if not path.endswith('.class'):
-      return False
-    path_without_suffix = re.sub(r'(?:\$|\.)[^/]*class$', '', path)
-    partial_java_path = path_without_suffix + '.java'
-    return not any(p.endswith(partial_java_path) for p in java_files)
+    return path.endswith('.class') and path[:-6] not in excluded_classes
 
   logging.info('Extracting class files from %s', jar_path)
   build_utils.ExtractAll(jar_path, path=dest_dir, predicate=extract_predicate)
-  for path in build_utils.FindInDirectory(dest_dir, '*.class'):
-    shutil.copystat(jar_path, path)
+
+
+# |refs| are the other classes of the same jar that a class refers to.
+# |constants| maps the names of non-private constant fields (which javac
+# inlines into the classes that use them) to their descriptor and value.
+_ClassDeps = collections.namedtuple(
+    '_ClassDeps', 'supers refs constants source_file')
+
+
+class _IncrementalState(object):
+  """The classes of the previous compile, and the classes they depend on.
+
+  The state is stored under a key for all inputs other than the sources (javac,
+  its flags and the classpath), along with the size and mtime of the jar that
+  it describes. While both are unchanged, only the sources whose digest changed
+  are recompiled, along with the sources whose classes refer to the classes of
+  changed or removed sources (or to their subclasses, which inherit their
+  members). Classes of the other sources are taken from the previous jar.
+
+  A full compile is still needed when sources or top-level classes are added,
+  since they can change what names in other sources refer to, and when
+  constants change, since javac inlines them into the classes that use them.
+
+  Args:
+    path: Path of the file that stores the state.
+    config_key: The key described above.
+  """
+
+  def __init__(self, path, config_key):
+    self._path = path
+    self._config_key = config_key
+    # Map of source path -> digest.
+    self.source_digests = {}
+    # Map of source path -> names of the classes compiled from it (e.g.
+    # "org/chromium/Foo$Bar").
+    self.source_classes = {}
+    # Map of class name -> _ClassDeps.
+    self.classes = {}
+
+  def Load(self, jar_path):
+    """Loads the previous compile's state. Returns whether it can be used."""
+    try:
+      with open(self._path) as f:
+        data = json.load(f)
+    except (IOError, ValueError):
+      return False
+    if (data.get('version') != _INCREMENTAL_STATE_VERSION or
+        data.get('config_key') != self._config_key or
+        data.get('jar_stat') != _StatJar(jar_path)):
+      return False
+    self.source_digests = data['source_digests']
+    self.source_classes = data['source_classes']
+    self.classes = {
+        k: _ClassDeps(*v) for k, v in data['classes'].items()}
+    return True
+
+  def Delete(self):
+    if os.path.exists(self._path):
+      os.unlink(self._path)
+
+  def Write(self, jar_path):
+    data = {
+        'version': _INCREMENTAL_STATE_VERSION,
+        'config_key': self._config_key,
+        'jar_stat': _StatJar(jar_path),
+        'source_digests': self.source_digests,
+        'source_classes': self.source_classes,
+        'classes': self.classes,
+    }
+    with build_utils.AtomicOutput(self._path) as f:
+      f.write(json.dumps(data).encode('utf-8'))
+
+
+def _StatJar(jar_path):
+  try:
+    st = os.stat(jar_path)
+  except OSError:
+    return None
+  return [st.st_size, st.st_mtime_ns]
+
+
+def _ComputeConfigKey(changes, sources, srcjars):
+  """Returns a digest of all inputs except for |sources| and |srcjars|."""
+  md5 = hashlib.md5(changes.new_metadata.StringsMd5().encode())
+  excluded_paths = set(sources)
+  excluded_paths.update(srcjars)
+  for path in sorted(changes.new_metadata.IterPaths()):
+    if path not in excluded_paths:
+      md5.update('\n{}\n{}'.format(path, changes.new_metadata.GetTag(path))
+                 .encode())
+  return md5.hexdigest()
+
+
+def _ReadClassDeps(path):
+  with open(path, 'rb') as f:
+    class_file = class_file_utils.ParseClassFile(f.read())
+  supers = class_file.interfaces[:]
+  if class_file.super_name:
+    supers.append(class_file.super_name)
+  constants = {}
+  for field in class_file.fields:
+    if (field.constant_value is not None and
+        not field.access_flags & class_file_utils.ACC_PRIVATE):
+      constants[field.name] = [field.descriptor, repr(field.constant_value)]
+  deps = _ClassDeps(supers, sorted(class_file.referenced_classes), constants,
+                    class_file.source_file)
+  return class_file.name, deps
+
+
+def _ReadAllClassDeps(class_paths):
+  """Returns a dict of class name -> _ClassDeps for the given .class files."""
+  if len(class_paths) < 100:
+    return dict(_ReadClassDeps(p) for p in class_paths)
+  pool = multiprocessing.Pool()
+  try:
+    return dict(pool.imap_unordered(_ReadClassDeps, class_paths, chunksize=50))
+  finally:
+    pool.close()
+    pool.join()
+
+
+def _GetSourcesToCompile(sources, source_digests, state):
+  """Returns the sources whose classes may be out of date in |state|.
+
+  Returns None when all sources need to be compiled.
+  """
+  if any(s not in state.source_digests for s in sources):
+    return None
+  changed = [s for s in sources
+             if state.source_digests[s] != source_digests[s]]
+  removed = [s for s in state.source_digests if s not in source_digests]
+
+  subclasses = collections.defaultdict(list)
+  for name, deps in state.classes.items():
+    for super_name in deps.supers:
+      subclasses[super_name].append(name)
+  changed_classes = set()
+  queue = [c for s in changed + removed
+           for c in state.source_classes.get(s, ())]
+  while queue:
+    name = queue.pop()
+    if name not in changed_classes:
+      changed_classes.add(name)
+      queue.extend(subclasses.get(name, ()))
+
+  ret = set(changed)
+  for source in sources:
+    if source not in ret:
+      for name in state.source_classes.get(source, ()):
+        if name in changed_classes or any(
+            r in changed_classes for r in state.classes[name].refs):
+          ret.add(source)
+          break
+  return sorted(ret)
+
+
+def _CheckIncrementalCompile(old_classes, new_classes):
+  """Returns whether recompiled classes require a full compile.
+
+  Args:
+    old_classes: Map of class name -> _ClassDeps of the classes that were
+        deleted or recompiled.
+    new_classes: Map of class name -> _ClassDeps of the recompiled classes.
+  """
+  for name in new_classes:
+    # New top-level classes may hide classes that other sources refer to.
+    if name not in old_classes and '$' not in name.rsplit('/', 1)[-1]:
+      logging.info('Full compile needed: %s was added', name)
+      return False
+  for name, deps in old_classes.items():
+    # Constants are inlined, so the classes that use them do not refer to the
+    # classes that declare them.
+    new_deps = new_classes.get(name)
+    if deps.constants and (not new_deps or
+                           new_deps.constants != deps.constants):
+      logging.info('Full compile needed: constants of %s changed', name)
+      return False
+  return True
+
+
+def _FindClassSources(class_deps, info_data, java_files):
+  """Returns a dict of source path -> names of the classes compiled from it.
+
+  Returns None if the source of a class is unknown.
+
+  Args:
+    class_deps: Map of class name -> _ClassDeps.
+    info_data: The .jar.info mapping of fully qualified top-level class names
+        to the sources they are defined in.
+    java_files: All sources.
+  """
+  # Classes that the .jar.info does not list (e.g. package-info) are matched
+  # to the source named by their SourceFile attribute.
+  sources_by_name = collections.defaultdict(list)
+  for path in java_files:
+    sources_by_name[os.path.basename(path)].append(path)
+
+  ret = collections.defaultdict(list)
+  for name, deps in class_deps.items():
+    top_level_name = name.split('$', 1)[0]
+    source = info_data.get(top_level_name.replace('/', '.'))
+    if not source and deps.source_file:
+      suffix = os.path.join(os.path.dirname(top_level_name), deps.source_file)
+      candidates = [p for p in sources_by_name.get(deps.source_file, [])
+                    if p.endswith(suffix)]
+      if len(candidates) == 1:
+        source = candidates[0]
+    if not source:
+      logging.info('Unknown source for class %s', name)
+      return None
+    ret[source].append(name)
+  return ret
 
 
 def _ParsePackageAndClassNames(java_file):
@@ -251,6 +459,9 @@ def _CreateInfoFile(java_files, jar_path, chromium_code, srcjar_files,
 
   This maps fully qualified names for classes to either the java file that they
   are defined in or the path of the srcjar that they came from.
+
+  Returns:
+    The mapping, with the extracted paths of sources that came from srcjars.
   """
   output_path = jar_path + '.info'
   logging.info('Start creating info file: %s', output_path)
@@ -274,6 +485,7 @@ def _CreateInfoFile(java_files, jar_path, chromium_code, srcjar_files,
   with build_utils.AtomicOutput(output_path) as f:
     jar_info_utils.WriteJarInfoFile(f, all_info_data, srcjar_files)
   logging.info('Completed info file: %s', output_path)
+  return all_info_data
 
 
 def _CreateJarFile(jar_path, provider_configurations, additional_jar_files,
@@ -291,7 +503,102 @@ def _CreateJarFile(jar_path, provider_configurations, additional_jar_files,
   logging.info('Completed jar file: %s', jar_path)
 
 
-def _OnStaleMd5(options, javac_cmd, java_files, classpath):
+def _RunCompiler(options, javac_cmd, java_files, classpath, classes_dir,
+                 temp_dir):
+  # Don't include the output directory in the initial set of args since it
+  # being in a temp dir makes it unstable (breaks md5 stamping).
+  cmd = javac_cmd + ['-d', classes_dir]
+  classpath = list(classpath)
+
+  uses_kotlin = any([f.endswith(".kt") for f in java_files])
+
+  # Pass classpath and source paths as response files to avoid extremely
+  # long command lines that are tedius to debug.
+  if classpath:
+    if uses_kotlin:
+      # Add the generated classes to the class path, so that the Java
+      # compiler can pick up generated Kotlin classes.
+      classpath.append(classes_dir)
+
+    cmd += ['-classpath', ':'.join(classpath)]
+
+  if uses_kotlin:
+    # The Kotlin Compiler accepts Java files (and uses them to resolve
+    # dependencies).
+    kotlin_files = java_files
+
+    # The Java Compiler on the other hand doesn't like Kotlin files.
+    java_files = [f for f in java_files if not f.endswith(".kt")]
+
+    kotlin_cmd = [options.kotlinc_path, '-d', classes_dir]
+    kotlin_cmd.extend(kotlin_files)
+
+    classpath += options.bootclasspath
+    kotlin_cmd += ['-classpath', ':'.join(classpath)]
+
+    logging.debug('Kotlin build command %s', kotlin_cmd)
+    build_utils.CheckOutput(
+        kotlin_cmd,
+        print_stdout=options.chromium_code,
+        stderr_filter=ProcessJavacOutput)
+    logging.info('Finished kotlin build command')
+
+
+  java_files_rsp_path = os.path.join(temp_dir, 'files_list.txt')
+  with open(java_files_rsp_path, 'w') as f:
+    f.write(' '.join(java_files))
+  cmd += ['@' + java_files_rsp_path]
+
+  logging.debug('Build command %s', cmd)
+  build_utils.CheckOutput(
+      cmd,
+      print_stdout=options.chromium_code,
+      stderr_filter=ProcessJavacOutput)
+  logging.info('Finished build command')
+
+
+def _CompileIncrementally(options, javac_cmd, sources, classpath, classes_dir,
+                          temp_dir, state, replaced_classes):
+  """Compiles |sources| against the classes of the previous jar.
+
+  Args:
+    replaced_classes: Classes of |state| that |sources| replace, or whose
+        sources were removed.
+
+  Returns:
+    A dict of class name -> _ClassDeps for the compiled classes, or None if
+    the result would differ from a full compile.
+  """
+  kept_classes = set(state.classes).difference(replaced_classes)
+  _ExtractClassFiles(options.jar_path, classes_dir, replaced_classes)
+
+  compiled_dir = os.path.join(temp_dir, 'compiled')
+  os.makedirs(compiled_dir)
+  if sources:
+    _RunCompiler(options, javac_cmd, sources, classpath + [classes_dir],
+                 compiled_dir, temp_dir)
+  compiled_paths = build_utils.FindInDirectory(compiled_dir, '*')
+  compiled_classes = _ReadAllClassDeps(
+      [p for p in compiled_paths if p.endswith('.class')])
+  duplicate_classes = kept_classes.intersection(compiled_classes)
+  if duplicate_classes:
+    # A full compile would fail.
+    logging.info('Full compile needed: %s defined twice',
+                 next(iter(duplicate_classes)))
+    return None
+  old_classes = {c: state.classes[c] for c in replaced_classes}
+  if not _CheckIncrementalCompile(old_classes, compiled_classes):
+    return None
+
+  for src_path in compiled_paths:
+    dst_path = os.path.join(classes_dir,
+                            os.path.relpath(src_path, compiled_dir))
+    build_utils.MakeDirectory(os.path.dirname(dst_path))
+    shutil.move(src_path, dst_path)
+  return compiled_classes
+
+
+def _OnStaleMd5(changes, options, javac_cmd, java_files, classpath):
   logging.info('Starting _OnStaleMd5')
 
   # Compiles with Error Prone take twice as long to run as pure javac. Thus GN
@@ -309,75 +616,69 @@ def _OnStaleMd5(options, javac_cmd, java_files, classpath):
     else:
       generated_java_dir = os.path.join(temp_dir, 'gen')
 
-    shutil.rmtree(generated_java_dir, True)
-
+    # Map of source path -> digest. Only computed in incremental mode, where
+    # |changes| is passed.
+    source_digests = None
+    if changes:
+      source_digests = {p: changes.new_metadata.GetTag(p) for p in java_files}
     srcjar_files = {}
     if srcjars:
+      # Files that are unchanged since the previous build are left alone, so
+      # that their mtimes stay stable for tools that look at generated_dir.
       logging.info('Extracting srcjars to %s', generated_java_dir)
-      build_utils.MakeDirectory(generated_java_dir)
       jar_srcs = []
-      for srcjar in options.java_srcjars:
-        extracted_files = build_utils.ExtractAll(
-            srcjar, no_clobber=True, path=generated_java_dir, pattern='*.java')
+      all_extracted_files = build_utils.ExtractAllIncrementally(
+          srcjars, generated_java_dir, pattern='*.java')
+      for srcjar, extracted_files in zip(srcjars, all_extracted_files):
         for path in extracted_files:
+          subpath = os.path.relpath(path, generated_java_dir)
           # We want the path inside the srcjar so the viewer can have a tree
           # structure.
-          srcjar_files[path] = '{}/{}'.format(
-              srcjar, os.path.relpath(path, generated_java_dir))
+          srcjar_files[path] = '{}/{}'.format(srcjar, subpath)
+          if changes:
+            source_digests[path] = changes.new_metadata.GetTag(srcjar, subpath)
         jar_srcs.extend(extracted_files)
       logging.info('Done extracting srcjars')
       java_files.extend(jar_srcs)
-
-    if java_files:
-      # Don't include the output directory in the initial set of args since it
-      # being in a temp dir makes it unstable (breaks md5 stamping).
-      cmd = javac_cmd + ['-d', classes_dir]
-
-      uses_kotlin = any([f.endswith(".kt") for f in java_files])
-
-      # Pass classpath and source paths as response files to avoid extremely
-      # long command lines that are tedius to debug.
-      if classpath:
-        if uses_kotlin:
-          # Add the generated classes to the class path, so that the Java
-          # compiler can pick up generated Kotlin classes.
-          classpath.append(classes_dir)
-
-        cmd += ['-classpath', ':'.join(classpath)]
-
-      if uses_kotlin:
-        # The Kotlin Compiler accepts Java files (and uses them to resolve
-        # dependencies).
-        kotlin_files = java_files
-
-        # The Java Compiler on the other hand doesn't like Kotlin files.
-        java_files = [f for f in java_files if not f.endswith(".kt")]
-
-        kotlin_cmd = [options.kotlinc_path, '-d', classes_dir]
-        kotlin_cmd.extend(kotlin_files)
-
-        classpath += options.bootclasspath
-        kotlin_cmd += ['-classpath', ':'.join(classpath)]
-
-        logging.debug('Kotlin build command %s', kotlin_cmd)
-        build_utils.CheckOutput(
-            kotlin_cmd,
-            print_stdout=options.chromium_code,
-            stderr_filter=ProcessJavacOutput)
-        logging.info('Finished kotlin build command')
-
-
-      java_files_rsp_path = os.path.join(temp_dir, 'files_list.txt')
-      with open(java_files_rsp_path, 'w') as f:
-        f.write(' '.join(java_files))
-      cmd += ['@' + java_files_rsp_path]
-
-      logging.debug('Build command %s', cmd)
-      build_utils.CheckOutput(
-          cmd,
-          print_stdout=options.chromium_code,
-          stderr_filter=ProcessJavacOutput)
-      logging.info('Finished build command')
+    else:
+      shutil.rmtree(generated_java_dir, True)
+
+    uses_kotlin = any(f.endswith('.kt') for f in java_files)
+    incremental_state = None
+    # Map of class name -> _ClassDeps of the classes that were compiled, or
+    # None after a full compile.
+    compiled_classes = None
+    if (changes and save_outputs and not options.processors and
+        not uses_kotlin):
+      incremental_state = _IncrementalState(
+          options.jar_path + '.incremental.json',
+          _ComputeConfigKey(changes, java_files, srcjars))
+      if incremental_state.Load(options.jar_path):
+        sources = _GetSourcesToCompile(java_files, source_digests,
+                                       incremental_state)
+        if sources is not None:
+          logging.info('Compiling %d of %d sources incrementally',
+                       len(sources), len(java_files))
+          stale_sources = set(sources).union(
+              s for s in incremental_state.source_digests
+              if s not in source_digests)
+          replaced_classes = set(
+              c for s in stale_sources
+              for c in incremental_state.source_classes.get(s, ()))
+          compiled_classes = _CompileIncrementally(
+              options, javac_cmd, sources, classpath, classes_dir, temp_dir,
+              incremental_state, replaced_classes)
+          if compiled_classes is None:
+            shutil.rmtree(classes_dir)
+            os.makedirs(classes_dir)
+      # Out of date until the new state is written.
+      incremental_state.Delete()
+
+    if compiled_classes is None and java_files:
+      _RunCompiler(options, javac_cmd, java_files, classpath, classes_dir,
+                   temp_dir)
+    # Kotlin sources are not listed in the .jar.info.
+    java_files = [f for f in java_files if not f.endswith('.kt')]
 
     if save_outputs:
       # Creating the jar file takes the longest, start it first on a separate
@@ -392,13 +693,35 @@ def _OnStaleMd5(options, javac_cmd, java_files, classpath):
       build_utils.Touch(options.jar_path)
 
     if save_outputs:
-      _CreateInfoFile(java_files, options.jar_path, options.chromium_code,
-                      srcjar_files, classes_dir, generated_java_dir)
+      info_data = _CreateInfoFile(java_files, options.jar_path,
+                                  options.chromium_code, srcjar_files,
+                                  classes_dir, generated_java_dir)
     else:
       build_utils.Touch(options.jar_path + '.info')
 
+    if incremental_state:
+      if compiled_classes is None:
+        class_deps = _ReadAllClassDeps(
+            build_utils.FindInDirectory(classes_dir, '*.class'))
+      else:
+        class_deps = {c: d for c, d in incremental_state.classes.items()
+                      if c not in replaced_classes}
+        class_deps.update(compiled_classes)
+      source_classes = _FindClassSources(class_deps, info_data, java_files)
+    else:
+      source_classes = None
+
     if jar_file_worker:
       jar_file_worker.join()
+
+    if source_classes is not None:
+      # Only dependencies between the classes of this jar are tracked.
+      incremental_state.classes = {
+          c: d._replace(refs=[r for r in d.refs if r in class_deps])
+          for c, d in class_deps.items()}
+      incremental_state.source_digests = source_digests
+      incremental_state.source_classes = source_classes
+      incremental_state.Write(options.jar_path)
     logging.info('Completed all steps in _OnStaleMd5')
 
 
@@ -612,13 +935,16 @@ def main(argv):
 
   # List python deps in input_strings rather than input_paths since the contents
   # of them does not change what gets written to the depsfile.
+  # Per-file digests are only recorded when incremental compiles need them.
   build_utils.CallAndWriteDepfileIfStale(
-      lambda: _OnStaleMd5(options, javac_cmd, java_files, classpath),
+      lambda changes=None: _OnStaleMd5(changes, options, javac_cmd,
+                                       java_files, classpath),
       options,
       depfile_deps=depfile_deps,
       input_paths=input_paths,
       input_strings=javac_cmd + classpath,
       output_paths=output_paths,
+      pass_changes=_INCREMENTAL,
       add_pydeps=False)
   logging.info('Script complete: %s', __file__)
 
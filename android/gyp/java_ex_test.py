@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import collections
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import java_ex
+from util import md5_check
+from util.class_file_utils_test import _ClassFileBuilder
+
+_Changes = collections.namedtuple('_Changes', 'new_metadata')
+
+
+def _Deps(supers=(), refs=(), constants=None, source_file=None):
+  return java_ex._ClassDeps(list(supers), list(refs), constants or {},
+                            source_file)
+
+
+def _BuildClass(name, constant=None):
+  b = _ClassFileBuilder()
+  fields = []
+  if constant is not None:
+    fields.append(b.Member(0x19, 'X', 'I', [b.Attribute(
+        'ConstantValue', struct.pack('>H', b.Integer(constant)))]))
+  return b.Build(0x21, name, 'java/lang/Object', [], fields, [], [])
+
+
+def _NewState():
+  """Returns the state of a compile of the sources below.
+
+  A.java: org/A, with a constant.
+  B.java: org/B, which refers to org/A.
+  C.java: org/C extends org/A, and its nested class org/C$Inner.
+  D.java: org/D.
+  E.java: org/E, which refers to org/C.
+  F.java: org/F, which refers to org/D.
+  """
+  state = java_ex._IncrementalState('unused', 'key')
+  state.source_digests = {'%s.java' % n: n.lower() for n in 'ABCDEF'}
+  state.source_classes = {
+      'A.java': ['org/A'],
+      'B.java': ['org/B'],
+      'C.java': ['org/C', 'org/C$Inner'],
+      'D.java': ['org/D'],
+      'E.java': ['org/E'],
+      'F.java': ['org/F'],
+  }
+  state.classes = {
+      'org/A': _Deps(constants={'X': ['I', '1']}),
+      'org/B': _Deps(refs=['org/A']),
+      'org/C': _Deps(supers=['org/A']),
+      'org/C$Inner': _Deps(refs=['org/C']),
+      'org/D': _Deps(),
+      'org/E': _Deps(refs=['org/C']),
+      'org/F': _Deps(refs=['org/D']),
+  }
+  return state
+
+
+class JavaExTest(unittest.TestCase):
+
+  def _GetSourcesToCompile(self, source_digests):
+    return java_ex._GetSourcesToCompile(sorted(source_digests), source_digests,
+                                        _NewState())
+
+  def testGetSourcesToCompileUnchanged(self):
+    self.assertEqual([], self._GetSourcesToCompile(_NewState().source_digests))
+
+  def testGetSourcesToCompileChangedSource(self):
+    source_digests = _NewState().source_digests
+    source_digests['E.java'] = 'e2'
+    self.assertEqual(['E.java'], self._GetSourcesToCompile(source_digests))
+
+  def testGetSourcesToCompileDependents(self):
+    source_digests = _NewState().source_digests
+    source_digests['A.java'] = 'a2'
+    # B refers to A, C extends A, and E refers to C, which inherits from A.
+    self.assertEqual(['A.java', 'B.java', 'C.java', 'E.java'],
+                     self._GetSourcesToCompile(source_digests))
+
+  def testGetSourcesToCompileDeletedSource(self):
+    source_digests = _NewState().source_digests
+    del source_digests['D.java']
+    self.assertEqual(['F.java'], self._GetSourcesToCompile(source_digests))
+
+  def testGetSourcesToCompileAddedSource(self):
+    source_digests = _NewState().source_digests
+    source_digests['G.java'] = 'g'
+    self.assertIsNone(self._GetSourcesToCompile(source_digests))
+
+  def testCheckIncrementalCompile(self):
+    old_classes = {'org/A': _Deps(constants={'X': ['I', '1']}),
+                   'org/B': _Deps()}
+    self.assertTrue(java_ex._CheckIncrementalCompile(old_classes, old_classes))
+    # Nested classes cannot hide other classes.
+    self.assertTrue(java_ex._CheckIncrementalCompile(
+        old_classes, dict(old_classes, **{'org/B$1': _Deps()})))
+    self.assertFalse(java_ex._CheckIncrementalCompile(
+        old_classes, dict(old_classes, **{'org/G': _Deps()})))
+    # Constants are inlined into the classes that use them.
+    self.assertFalse(java_ex._CheckIncrementalCompile(
+        old_classes,
+        {'org/A': _Deps(constants={'X': ['I', '2']}), 'org/B': _Deps()}))
+    self.assertFalse(java_ex._CheckIncrementalCompile(
+        old_classes, {'org/B': _Deps()}))
+    self.assertTrue(java_ex._CheckIncrementalCompile(
+        {'org/B': _Deps()}, {}))
+
+  def testFindClassSources(self):
+    class_deps = {
+        'org/A': _Deps(source_file='A.java'),
+        'org/A$1': _Deps(source_file='A.java'),
+        'org/package-info': _Deps(source_file='package-info.java'),
+    }
+    info_data = {'org.A': 'src/org/A.java'}
+    java_files = ['src/org/A.java', 'src/org/package-info.java',
+                  'src/com/package-info.java']
+    self.assertEqual(
+        {'src/org/A.java': ['org/A', 'org/A$1'],
+         'src/org/package-info.java': ['org/package-info']},
+        {k: sorted(v) for k, v in java_ex._FindClassSources(
+            class_deps, info_data, java_files).items()})
+
+    class_deps['org/Unknown'] = _Deps()
+    self.assertIsNone(
+        java_ex._FindClassSources(class_deps, info_data, java_files))
+
+  def testConfigKeyChangeForcesFullCompile(self):
+
+    def config_key(classpath_tag, source_tag):
+      metadata = md5_check._Metadata()
+      metadata.AddStrings(['javac', '-g'])
+      metadata.AddFile('lib.interface.jar', classpath_tag)
+      metadata.AddFile('A.java', source_tag)
+      return java_ex._ComputeConfigKey(_Changes(metadata), ['A.java'], [])
+
+    # Sources are tracked separately.
+    self.assertEqual(config_key('1', 'a'), config_key('1', 'a2'))
+    self.assertNotEqual(config_key('1', 'a'), config_key('2', 'a'))
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+      jar_path = os.path.join(temp_dir, 'out.jar')
+      with open(jar_path, 'w') as f:
+        f.write('jar')
+      state_path = jar_path + '.incremental.json'
+      state = java_ex._IncrementalState(state_path, config_key('1', 'a'))
+      state.source_digests = _NewState().source_digests
+      state.Write(jar_path)
+
+      self.assertTrue(java_ex._IncrementalState(
+          state_path, config_key('1', 'a2')).Load(jar_path))
+      self.assertFalse(java_ex._IncrementalState(
+          state_path, config_key('2', 'a')).Load(jar_path))
+      # The jar was not written by the compile that wrote the state.
+      with open(jar_path, 'w') as f:
+        f.write('other jar')
+      self.assertFalse(java_ex._IncrementalState(
+          state_path, config_key('1', 'a')).Load(jar_path))
+    finally:
+      shutil.rmtree(temp_dir)
+
+  def testCompileIncrementallyFallsBack(self):
+    temp_dir = tempfile.mkdtemp()
+    old_run_compiler = java_ex._RunCompiler
+    try:
+      options = collections.namedtuple('Options', 'jar_path')(
+          os.path.join(temp_dir, 'out.jar'))
+      with zipfile.ZipFile(options.jar_path, 'w') as z:
+        z.writestr('org/A.class', _BuildClass('org/A', 1))
+        z.writestr('org/D.class', _BuildClass('org/D'))
+      compiled = {}
+
+      def run_compiler(_options, _javac_cmd, _java_files, _classpath,
+                       classes_dir, _temp_dir):
+        os.makedirs(os.path.join(classes_dir, 'org'))
+        for name, data in compiled.items():
+          with open(os.path.join(classes_dir, name + '.class'), 'wb') as f:
+            f.write(data)
+
+      java_ex._RunCompiler = run_compiler
+
+      def compile_incrementally(sources, replaced_classes):
+        step_dir = tempfile.mkdtemp(dir=temp_dir)
+        classes_dir = os.path.join(step_dir, 'classes')
+        os.makedirs(os.path.join(classes_dir, 'org'))
+        state = java_ex._IncrementalState('unused', 'key')
+        state.classes = {'org/A': _Deps(constants={'X': ['I', '1']}),
+                         'org/D': _Deps()}
+        result = java_ex._CompileIncrementally(
+            options, ['javac'], sources, [], classes_dir, step_dir, state,
+            replaced_classes)
+        return result, sorted(os.listdir(os.path.join(classes_dir, 'org')))
+
+      # Recompiling org/D keeps org/A from the previous jar.
+      compiled = {'org/D': _BuildClass('org/D')}
+      result, class_files = compile_incrementally(['D.java'], {'org/D'})
+      self.assertEqual(['org/D'], list(result))
+      self.assertEqual(['A.class', 'D.class'], class_files)
+
+      # A changed constant requires a full compile.
+      compiled = {'org/A': _BuildClass('org/A', 2)}
+      self.assertIsNone(compile_incrementally(['A.java'], {'org/A'})[0])
+
+      # So does a class that is also kept from the previous jar.
+      compiled = {'org/D': _BuildClass('org/D'), 'org/A': _BuildClass('org/A')}
+      self.assertIsNone(compile_incrementally(['D.java'], {'org/D'})[0])
+    finally:
+      java_ex._RunCompiler = old_run_compiler
+      shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+  unittest.main()
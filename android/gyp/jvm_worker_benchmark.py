@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Measures dex.py actions with and without JVM workers (see jvm_worker.py).
+
+Each input jar is dexed by its own dex.py process, as each target is in a build.
+The first round with workers includes starting them, so it is reported
+separately.
+
+Example:
+  android/gyp/jvm_worker_benchmark.py \
+      --d8-jar-path third_party/r8/lib/d8.jar \
+      out/Debug/lib.java/base/base_java.jar out/Debug/lib.java/...
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+_DEX_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dex.py')
+
+
+def _RunRound(jar_paths, d8_jar_path, output_dir, env):
+  """Returns the seconds taken to dex each of |jar_paths| separately."""
+  start = time.time()
+  for i, jar_path in enumerate(jar_paths):
+    output_path = os.path.join(output_dir, '%d.dex.jar' % i)
+    subprocess.check_call([
+        sys.executable, _DEX_PY, '--d8-jar-path', d8_jar_path, '--dex-path',
+        output_path, '--depfile', output_path + '.d', jar_path
+    ], env=env)
+  return time.time() - start
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--d8-jar-path', required=True)
+  parser.add_argument('--iterations', type=int, default=3)
+  parser.add_argument('jar_paths', nargs='+')
+  args = parser.parse_args(argv)
+
+  temp_dir = tempfile.mkdtemp()
+  try:
+    env = dict(os.environ)
+    env.pop('DEX_CACHE_DIR', None)
+    env.pop('ANDROID_JVM_WORKER_DIR', None)
+    worker_env = dict(env)
+    worker_env['ANDROID_JVM_WORKER_DIR'] = os.path.join(temp_dir, 'workers')
+    # Workers exit soon after the benchmark.
+    worker_env['ANDROID_JVM_WORKER_IDLE_SECS'] = '30'
+
+    print('Dexing %d jars as separate actions:' % len(args.jar_paths))
+    first_round = _RunRound(args.jar_paths, args.d8_jar_path, temp_dir,
+                            worker_env)
+    print('  %-20s %8.3fs' % ('worker (first)', first_round))
+    for name, mode_env in (('subprocess', env), ('worker', worker_env)):
+      elapsed = sum(
+          _RunRound(args.jar_paths, args.d8_jar_path, temp_dir, mode_env)
+          for _ in range(args.iterations)) / args.iterations
+      print('  %-20s %8.3fs' % (name, elapsed))
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
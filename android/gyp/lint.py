@@ -8,6 +8,9 @@
 
 
 import argparse
+import collections
+import hashlib
+import json
 import os
 import re
 import sys
@@ -18,8 +21,191 @@ from util import build_utils
 
 _LINT_MD_URL = 'https://chromium.googlesource.com/chromium/src/+/master/build/android/docs/lint.md' # pylint: disable=line-too-long
 
-
-def _OnStaleMd5(lint_path, config_path, processed_config_path,
+# Set to 1 to only lint the sources that changed since the previous run (and
+# the sources that refer to them), and to reuse the issues previously found in
+# the other ones. See _IncrementalState.
+_INCREMENTAL = os.environ.get('ANDROID_LINT_INCREMENTAL') == '1'
+
+# Bump when the format of _IncrementalState files changes.
+_INCREMENTAL_STATE_VERSION = 1
+
+
+class _IncrementalState(object):
+  """Lint issues found by previous runs, by source file.
+
+  Issues are stored along with the digest of the source they are located in,
+  under a key for everything else that lint's results depend on (the lint
+  binary, its config, the manifest, the resources, the classpath and the
+  flags). While that key is unchanged, only the sources whose digest changed
+  and the sources that mention changed or deleted ones by name are linted.
+
+  Issues located in resources or in the manifest are kept from the last run
+  that linted all sources: those files are unchanged since, and lint's
+  results for them are not reliable when it only sees some of the sources.
+  Other issues (e.g. those in class files or in srcjars) are always from the
+  latest run, which analyzes all of those files.
+
+  Args:
+    path: Path of the file that stores the state.
+    config_key: The key described above.
+  """
+
+  def __init__(self, path, config_key):
+    self._path = path
+    self._config_key = config_key
+    # Map of source path -> digest.
+    self.source_digests = {}
+    # Map of source path -> list of <issue> elements, as XML strings.
+    self.source_issues = {}
+    # List of <issue> elements located in resources or the manifest.
+    self.resource_issues = []
+
+  def Load(self):
+    """Loads the previous run's state. Returns whether it can be used."""
+    try:
+      with open(self._path) as f:
+        data = json.load(f)
+    except (IOError, ValueError):
+      return False
+    if (data.get('version') != _INCREMENTAL_STATE_VERSION or
+        data.get('config_key') != self._config_key):
+      return False
+    self.source_digests = data['source_digests']
+    self.source_issues = data['source_issues']
+    self.resource_issues = data['resource_issues']
+    return True
+
+  def Delete(self):
+    if os.path.exists(self._path):
+      os.unlink(self._path)
+
+  def Write(self):
+    data = {
+        'version': _INCREMENTAL_STATE_VERSION,
+        'config_key': self._config_key,
+        'source_digests': self.source_digests,
+        'source_issues': self.source_issues,
+        'resource_issues': self.resource_issues,
+    }
+    with build_utils.AtomicOutput(self._path) as f:
+      f.write(json.dumps(data).encode('utf-8'))
+
+
+def _ComputeConfigKey(changes, sources, jar_path):
+  """Returns a digest of all inputs except for |sources| and |jar_path|."""
+  md5 = hashlib.md5(changes.new_metadata.StringsMd5().encode())
+  excluded_paths = set(sources)
+  excluded_paths.add(jar_path)
+  for path in sorted(changes.new_metadata.IterPaths()):
+    if path not in excluded_paths:
+      md5.update('\n{}\n{}'.format(path, changes.new_metadata.GetTag(path))
+                 .encode())
+  return md5.hexdigest()
+
+
+def _GetSourcesToLint(sources, source_digests, state):
+  """Returns the sources whose issues in |state| may be out of date."""
+  changed = [s for s in sources if state.source_digests.get(s) !=
+             source_digests[s]]
+  deleted = [s for s in state.source_digests if s not in source_digests]
+  names = set(
+      os.path.splitext(os.path.basename(s))[0] for s in changed + deleted)
+  if not names:
+    return []
+  # Sources that use the changed ones mention their class names (sources are
+  # named after their top-level class).
+  pattern = re.compile(
+      r'\b(?:%s)\b' % '|'.join(re.escape(n) for n in sorted(names)))
+  ret = set(changed)
+  for source in sources:
+    if source not in ret:
+      with open(source, encoding='utf-8', errors='replace') as f:
+        if pattern.search(f.read()):
+          ret.add(source)
+  return [s for s in sources if s in ret]
+
+
+def _MergeIncrementalResults(result_path, state, linted_paths, sources,
+                             source_digests, resource_paths, rebase_path):
+  """Merges the issues in |state| into |result_path| and updates |state|.
+
+  Args:
+    result_path: Path to lint's XML result file. It may not exist when lint
+      found no issues.
+    state: The _IncrementalState of the previous run, or an empty one.
+    linted_paths: Map of the absolute paths that lint saw for the sources
+      that it linted, to those sources.
+    sources: All sources.
+    source_digests: Map of source path -> digest.
+    resource_paths: Absolute paths of resource directories and manifests.
+    rebase_path: Function that returns paths relative to the source root.
+  Returns:
+    The number of issues in the merged result file.
+  """
+  if os.path.exists(result_path):
+    dom = minidom.parse(result_path)
+  else:
+    dom = minidom.parseString('<issues format="4"/>')
+  issues_elem = dom.documentElement
+  linted_all = len(set(linted_paths.values())) == len(sources)
+
+  def is_resource_path(path):
+    return any(path == p or path.startswith(p + os.sep)
+               for p in resource_paths)
+
+  source_issues = collections.defaultdict(list)
+  resource_issues = []
+  for issue in issues_elem.getElementsByTagName('issue'):
+    locations = issue.getElementsByTagName('location')
+    paths = [
+        os.path.normpath(os.path.join(build_utils.DIR_SOURCE_ROOT,
+                                      l.getAttribute('file')))
+        for l in locations
+    ]
+    source = paths and linted_paths.get(paths[0])
+    if source:
+      # Sources are linted from temporary directories. Report their real
+      # paths, which stay valid when the issues are reused.
+      for location, path in zip(locations, paths):
+        if path in linted_paths:
+          location.setAttribute('file', rebase_path(linted_paths[path]))
+      source_issues[source].append(issue.toxml())
+    elif paths and is_resource_path(paths[0]):
+      if linted_all:
+        resource_issues.append(issue.toxml())
+      else:
+        issues_elem.removeChild(issue)
+
+  linted_sources = set(linted_paths.values())
+  for source in sources:
+    if source not in linted_sources:
+      source_issues[source] = state.source_issues.get(source, [])
+  if not linted_all:
+    resource_issues = state.resource_issues
+  for source in sources:
+    if source not in linted_sources:
+      for xml in source_issues[source]:
+        _AppendIssue(dom, xml)
+  if not linted_all:
+    for xml in resource_issues:
+      _AppendIssue(dom, xml)
+
+  with build_utils.AtomicOutput(result_path) as f:
+    f.write(dom.toxml(encoding='utf-8'))
+
+  state.source_digests = source_digests
+  state.source_issues = dict(source_issues)
+  state.resource_issues = resource_issues
+  state.Write()
+  return len(issues_elem.getElementsByTagName('issue'))
+
+
+def _AppendIssue(dom, xml):
+  issue = minidom.parseString(xml).documentElement
+  dom.documentElement.appendChild(dom.importNode(issue, True))
+
+
+def _OnStaleMd5(changes, lint_path, config_path, processed_config_path,
                 manifest_path, result_path, product_dir, sources, jar_path,
                 cache_dir, android_sdk_version, srcjars, resource_sources,
                 disable=None, classpath=None, can_fail_build=False,
@@ -52,7 +238,7 @@ def _OnStaleMd5(lint_path, config_path, processed_config_path,
   def _ProcessResultFile():
     with open(result_path, 'rb') as f:
       content = f.read().replace(
-          _RebasePath(product_dir), 'PRODUCT_DIR')
+          _RebasePath(product_dir).encode(), 'PRODUCT_DIR'.encode())
 
     with open(result_path, 'wb') as f:
       f.write(content)
@@ -83,6 +269,23 @@ def _OnStaleMd5(lint_path, config_path, processed_config_path,
   with build_utils.TempDir() as temp_dir:
     _ProcessConfigFile()
 
+    incremental_state = None
+    sources_to_lint = sources
+    # |changes| is only passed in incremental mode.
+    if changes:
+      source_digests = {s: changes.new_metadata.GetTag(s) for s in sources}
+      incremental_state = _IncrementalState(
+          result_path + '.incremental.json',
+          _ComputeConfigKey(changes, sources, jar_path))
+      if incremental_state.Load():
+        # No sources changed when only the inputs outside of the config key
+        # (i.e. the jar) did. Lint needs sources to analyze the jar with, so
+        # they are all linted rather than none.
+        sources_to_lint = (_GetSourcesToLint(sources, source_digests,
+                                             incremental_state) or sources)
+      # Rewritten once the results are merged.
+      incremental_state.Delete()
+
     cmd = [
         _RebasePath(lint_path), '-Werror', '--exitcode', '--showall',
         '--xml', _RebasePath(result_path),
@@ -136,7 +339,9 @@ def _OnStaleMd5(lint_path, config_path, processed_config_path,
       return subpath
 
     src_dirs = []
-    for src in sources:
+    # Map of the paths that lint may report for sources -> sources.
+    linted_paths = {}
+    for src in sources_to_lint:
       src_dir = None
       for d in src_dirs:
         if not os.path.exists(PathInDir(d, src)):
@@ -147,6 +352,8 @@ def _OnStaleMd5(lint_path, config_path, processed_config_path,
         src_dirs.append(src_dir)
         cmd.extend(['--sources', _RebasePath(src_dir)])
       os.symlink(os.path.abspath(src), PathInDir(src_dir, src))
+      for path in (PathInDir(src_dir, src), src, os.path.realpath(src)):
+        linted_paths[os.path.abspath(path)] = src
 
     if srcjars:
       srcjar_paths = build_utils.ParseGnList(srcjars)
@@ -200,6 +407,7 @@ def _OnStaleMd5(lint_path, config_path, processed_config_path,
         return True
       return False
 
+    lint_failed = False
     try:
       build_utils.CheckOutput(cmd, cwd=build_utils.DIR_SOURCE_ROOT,
                               env=env or None, stderr_filter=stderr_filter,
@@ -216,36 +424,54 @@ def _OnStaleMd5(lint_path, config_path, processed_config_path,
         elif not silent:
           traceback.print_exc()
         return
+      lint_failed = True
 
-      # There are actual lint issues
+    if incremental_state is not None:
+      resource_paths = [os.path.abspath(d) for d in resource_dirs]
+      resource_paths.append(os.path.abspath(manifest_path))
+      resource_paths.append(os.path.join(project_dir, 'AndroidManifest.xml'))
       try:
-        num_issues = _ParseAndShowResultFile()
+        # Issues of sources that were not linted fail the build as well, and
+        # so do unexpected failures that fail_func() rejected.
+        lint_failed = _MergeIncrementalResults(
+            result_path, incremental_state, linted_paths, sources,
+            source_digests, resource_paths, _RebasePath) > 0 or lint_failed
       except Exception: # pylint: disable=broad-except
-        if not silent:
-          print('Lint created unparseable xml file...')
-          print('File contents:')
-          with open(result_path) as f:
-            print(f.read())
-          if can_fail_build:
-            traceback.print_exc()
-        if can_fail_build:
-          raise
-        else:
-          return
+        # Reported by _ParseAndShowResultFile() below.
+        incremental_state.Delete()
 
-      _ProcessResultFile()
-      if num_issues == 0 and include_unexpected:
-        msg = 'Please refer to output above for unexpected lint failures.\n'
-      else:
-        msg = ('\nLint found %d new issues.\n'
-               ' - For full explanation, please refer to %s\n'
-               ' - For more information about lint and how to fix lint issues,'
-               ' please refer to %s\n' %
-               (num_issues, _RebasePath(result_path), _LINT_MD_URL))
+    if not lint_failed:
+      return
+
+    # There are actual lint issues
+    try:
+      num_issues = _ParseAndShowResultFile()
+    except Exception: # pylint: disable=broad-except
       if not silent:
-        print(msg, file=sys.stderr)
+        print('Lint created unparseable xml file...')
+        print('File contents:')
+        with open(result_path) as f:
+          print(f.read())
+        if can_fail_build:
+          traceback.print_exc()
       if can_fail_build:
-        raise Exception('Lint failed.')
+        raise
+      else:
+        return
+
+    _ProcessResultFile()
+    if num_issues == 0 and include_unexpected:
+      msg = 'Please refer to output above for unexpected lint failures.\n'
+    else:
+      msg = ('\nLint found %d new issues.\n'
+             ' - For full explanation, please refer to %s\n'
+             ' - For more information about lint and how to fix lint issues,'
+             ' please refer to %s\n' %
+             (num_issues, _RebasePath(result_path), _LINT_MD_URL))
+    if not silent:
+      print(msg, file=sys.stderr)
+    if can_fail_build:
+      raise Exception('Lint failed.')
 
 
 def _FindInDirectories(directories, filename_filter):
@@ -372,26 +598,29 @@ def main():
   output_paths = [args.result_path, args.processed_config_path]
 
   build_utils.CallAndWriteDepfileIfStale(
-      lambda: _OnStaleMd5(args.lint_path,
-                          args.config_path,
-                          args.processed_config_path,
-                          args.manifest_path, args.result_path,
-                          args.product_dir, sources,
-                          args.jar_path,
-                          args.cache_dir,
-                          args.android_sdk_version,
-                          args.srcjars,
-                          resource_sources,
-                          disable=disable,
-                          classpath=classpath,
-                          can_fail_build=args.can_fail_build,
-                          include_unexpected=args.include_unexpected_failures,
-                          silent=args.silent),
+      lambda changes=None: _OnStaleMd5(
+          changes,
+          args.lint_path,
+          args.config_path,
+          args.processed_config_path,
+          args.manifest_path, args.result_path,
+          args.product_dir, sources,
+          args.jar_path,
+          args.cache_dir,
+          args.android_sdk_version,
+          args.srcjars,
+          resource_sources,
+          disable=disable,
+          classpath=classpath,
+          can_fail_build=args.can_fail_build,
+          include_unexpected=args.include_unexpected_failures,
+          silent=args.silent),
       args,
       input_paths=input_paths,
       input_strings=input_strings,
       output_paths=output_paths,
       depfile_deps=classpath,
+      pass_changes=_INCREMENTAL,
       add_pydeps=False)
 
 
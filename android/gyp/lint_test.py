@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from xml.dom import minidom
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import lint
+
+
+def _Issue(issue_id, path):
+  return '<issue id="%s" message="m"><location file="%s" line="1"/></issue>' % (
+      issue_id, path)
+
+
+class LintTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.state_path = self._Path('result.xml.incremental.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def _Path(self, name):
+    return os.path.join(self.temp_dir, name)
+
+  def _WriteSource(self, name, contents):
+    path = self._Path(name)
+    with open(path, 'w') as f:
+      f.write(contents)
+    return path
+
+  def _ReadIssues(self, result_path):
+    """Returns the sorted (id, file) of the issues in |result_path|."""
+    dom = minidom.parse(result_path)
+    return sorted(
+        (issue.getAttribute('id'),
+         issue.getElementsByTagName('location')[0].getAttribute('file'))
+        for issue in dom.getElementsByTagName('issue'))
+
+  def testGetSourcesToLint(self):
+    a = self._WriteSource('Apple.java', 'class Apple {}')
+    b = self._WriteSource('Banana.java', 'class Banana { Apple a; }')
+    c = self._WriteSource('Cherry.java', 'class Cherry { Date d; }')
+    d = self._Path('Date.java')
+    state = lint._IncrementalState(self.state_path, 'key')
+    state.source_digests = {a: 'a', b: 'b', c: 'c', d: 'd'}
+    sources = [a, b, c]
+
+    # Date.java was deleted, and Cherry.java mentions it.
+    self.assertEqual([c], lint._GetSourcesToLint(
+        sources, {a: 'a', b: 'b', c: 'c'}, state))
+
+    state.source_digests = {a: 'a', b: 'b', c: 'c'}
+    self.assertEqual([], lint._GetSourcesToLint(
+        sources, {a: 'a', b: 'b', c: 'c'}, state))
+    self.assertEqual([b], lint._GetSourcesToLint(
+        sources, {a: 'a', b: 'b2', c: 'c'}, state))
+    # Banana.java mentions Apple.
+    self.assertEqual([a, b], lint._GetSourcesToLint(
+        sources, {a: 'a2', b: 'b', c: 'c'}, state))
+
+  def _Merge(self, state, result_issues, linted_paths, sources):
+    result_path = self._Path('result.xml')
+    with open(result_path, 'w') as f:
+      f.write('<issues format="4">%s</issues>' % ''.join(result_issues))
+    source_digests = {s: s + '-digest' for s in sources}
+    num_issues = lint._MergeIncrementalResults(
+        result_path, state, linted_paths, sources, source_digests,
+        [self._Path('res')], lambda p: p)
+    self.assertEqual(len(self._ReadIssues(result_path)), num_issues)
+    return result_path
+
+  def testMergeIncrementalResults(self):
+    a = self._Path('A.java')
+    b = self._Path('B.java')
+    c = self._Path('C.java')
+    linted_a = self._Path(os.path.join('tmp', 'A.java'))
+    layout = self._Path(os.path.join('res', 'layout', 'main.xml'))
+    jar = self._Path('lib.jar')
+    state = lint._IncrementalState(self.state_path, 'key')
+    state.source_digests = {a: 'a', b: 'b', c: 'c'}
+    state.source_issues = {
+        a: [_Issue('StaleA', a)],
+        b: [_Issue('OldB', b)],
+        c: [_Issue('OldC', c)],
+    }
+    state.resource_issues = [_Issue('OldRes', layout)]
+
+    # Only A.java was linted, and C.java was deleted.
+    result_path = self._Merge(
+        state,
+        [_Issue('NewA', linted_a), _Issue('NewRes', layout),
+         _Issue('Jar', jar)],
+        {linted_a: a}, [a, b])
+    self.assertEqual(
+        [('Jar', jar), ('NewA', a), ('OldB', b), ('OldRes', layout)],
+        self._ReadIssues(result_path))
+
+    loaded = lint._IncrementalState(self.state_path, 'key')
+    self.assertTrue(loaded.Load())
+    self.assertEqual({a: a + '-digest', b: b + '-digest'},
+                     loaded.source_digests)
+    self.assertEqual([a, b], sorted(loaded.source_issues))
+    self.assertEqual(1, len(loaded.source_issues[a]))
+    self.assertIn('NewA', loaded.source_issues[a][0])
+    self.assertEqual(state.resource_issues, loaded.resource_issues)
+    self.assertIn('OldRes', loaded.resource_issues[0])
+
+  def testMergeIncrementalResultsWhenAllLinted(self):
+    a = self._Path('A.java')
+    linted_a = self._Path(os.path.join('tmp', 'A.java'))
+    layout = self._Path(os.path.join('res', 'layout', 'main.xml'))
+    state = lint._IncrementalState(self.state_path, 'key')
+    state.source_issues = {a: [_Issue('StaleA', a)]}
+    state.resource_issues = [_Issue('OldRes', layout)]
+
+    # Resource issues are replaced, and fixed issues are gone.
+    result_path = self._Merge(state, [_Issue('NewRes', layout)],
+                              {linted_a: a}, [a])
+    self.assertEqual([('NewRes', layout)], self._ReadIssues(result_path))
+    self.assertEqual([], state.source_issues.get(a, []))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -12,6 +12,7 @@ import tempfile
 import zipfile
 
 from util import build_utils
+from util import jvm_worker
 from util import proguard_util
 
 
@@ -114,7 +115,7 @@ def _CheckForUnwanted(kept_classes, proguard_cmd, negative_main_dex_globs):
     first_class = found_unwanted_classes[0].replace(
         '.class', '').replace('/', '.')
     proguard_cmd += ['-whyareyoukeeping', 'class', first_class, '{}']
-    output = build_utils.CheckOutput(
+    output = jvm_worker.CheckOutput(
         proguard_cmd, print_stderr=False,
         stdout_filter=proguard_util.ProguardOutputFilter())
     raise Exception(
@@ -135,7 +136,7 @@ def _OnStaleMd5(proguard_cmd, main_dex_list_cmd, paths, main_dex_list_path,
         '-injars', paths_arg,
         '-outjars', temp_jar.name
       ]
-      build_utils.CheckOutput(proguard_cmd, print_stderr=False)
+      jvm_worker.CheckOutput(proguard_cmd, print_stderr=False)
 
       # Record the classes kept by ProGuard. Not used by the build, but useful
       # for debugging what classes are kept by ProGuard vs. MainDexListBuilder.
@@ -156,7 +157,7 @@ def _OnStaleMd5(proguard_cmd, main_dex_list_cmd, paths, main_dex_list_path,
       main_dex_list_cmd += [
         temp_jar.name, paths_arg
       ]
-      main_dex_list = build_utils.CheckOutput(main_dex_list_cmd)
+      main_dex_list = jvm_worker.CheckOutput(main_dex_list_cmd)
 
   except build_utils.CalledProcessError as e:
     if "output jar is empty" in e.output:
@@ -9,6 +9,7 @@
 
 import argparse
 import collections
+import json
 import os
 import re
 import shutil
@@ -97,7 +98,8 @@ def _GenerateGlobs(pattern):
   return pattern.replace('!', '').split(':')
 
 
-def _ZipResources(resource_dirs, zip_path, ignore_pattern):
+def _ZipResources(resource_dirs, zip_path, ignore_pattern, generated_dirs,
+                  record_path, changes):
   # Python zipfile does not provide a way to replace a file (it just writes
   # another file with the same name). So, first collect all the files to put
   # in the zip (with proper overriding), and then zip them.
@@ -118,12 +120,42 @@ def _ZipResources(resource_dirs, zip_path, ignore_pattern):
           continue
         # We want the original resource dirs in the .info file rather than the
         # generated overridden path.
-        if not path.startswith('/tmp'):
+        if not any(path.startswith(g + os.sep) for g in generated_dirs):
           files_to_zip_without_generated[archive_path] = path
         files_to_zip[archive_path] = path
   resource_utils.CreateResourceInfoFile(files_to_zip_without_generated,
                                         zip_path)
-  build_utils.DoZip(iter(files_to_zip.items()), zip_path)
+
+  # Entries of the previous zip are reused when they were added from the same
+  # file, and md5_check's tag for that file is unchanged. Generated files are
+  # not tracked by md5_check, so their contents are compared instead.
+  # |record_path| maps archive path -> [source path, md5_check tag].
+  old_sources = {}
+  if changes.old_metadata and not changes.force:
+    try:
+      with open(record_path) as f:
+        old_sources = json.load(f)
+    except (IOError, ValueError):
+      pass
+  # Removed until the zip and the record match again, in case this fails.
+  _DeleteFile(record_path)
+
+  sources = {}
+  for archive_path, path in files_to_zip.items():
+    sources[archive_path] = [path, changes.new_metadata.GetTag(path)]
+
+  def reuse_fn(zip_file, info, path):
+    tag = sources[info.filename][1]
+    if tag is None:
+      return build_utils.ZipEntryMatchesPath(zip_file, info, path)
+    return old_sources.get(info.filename) == [path, tag]
+
+  with build_utils.AtomicOutput(zip_path, only_if_changed=False) as f:
+    build_utils.DoZip(iter(files_to_zip.items()), f,
+                      reuse_zip=zip_path if old_sources else None,
+                      reuse_fn=reuse_fn)
+  with open(record_path, 'w') as f:
+    json.dump(sources, f)
 
 
 def _GenerateRTxt(options, dep_subdirs, gen_dir):
@@ -177,36 +209,85 @@ def _GenerateRTxt(options, dep_subdirs, gen_dir):
       package_command, print_stdout=False, print_stderr=False)
 
 
+def _GenerateV14Resources(resource_dirs, v14_dir, changes):
+  """Updates |v14_dir| to hold v14-compatible resources for |resource_dirs|.
+
+  |v14_dir| is kept between builds, next to a record of the inputs that it was
+  generated for. When the record matches |changes|, only the outputs of
+  changed resource files are regenerated.
+
+  Args:
+    resource_dirs: A list of input resource directories.
+    v14_dir: Output directory.
+    changes: An md5_check.Changes instance.
+  """
+  record_path = v14_dir + '.json'
+  record = {
+      'resource_dirs': [os.path.abspath(d) for d in resource_dirs],
+      'files_md5': changes.new_metadata.FilesMd5(),
+  }
+  changed_paths = None
+  if changes.old_metadata and not changes.force:
+    try:
+      with open(record_path) as f:
+        old_record = json.load(f)
+    except (IOError, ValueError):
+      old_record = None
+    if (old_record and
+        old_record['resource_dirs'] == record['resource_dirs'] and
+        old_record['files_md5'] == changes.old_metadata.FilesMd5()):
+      changed_paths = list(changes.IterChangedPaths())
+      # Changes to the scripts themselves affect all outputs.
+      if any(p.endswith('.py') for p in changed_paths):
+        changed_paths = None
+
+  # Removed until |v14_dir| is consistent again, in case this fails.
+  _DeleteFile(record_path)
+  if changed_paths is None:
+    build_utils.DeleteDirectory(v14_dir)
+    build_utils.MakeDirectory(v14_dir)
+  generate_v14_compatible_resources.GenerateV14ResourcesForDirs(
+      resource_dirs, v14_dir, changed_paths)
+  with open(record_path, 'w') as f:
+    json.dump(record, f)
+
+
+def _DeleteFile(path):
+  if os.path.exists(path):
+    os.unlink(path)
+
+
 def _GenerateResourcesZip(output_resource_zip, input_resource_dirs, v14_skip,
-                          strip_drawables, temp_dir):
+                          strip_drawables, state_prefix, changes):
   """Generate a .resources.zip file fron a list of input resource dirs.
 
   Args:
     output_resource_zip: Path to the output .resources.zip file.
     input_resource_dirs: A list of input resource directories.
     v14_skip: If False, then v14-compatible resource will also be
-      generated in |{temp_dir}/v14| and added to the final zip.
-    temp_dir: Path to temporary directory.
+      generated in |{state_prefix}.v14| and added to the final zip.
+    strip_drawables: Whether to leave out drawables.
+    state_prefix: Path prefix of the files kept between builds.
+    changes: An md5_check.Changes instance.
   """
-  if not v14_skip:
-    # Generate v14-compatible resources in temp_dir.
-    v14_dir = os.path.join(temp_dir, 'v14')
-    build_utils.MakeDirectory(v14_dir)
-
-    for resource_dir in input_resource_dirs:
-      generate_v14_compatible_resources.GenerateV14Resources(
-          resource_dir,
-          v14_dir)
-
-    input_resource_dirs.append(v14_dir)
+  v14_dir = state_prefix + '.v14'
+  generated_dirs = []
+  if v14_skip:
+    build_utils.DeleteDirectory(v14_dir)
+    _DeleteFile(v14_dir + '.json')
+  else:
+    _GenerateV14Resources(input_resource_dirs, v14_dir, changes)
+    input_resource_dirs = input_resource_dirs + [v14_dir]
+    generated_dirs.append(v14_dir)
 
   ignore_pattern = _AAPT_IGNORE_PATTERN
   if strip_drawables:
     ignore_pattern += ':*drawable*'
-  _ZipResources(input_resource_dirs, output_resource_zip, ignore_pattern)
+  _ZipResources(input_resource_dirs, output_resource_zip, ignore_pattern,
+                generated_dirs, state_prefix + '.zip_sources.json', changes)
 
 
-def _OnStaleMd5(options):
+def _OnStaleMd5(options, changes):
   with resource_utils.BuildContext() as build:
     if options.r_text_in:
       r_txt_path = options.r_text_in
@@ -253,9 +334,17 @@ def _OnStaleMd5(options):
       build_utils.ZipDir(options.srcjar_out, build.srcjar_dir)
 
     if options.resource_zip_out:
+      # Files kept between builds live next to the depfile, in the target's
+      # gen dir: {target_name}.v14/, {target_name}.v14.json and
+      # {target_name}.zip_sources.json. Without a depfile, they go in the temp
+      # dir and everything is regenerated.
+      if options.depfile:
+        state_prefix = os.path.splitext(options.depfile)[0]
+      else:
+        state_prefix = os.path.join(build.temp_dir, 'state')
       _GenerateResourcesZip(options.resource_zip_out, options.resource_dirs,
                             options.v14_skip, options.strip_drawables,
-                            build.temp_dir)
+                            state_prefix, changes)
 
 
 def main(args):
@@ -308,12 +397,13 @@ def main(args):
   input_strings.extend(sorted(resource_names))
 
   build_utils.CallAndWriteDepfileIfStale(
-      lambda: _OnStaleMd5(options),
+      lambda changes: _OnStaleMd5(options, changes),
       options,
       input_paths=input_paths,
       input_strings=input_strings,
       output_paths=output_paths,
       depfile_deps=depfile_deps,
+      pass_changes=True,
       add_pydeps=False)
 
 
@@ -0,0 +1,184 @@
+// Copyright 2019 The Chromium Authors. All rights reserved.
+// Use of this source code is governed by a BSD-style license that can be
+// found in the LICENSE file.
+
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.IOException;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.net.SocketTimeoutException;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.nio.file.StandardCopyOption;
+import java.security.Permission;
+import java.security.SecureRandom;
+
+/**
+ * Runs the main() methods of Java build tools (e.g. D8 and ProGuard) within a
+ * long-lived JVM, so that build actions do not pay for JVM startup and JIT
+ * warmup on every run. Started and used by build/android/gyp/util/jvm_worker.py.
+ *
+ * Usage (Java 11+):
+ *   java -cp TOOL_CLASSPATH JvmWorker.java PORT_FILE IDLE_TIMEOUT_SECS
+ *
+ * Listens on a loopback port, and writes "PORT TOKEN" to PORT_FILE, where TOKEN
+ * is a random string that clients must send. Requests are handled one at a
+ * time:
+ *   Request: TOKEN, main class, number of arguments, arguments.
+ *   Response: exit code, stdout, stderr.
+ * Integers are 4-byte big-endian. Strings (UTF-8) and byte arrays are prefixed
+ * with their length.
+ *
+ * Exits once no request has been received for IDLE_TIMEOUT_SECS.
+ */
+public class JvmWorker {
+    // Exit code for when System.exit() cannot be intercepted, because the JVM
+    // was started without -Djava.security.manager=allow (Java 18+).
+    private static final int EXIT_NO_SECURITY_MANAGER = 3;
+
+    /** Thrown instead of exiting when a tool calls System.exit(). */
+    private static class ExitException extends SecurityException {
+        final int mStatus;
+
+        ExitException(int status) {
+            mStatus = status;
+        }
+    }
+
+    public static void main(String[] args) throws IOException {
+        Path portFile = Paths.get(args[0]);
+        int idleTimeoutMs = Integer.parseInt(args[1]) * 1000;
+
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkPermission(Permission perm) {}
+
+                @Override
+                public void checkPermission(Permission perm, Object context) {}
+
+                @Override
+                public void checkExit(int status) {
+                    throw new ExitException(status);
+                }
+            });
+        } catch (UnsupportedOperationException e) {
+            System.err.println("Requires -Djava.security.manager=allow: " + e);
+            System.exit(EXIT_NO_SECURITY_MANAGER);
+        }
+
+        byte[] tokenBytes = new byte[16];
+        new SecureRandom().nextBytes(tokenBytes);
+        StringBuilder tokenBuilder = new StringBuilder();
+        for (byte b : tokenBytes) {
+            tokenBuilder.append(String.format("%02x", b));
+        }
+        String token = tokenBuilder.toString();
+
+        ServerSocket server = new ServerSocket(0, 50, InetAddress.getLoopbackAddress());
+        server.setSoTimeout(idleTimeoutMs);
+        String portFileContents = server.getLocalPort() + " " + token + "\n";
+        Path tempPortFile = Paths.get(args[0] + ".tmp");
+        Files.write(tempPortFile, portFileContents.getBytes(StandardCharsets.UTF_8));
+        Files.move(tempPortFile, portFile, StandardCopyOption.ATOMIC_MOVE);
+
+        while (true) {
+            Socket socket;
+            try {
+                socket = server.accept();
+            } catch (SocketTimeoutException e) {
+                break;
+            }
+            try (Socket s = socket) {
+                handleRequest(s, token);
+            } catch (IOException e) {
+                e.printStackTrace();
+            }
+        }
+        server.close();
+        // A client may have started a replacement worker already.
+        try {
+            if (portFileContents.equals(
+                        new String(Files.readAllBytes(portFile), StandardCharsets.UTF_8))) {
+                Files.delete(portFile);
+            }
+        } catch (IOException e) {
+            // Deleted by a client.
+        }
+        // Threads left behind by tools must not keep the JVM alive.
+        Runtime.getRuntime().halt(0);
+    }
+
+    private static void handleRequest(Socket socket, String token) throws IOException {
+        DataInputStream in = new DataInputStream(new BufferedInputStream(socket.getInputStream()));
+        DataOutputStream out =
+                new DataOutputStream(new BufferedOutputStream(socket.getOutputStream()));
+        if (!token.equals(readString(in))) {
+            return;
+        }
+        String mainClass = readString(in);
+        String[] args = new String[in.readInt()];
+        for (int i = 0; i < args.length; i++) {
+            args[i] = readString(in);
+        }
+
+        ByteArrayOutputStream stdout = new ByteArrayOutputStream();
+        ByteArrayOutputStream stderr = new ByteArrayOutputStream();
+        int exitCode = runMain(mainClass, args, stdout, stderr);
+        out.writeInt(exitCode);
+        writeBytes(out, stdout.toByteArray());
+        writeBytes(out, stderr.toByteArray());
+        out.flush();
+    }
+
+    private static int runMain(String mainClass, String[] args, ByteArrayOutputStream stdout,
+            ByteArrayOutputStream stderr) {
+        PrintStream oldOut = System.out;
+        PrintStream oldErr = System.err;
+        PrintStream out = new PrintStream(stdout, true);
+        PrintStream err = new PrintStream(stderr, true);
+        System.setOut(out);
+        System.setErr(err);
+        try {
+            Method main = Class.forName(mainClass).getMethod("main", String[].class);
+            main.invoke(null, (Object) args);
+            return 0;
+        } catch (InvocationTargetException e) {
+            Throwable cause = e.getCause();
+            if (cause instanceof ExitException) {
+                return ((ExitException) cause).mStatus;
+            }
+            cause.printStackTrace(err);
+            return 1;
+        } catch (ReflectiveOperationException e) {
+            e.printStackTrace(err);
+            return 1;
+        } finally {
+            out.flush();
+            err.flush();
+            System.setOut(oldOut);
+            System.setErr(oldErr);
+        }
+    }
+
+    private static String readString(DataInputStream in) throws IOException {
+        byte[] data = new byte[in.readInt()];
+        in.readFully(data);
+        return new String(data, StandardCharsets.UTF_8);
+    }
+
+    private static void writeBytes(DataOutputStream out, byte[] data) throws IOException {
+        out.writeInt(data.length);
+        out.write(data);
+    }
+}
@@ -0,0 +1,253 @@
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""A persistent index of .build_config deps_info and transitive deps.
+
+write_build_config.py needs the deps_info of every transitive dependency of a
+target, in dependency order. Without an index, every target json.load()s all
+of its transitive .build_config files and walks the graph from scratch.
+
+The index stores, in a binary format:
+  * One record per .build_config, with its deps_info.
+  * One closure per .build_config: all configs it depends on (directly or
+    not), in the order that build_utils.GetSortedTransitiveDependencies()
+    lists them, followed by the config itself. Closures are stored under a
+    token that identifies them: the md5 of the config's path and of the
+    tokens of its direct deps.
+
+The closure of a target is built by merging the closures that its direct deps
+recorded, so the graph is never re-walked. Merging the closures of |top| in
+order, skipping paths already seen, yields exactly the order of
+GetSortedTransitiveDependencies(top).
+
+To enable the index, set the environment variable:
+    BUILD_CONFIG_INDEX_DIR=/path/to/index
+"""
+
+import hashlib
+import json
+import marshal
+import os
+import tempfile
+import time
+
+
+_INDEX_DIR = os.environ.get('BUILD_CONFIG_INDEX_DIR')
+
+# Bump when the layout of records or closures changes.
+_FORMAT_VERSION = 1
+
+# The stat info of files modified more recently than this many seconds is not
+# trusted, since a second write within the same mtime granularity would leave
+# it unchanged.
+_RACY_SECONDS = 2
+
+
+class _Record(object):
+  """The indexed information of a single .build_config."""
+
+  def __init__(self, content_digest, deps_info):
+    # md5 of the .build_config's contents.
+    self.content_digest = content_digest
+    self.deps_info = deps_info
+    # Identifies the closure of the .build_config. Set once deps are loaded.
+    self.token = None
+
+
+def _StatKey(path):
+  st = os.stat(path)
+  return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+def _IsRacy(stat_key):
+  return time.time_ns() - stat_key[1] < _RACY_SECONDS * 10**9
+
+
+def _ComputeToken(path, dep_tokens):
+  return hashlib.md5('\n'.join([path] + dep_tokens).encode()).hexdigest()
+
+
+def _MergeClosures(closures):
+  ret = []
+  seen = set()
+  for closure in closures:
+    for path in closure:
+      if path not in seen:
+        seen.add(path)
+        ret.append(path)
+  return ret
+
+
+class BuildConfigIndex(object):
+  """Looks up .build_config files through a persistent index.
+
+  A record is used only when it matches the .build_config's contents. These
+  are compared by md5, unless the file's (size, mtime_ns, inode) are unchanged
+  since a time at which they could be trusted (i.e. the file had not been
+  modified within _RACY_SECONDS of the record being written). Even the md5
+  check is much cheaper than parsing the file.
+
+  Tokens are recomputed from the validated records of all transitive deps, so
+  a changed dep is noticed even though the .build_config files that depend on
+  it are not necessarily rewritten. Closures are only read for the configs
+  that are asked about directly.
+
+  Files are written to a temporary file and renamed into place, so that
+  concurrent actions never see partially written ones.
+
+  Args:
+    index_dir: Directory to store the index in. Created on demand.
+  """
+
+  def __init__(self, index_dir):
+    self._index_dir = index_dir
+    # Validated records and closures, by path.
+    self._records = {}
+    self._closures = {}
+
+  def _IndexPath(self, kind, key):
+    name = hashlib.md5(key.encode()).hexdigest()
+    return os.path.join(self._index_dir, kind, name[:2], name[2:] + '.marshal')
+
+  def _Read(self, index_path):
+    try:
+      with open(index_path, 'rb') as f:
+        # Much faster than marshal.load(), which reads in small chunks.
+        data = marshal.loads(f.read())
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+      return None
+    if not isinstance(data, tuple) or data[:1] != (_FORMAT_VERSION,):
+      return None
+    return data[1:]
+
+  def _Write(self, index_path, data):
+    """Writes |data|. Failures are silently ignored."""
+    index_dir = os.path.dirname(index_path)
+    try:
+      if not os.path.isdir(index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+      with tempfile.NamedTemporaryFile(dir=index_dir, suffix='.tmp',
+                                       delete=False) as f:
+        f.write(marshal.dumps((_FORMAT_VERSION,) + data))
+      os.replace(f.name, index_path)
+    except (IOError, OSError):
+      pass
+
+  def _StoreRecord(self, abs_path, stat_key, record):
+    # Recently modified files could be modified again without their stat key
+    # changing, so such stat keys are not trusted.
+    trusted_stat_key = None if _IsRacy(stat_key) else stat_key
+    self._Write(self._IndexPath('records', abs_path),
+                (abs_path, trusted_stat_key, record.content_digest,
+                 record.deps_info))
+
+  def _LoadRecord(self, path):
+    abs_path = os.path.abspath(path)
+    stat_key = _StatKey(path)
+    data = self._Read(self._IndexPath('records', abs_path))
+    contents = None
+    if data and len(data) == 4 and data[0] == abs_path:
+      trusted_stat_key, content_digest, deps_info = data[1:]
+      if stat_key == trusted_stat_key:
+        return _Record(content_digest, deps_info)
+      with open(path, 'rb') as f:
+        contents = f.read()
+      if hashlib.md5(contents).hexdigest() == content_digest:
+        record = _Record(content_digest, deps_info)
+        if not _IsRacy(stat_key):
+          # Trust the new stat key from now on.
+          self._StoreRecord(abs_path, stat_key, record)
+        return record
+
+    if contents is None:
+      with open(path, 'rb') as f:
+        contents = f.read()
+    record = _Record(hashlib.md5(contents).hexdigest(),
+                     json.loads(contents)['deps_info'])
+    self._StoreRecord(abs_path, stat_key, record)
+    return record
+
+  def _GetRecord(self, path):
+    record = self._records.get(path)
+    if record:
+      return record
+    # Dependency chains can be deeper than the recursion limit, so the graph
+    # is walked with an explicit stack. Each path is visited once to push its
+    # deps, and once more to compute its token after they are done.
+    loaded = {}
+    stack = [path]
+    while stack:
+      cur = stack[-1]
+      if cur in self._records:
+        stack.pop()
+        continue
+      record = loaded.get(cur)
+      if not record:
+        record = self._LoadRecord(cur)
+        loaded[cur] = record
+        deps = [p for p in record.deps_info['deps_configs']
+                if p not in self._records]
+        if deps:
+          stack.extend(reversed(deps))
+          continue
+      dep_tokens = [self._records[p].token
+                    for p in record.deps_info['deps_configs']]
+      record.token = _ComputeToken(cur, dep_tokens)
+      self._records[cur] = record
+      stack.pop()
+    return self._records[path]
+
+  def _GetClosure(self, path):
+    """Returns all transitive deps of |path|, deps first, ending with |path|."""
+    closure = self._closures.get(path)
+    if closure:
+      return closure
+    # Walked with an explicit stack, like _GetRecord().
+    expanded = set()
+    stack = [path]
+    while stack:
+      cur = stack[-1]
+      if cur in self._closures:
+        stack.pop()
+        continue
+      record = self._GetRecord(cur)
+      index_path = self._IndexPath('closures', record.token)
+      if cur not in expanded:
+        expanded.add(cur)
+        data = self._Read(index_path)
+        if data and len(data) == 2 and data[0] == record.token:
+          self._closures[cur] = data[1]
+          stack.pop()
+          continue
+        deps = [p for p in record.deps_info['deps_configs']
+                if p not in self._closures]
+        if deps:
+          stack.extend(reversed(deps))
+          continue
+      closure = _MergeClosures(
+          self._closures[p] for p in record.deps_info['deps_configs'])
+      closure.append(cur)
+      self._Write(index_path, (record.token, closure))
+      self._closures[cur] = closure
+      stack.pop()
+    return self._closures[path]
+
+  def GetDepsInfo(self, path):
+    """Returns the deps_info of the .build_config at |path|."""
+    return self._GetRecord(path).deps_info
+
+  def GetAllDepsInOrder(self, paths):
+    """Returns all transitive deps of |paths| (inclusive), deps first.
+
+    Matches build_utils.GetSortedTransitiveDependencies() applied to the
+    deps_configs graph.
+    """
+    return _MergeClosures(self._GetClosure(p) for p in paths)
+
+
+def GetIndex():
+  """Returns the shared BuildConfigIndex, or None if it is not enabled."""
+  if not _INDEX_DIR:
+    return None
+  return BuildConfigIndex(_INDEX_DIR)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_config_index
+from util import build_utils
+
+
+class BuildConfigIndexTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.index_dir = os.path.join(self.temp_dir, 'index')
+    self.deps = {}
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def _Path(self, name):
+    return os.path.join(self.temp_dir, name + '.build_config')
+
+  def _WriteConfig(self, name, dep_names, old=True):
+    path = self._Path(name)
+    dep_paths = [self._Path(d) for d in dep_names]
+    self.deps[path] = dep_paths
+    with open(path, 'w') as f:
+      json.dump({'deps_info': {'path': path, 'deps_configs': dep_paths}}, f)
+    if old:
+      # Move the mtime out of the index's racy window.
+      old_time = os.stat(path).st_mtime - 60
+      os.utime(path, (old_time, old_time))
+    return path
+
+  def _ExpectedOrder(self, paths):
+    return build_utils.GetSortedTransitiveDependencies(
+        paths, lambda p: self.deps[p])
+
+  def _NewIndex(self):
+    return build_config_index.BuildConfigIndex(self.index_dir)
+
+  def testMatchesGetSortedTransitiveDependencies(self):
+    rand = random.Random(0)
+    names = ['n%d' % i for i in range(60)]
+    for i, name in enumerate(names):
+      num_deps = min(i, rand.randint(0, 4))
+      self._WriteConfig(name, rand.sample(names[:i], num_deps))
+    for _ in range(20):
+      top = [self._Path(n) for n in rand.sample(names, 3)]
+      # Once from scratch, once from persisted records.
+      for index in (self._NewIndex(), self._NewIndex()):
+        self.assertEqual(self._ExpectedOrder(top), index.GetAllDepsInOrder(top))
+
+  def testDeepChains(self):
+    names = ['n%d' % i for i in range(sys.getrecursionlimit() + 100)]
+    self._WriteConfig(names[0], [])
+    for dep_name, name in zip(names, names[1:]):
+      self._WriteConfig(name, [dep_name])
+    top = [self._Path(names[-1])]
+    for index in (self._NewIndex(), self._NewIndex()):
+      self.assertEqual([self._Path(n) for n in names],
+                       index.GetAllDepsInOrder(top))
+
+  def testRecordsAreReused(self):
+    a = self._WriteConfig('a', [])
+    b = self._WriteConfig('b', ['a'])
+    self.assertEqual([a, b], self._NewIndex().GetAllDepsInOrder([b]))
+
+    old_loads = build_config_index.json.loads
+    build_config_index.json.loads = None
+    try:
+      index = self._NewIndex()
+      self.assertEqual([a, b], index.GetAllDepsInOrder([b]))
+      self.assertEqual([a], index.GetDepsInfo(b)['deps_configs'])
+    finally:
+      build_config_index.json.loads = old_loads
+
+  def testDetectsChangedTransitiveDeps(self):
+    self._WriteConfig('a', [])
+    self._WriteConfig('b', ['a'])
+    c = self._WriteConfig('c', ['b'])
+    self.assertEqual(self._ExpectedOrder([c]),
+                     self._NewIndex().GetAllDepsInOrder([c]))
+
+    # b gains a dep, but c's .build_config is unchanged.
+    self._WriteConfig('x', [])
+    self._WriteConfig('b', ['x', 'a'])
+    self.assertEqual(self._ExpectedOrder([c]),
+                     self._NewIndex().GetAllDepsInOrder([c]))
+
+  def testRecentlyWrittenFilesAreCheckedByContent(self):
+    a = self._WriteConfig('a', [], old=False)
+    self.assertEqual([a], self._NewIndex().GetAllDepsInOrder([a]))
+    # Same size and, within mtime granularity, possibly the same mtime.
+    b = self._WriteConfig('b', [])
+    with open(a, 'w') as f:
+      json.dump({'deps_info': {'path': a, 'deps_configs': [b]}}, f)
+    self.assertEqual([b, a], self._NewIndex().GetAllDepsInOrder([a]))
+
+
+if __name__ == '__main__':
+  unittest.main()
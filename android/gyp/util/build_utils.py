@@ -7,18 +7,23 @@ import contextlib
 import filecmp
 import fnmatch
 import json
+import multiprocessing
+import multiprocessing.pool
 import os
 import pipes
 import re
 import shlex
 import shutil
 import stat
+import struct
 import subprocess
 import sys
 import tempfile
 import zipfile
+import zlib
 
 from util import md5_check
+from util import trace_utils
 
 sys.path.append(os.path.join(os.path.dirname(__file__),
                              os.pardir, os.pardir, os.pardir))
@@ -232,20 +237,30 @@ def FilterLines(output, filter_string):
       line for line in output.splitlines() if not re_filter.search(line))
 
 
+def RunCommand(args, cwd=None, env=None):
+  """Runs |args| in a subprocess and returns (returncode, stdout, stderr)."""
+  child = subprocess.Popen(args,
+      stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd, env=env)
+  stdout, stderr = child.communicate()
+  return child.returncode, stdout, stderr
+
+
 # This can be used in most cases like subprocess.check_output(). The output,
 # particularly when the command fails, better highlights the command's failure.
 # If the command fails, raises a build_utils.CalledProcessError.
+# |run_func| is called like RunCommand() to run |args| (e.g. by
+# jvm_worker.RunCommand()).
 def CheckOutput(args, cwd=None, env=None,
                 print_stdout=False, print_stderr=True,
                 stdout_filter=None,
                 stderr_filter=None,
-                fail_func=lambda returncode, stderr: returncode != 0):
+                fail_func=lambda returncode, stderr: returncode != 0,
+                run_func=RunCommand):
   if not cwd:
     cwd = os.getcwd()
 
-  child = subprocess.Popen(args,
-      stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd, env=env)
-  stdout, stderr = child.communicate()
+  with trace_utils.Span('build_utils.CheckOutput', command=args):
+    returncode, stdout, stderr = run_func(args, cwd, env)
 
   if stdout_filter is not None:
     stdout = stdout_filter(stdout)
@@ -261,7 +276,7 @@ def CheckOutput(args, cwd=None, env=None,
   if isinstance(stderr, bytes) and sys.version_info >= (3, ):
     stderr = stderr.decode('utf-8')
 
-  if fail_func(child.returncode, stderr):
+  if fail_func(returncode, stderr):
     raise CalledProcessError(cwd, args, stdout + stderr)
 
   if print_stdout:
@@ -315,7 +330,42 @@ def _IsSymlink(zip_file, name):
   return stat.S_ISLNK(zi.external_attr >> 16)
 
 
-def ExtractAll(zip_path, path=None, no_clobber=True, pattern=None):
+def ZipEntryMatchesPath(zip_file, info, path):
+  """Returns whether |path| already has the contents of the given zip entry."""
+  if _IsSymlink(zip_file, info.filename):
+    return (os.path.islink(path) and
+            os.readlink(path) == zip_file.read(info).decode())
+  if os.path.islink(path) or not os.path.isfile(path):
+    return False
+  if os.path.getsize(path) != info.file_size:
+    return False
+  crc = 0
+  with open(path, 'rb') as f:
+    while True:
+      data = f.read(2**20)
+      if not data:
+        break
+      crc = zlib.crc32(data, crc)
+  return crc == info.CRC
+
+
+def ExtractAll(zip_path, path=None, no_clobber=True, pattern=None,
+               predicate=None, incremental=False):
+  """Extracts the files in |zip_path| into |path|.
+
+  Args:
+    zip_path: Path of the zip file to extract.
+    path: Output directory. Defaults to the current directory.
+    no_clobber: Whether to raise if an extracted file already exists.
+    pattern: Glob that entry paths must match to be extracted.
+    predicate: Function that entry paths must satisfy to be extracted.
+    incremental: Whether to leave alone existing files whose size and CRC
+        already match the zip entry (preserving their mtime). Implies
+        clobbering of files that do not match.
+
+  Returns:
+    List of paths of the extracted files, including unchanged ones.
+  """
   if path is None:
     path = os.getcwd()
   elif not os.path.exists(path):
@@ -326,15 +376,27 @@ def ExtractAll(zip_path, path=None, no_clobber=True, pattern=None):
 
   extracted = []
   with zipfile.ZipFile(zip_path) as z:
-    for name in z.namelist():
+    for info in z.infolist():
+      name = info.filename
       if name.endswith('/'):
         continue
       if pattern is not None:
         if not fnmatch.fnmatch(name, pattern):
           continue
+      if predicate and not predicate(name):
+        continue
       CheckZipPath(name)
-      if no_clobber:
-        output_path = os.path.join(path, name)
+      output_path = os.path.join(path, name)
+      if incremental:
+        if ZipEntryMatchesPath(z, info, output_path):
+          extracted.append(output_path)
+          continue
+        # A previous version of the zip may have had a directory here.
+        if os.path.isdir(output_path) and not os.path.islink(output_path):
+          shutil.rmtree(output_path)
+        elif os.path.lexists(output_path):
+          os.unlink(output_path)
+      elif no_clobber:
         if os.path.exists(output_path):
           raise Exception(
               'Path already exists from zip: %s %s %s'
@@ -351,6 +413,108 @@ def ExtractAll(zip_path, path=None, no_clobber=True, pattern=None):
   return extracted
 
 
+def ExtractAllIncrementally(zip_paths, path, pattern=None):
+  """Makes |path| contain exactly the files from |zip_paths|.
+
+  Zips are extracted concurrently with ExtractAll(incremental=True), so files
+  whose contents did not change are not rewritten and keep their mtimes.
+  Files within |path| that are not in any of the zips are deleted.
+
+  Args:
+    zip_paths: Paths of the zip files to extract. They must not contain the
+        same entry paths.
+    path: Output directory.
+    pattern: Glob that entry paths must match to be extracted.
+
+  Returns:
+    List of lists of extracted paths, parallel to |zip_paths|.
+  """
+  # Check for collisions up front, since no_clobber cannot be used when files
+  # from previous runs exist. This also creates output directories ahead of
+  # time so that concurrent extractions do not race to create them.
+  owners = {}
+  output_dirs = set([path])
+  for zip_path in zip_paths:
+    with zipfile.ZipFile(zip_path) as z:
+      for name in z.namelist():
+        if name.endswith('/'):
+          continue
+        if pattern is not None and not fnmatch.fnmatch(name, pattern):
+          continue
+        CheckZipPath(name)
+        output_path = os.path.join(path, name)
+        if output_path in owners:
+          raise Exception(
+              'Path already exists from zip: %s %s %s'
+              % (zip_path, name, owners[output_path]))
+        owners[output_path] = zip_path
+        output_dirs.add(os.path.dirname(output_path))
+  for output_dir in output_dirs:
+    MakeDirectory(output_dir)
+
+  extract_func = lambda zip_path: ExtractAll(
+      zip_path, path=path, pattern=pattern, incremental=True)
+  num_workers = min(len(zip_paths), multiprocessing.cpu_count())
+  if num_workers > 1:
+    pool = multiprocessing.pool.ThreadPool(num_workers)
+    try:
+      ret = pool.map(extract_func, zip_paths)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    ret = [extract_func(p) for p in zip_paths]
+
+  for root, _, files in os.walk(path, topdown=False):
+    for f in files:
+      file_path = os.path.join(root, f)
+      if file_path not in owners:
+        os.unlink(file_path)
+    if root != path and not os.listdir(root):
+      os.rmdir(root)
+
+  return ret
+
+
+def _CreateHermeticZipInfo(zip_file, zip_path, file_size, st_mode=None,
+                           compress=None):
+  """Returns a ZipInfo with a hard-coded modified time and attributes.
+
+  Args:
+    zip_file: ZipFile instance the entry will be added to.
+    zip_path: Destination path within the zip file.
+    file_size: Size of the uncompressed data.
+    st_mode: st_mode of the source file, if any.
+    compress: Whether to enable compression. Default is taken from ZipFile
+        constructor.
+  """
+  zipinfo = zipfile.ZipInfo(filename=zip_path, date_time=HERMETIC_TIMESTAMP)
+  zipinfo.external_attr = _HERMETIC_FILE_ATTR
+
+  # zipfile.write() does
+  #     external_attr = (os.stat(src_path)[0] & 0xFFFF) << 16
+  # but we want to use _HERMETIC_FILE_ATTR, so manually set
+  # the few attr bits we care about.
+  if st_mode is not None:
+    for mode in (stat.S_IXUSR, stat.S_IXGRP, stat.S_IXOTH):
+      if st_mode & mode:
+        zipinfo.external_attr |= mode << 16
+
+  # zipfile will deflate even when it makes the file bigger. To avoid
+  # growing files, disable compression at an arbitrary cut off point.
+  if file_size < 16:
+    compress = False
+
+  # None converts to ZIP_STORED, when passed explicitly rather than the
+  # default passed to the ZipFile constructor.
+  zipinfo.compress_type = zip_file.compression
+  if compress is not None:
+    zipinfo.compress_type = (zipfile.ZIP_DEFLATED if compress
+                             else zipfile.ZIP_STORED)
+  zipinfo.file_size = file_size
+  return zipinfo
+
+
 def AddToZipHermetic(zip_file, zip_path, src_path=None, data=None,
                      compress=None):
   """Adds a file to the given ZipFile with a hard-coded modified time.
@@ -366,46 +530,222 @@ def AddToZipHermetic(zip_file, zip_path, src_path=None, data=None,
   assert (src_path is None) != (data is None), (
       '|src_path| and |data| are mutually exclusive.')
   CheckZipPath(zip_path)
-  zipinfo = zipfile.ZipInfo(filename=zip_path, date_time=HERMETIC_TIMESTAMP)
-  zipinfo.external_attr = _HERMETIC_FILE_ATTR
 
   if src_path and os.path.islink(src_path):
-    zipinfo.filename = zip_path
+    zipinfo = zipfile.ZipInfo(filename=zip_path, date_time=HERMETIC_TIMESTAMP)
+    zipinfo.external_attr = _HERMETIC_FILE_ATTR
     zipinfo.external_attr |= stat.S_IFLNK << 16  # mark as a symlink
     zip_file.writestr(zipinfo, os.readlink(src_path))
     return
 
-  # zipfile.write() does
-  #     external_attr = (os.stat(src_path)[0] & 0xFFFF) << 16
-  # but we want to use _HERMETIC_FILE_ATTR, so manually set
-  # the few attr bits we care about.
   if src_path:
     st = os.stat(src_path)
-    for mode in (stat.S_IXUSR, stat.S_IXGRP, stat.S_IXOTH):
-      if st.st_mode & mode:
-        zipinfo.external_attr |= mode << 16
+    zipinfo = _CreateHermeticZipInfo(zip_file, zip_path, st.st_size,
+                                     st_mode=st.st_mode, compress=compress)
+    # Stream the file rather than reading it into memory, since some inputs
+    # (e.g. native libraries) are hundreds of MB. Setting file_size up front
+    # makes ZipFile.open() produce the same headers as writestr() does.
+    with open(src_path, 'rb') as src, zip_file.open(zipinfo, 'w') as dst:
+      shutil.copyfileobj(src, dst, 2**20)
+  else:
+    zipinfo = _CreateHermeticZipInfo(zip_file, zip_path, len(data),
+                                     compress=compress)
+    zip_file.writestr(zipinfo, data)
 
-  if src_path:
-    with open(src_path, 'rb') as f:
-      data = f.read()
 
-  # zipfile will deflate even when it makes the file bigger. To avoid
-  # growing files, disable compression at an arbitrary cut off point.
-  if len(data) < 16:
-    compress = False
+def _WriteRawZipEntry(zip_file, zipinfo, write_data_func):
+  """Adds an entry whose data is already compressed to |zip_file|.
 
-  # None converts to ZIP_STORED, when passed explicitly rather than the
-  # default passed to the ZipFile constructor.
-  compress_type = zip_file.compression
-  if compress is not None:
-    compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
-  zip_file.writestr(zipinfo, data, compress_type)
+  This mirrors what ZipFile.open(zipinfo, 'w') does, so for seekable outputs
+  the result is identical to writing the uncompressed data through zipfile.
+
+  Args:
+    zip_file: ZipFile instance to add the entry to.
+    zipinfo: ZipInfo with CRC, compress_size and file_size already set.
+    write_data_func: Called with the zip's file object to write the
+        compressed data.
+  """
+  zip64 = (zipinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT or
+           zipinfo.compress_size > zipfile.ZIP64_LIMIT)
+  with zip_file._lock:
+    if zip_file._seekable:
+      zip_file.fp.seek(zip_file.start_dir)
+    zipinfo.header_offset = zip_file.fp.tell()
+    zip_file._writecheck(zipinfo)
+    zip_file._didModify = True
+    zip_file.fp.write(zipinfo.FileHeader(zip64))
+    write_data_func(zip_file.fp)
+    zip_file.start_dir = zip_file.fp.tell()
+    zip_file.filelist.append(zipinfo)
+    zip_file.NameToInfo[zipinfo.filename] = zipinfo
+
+
+def _CopyRawZipEntryData(in_zip, info, out_fileobj, block_size=2**20):
+  """Copies the still-compressed bytes of |info| from |in_zip|."""
+  in_fileobj = in_zip.fp
+  in_fileobj.seek(info.header_offset)
+  header = in_fileobj.read(30)
+  if header[:4] != b'PK\x03\x04':
+    raise zipfile.BadZipFile('Bad local file header for %s' % info.filename)
+  # The local header's name and extra field lengths may differ from those in
+  # the central directory, so they must be read from the local header itself.
+  name_len, extra_len = struct.unpack('<HH', header[26:30])
+  in_fileobj.seek(name_len + extra_len, os.SEEK_CUR)
+  remaining = info.compress_size
+  while remaining:
+    data = in_fileobj.read(min(remaining, block_size))
+    if not data:
+      raise zipfile.BadZipFile('Truncated zip entry: %s' % info.filename)
+    out_fileobj.write(data)
+    remaining -= len(data)
+
+
+def CopyZipEntryHermetic(out_zip, in_zip, info, zip_path, compress=None):
+  """Copies an entry between ZipFiles with a hard-coded modified time.
+
+  When the entry is already stored with the requested compression, its
+  compressed bytes and CRC are transplanted as-is rather than being inflated
+  and deflated again. Otherwise, this is equivalent to:
+      AddToZipHermetic(out_zip, zip_path, data=in_zip.read(info),
+                       compress=compress)
+
+  Args:
+    out_zip: ZipFile instance to add the entry to.
+    in_zip: ZipFile instance containing |info|.
+    info: ZipInfo of the entry to copy.
+    zip_path: Destination path within |out_zip|.
+    compress: Whether to compress the entry. Default is to keep the
+        compression of the source entry.
+  """
+  if compress is None:
+    compress = info.compress_type != zipfile.ZIP_STORED
+  compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+  # AddToZipHermetic() never compresses tiny files, and ijar does not set
+  # CRCs, so fall back to it for entries whose bytes could not be reused.
+  can_copy_raw = (info.compress_type == compress_type and
+                  not info.flag_bits & 0x1 and  # Encrypted.
+                  (info.CRC or not info.file_size) and
+                  (compress_type == zipfile.ZIP_STORED or info.file_size >= 16))
+  if not can_copy_raw:
+    AddToZipHermetic(out_zip, zip_path, data=in_zip.read(info),
+                     compress=compress)
+    return
+
+  CheckZipPath(zip_path)
+  zipinfo = zipfile.ZipInfo(filename=zip_path, date_time=HERMETIC_TIMESTAMP)
+  zipinfo.external_attr = _HERMETIC_FILE_ATTR
+  zipinfo.compress_type = compress_type
+  zipinfo.CRC = info.CRC
+  zipinfo.compress_size = info.compress_size
+  zipinfo.file_size = info.file_size
+  _WriteRawZipEntry(out_zip, zipinfo,
+                    lambda fileobj: _CopyRawZipEntryData(in_zip, info, fileobj))
+
+
+def _AddToZipHermeticFromZip(out_zip, zip_path, src_path, in_zip, info,
+                             compress=None):
+  """Like AddToZipHermetic(), but takes the data from |info| in |in_zip|.
+
+  The entry must hold the current contents of |src_path|. Its compressed
+  bytes are reused when they match the requested compression, so that the
+  result is identical to AddToZipHermetic(out_zip, zip_path, src_path).
+  """
+  CheckZipPath(zip_path)
+  st = os.stat(src_path)
+  zipinfo = _CreateHermeticZipInfo(out_zip, zip_path, info.file_size,
+                                   st_mode=st.st_mode, compress=compress)
+  if (zipinfo.compress_type != info.compress_type or
+      info.flag_bits & 0x1):  # Encrypted.
+    AddToZipHermetic(out_zip, zip_path, src_path=src_path, compress=compress)
+    return
+  zipinfo.CRC = info.CRC
+  zipinfo.compress_size = info.compress_size
+  _WriteRawZipEntry(out_zip, zipinfo,
+                    lambda fileobj: _CopyRawZipEntryData(in_zip, info, fileobj))
+
+
+def _DeflateFile(path, block_size=2**20):
+  """Deflates |path| the same way zipfile does.
+
+  Returns:
+    A tuple of (CRC32, uncompressed size, list of compressed chunks).
+  """
+  compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+  crc = 0
+  file_size = 0
+  chunks = []
+  with open(path, 'rb') as f:
+    while True:
+      data = f.read(block_size)
+      if not data:
+        break
+      crc = zlib.crc32(data, crc)
+      file_size += len(data)
+      chunks.append(compressor.compress(data))
+  chunks.append(compressor.flush())
+  return crc, file_size, chunks
+
+
+def _AddFilesToZipHermeticInParallel(out_zip, entries, reuse_zip=None):
+  """Adds (zip_path, src_path, compress, reuse_info) |entries| to |out_zip|.
+
+  Entries that will be deflated are compressed ahead of time on a pool of
+  threads (zlib releases the GIL while compressing), then written in order.
+  Since the deflate streams match what zipfile would produce, the output is
+  identical to calling AddToZipHermetic() for each entry. Entries with a
+  |reuse_info| are copied from |reuse_zip| instead.
+  """
+  num_workers = multiprocessing.cpu_count()
+  # Bound the number of compressed files held in memory at once.
+  max_pending = num_workers * 4
+  pool = multiprocessing.pool.ThreadPool(num_workers)
+  # List of (zip_path, src_path, compress, reuse_info, zipinfo, async_result).
+  pending = collections.deque()
+
+  def write_next():
+    (zip_path, src_path, compress, reuse_info, zipinfo,
+     async_result) = pending.popleft()
+    if reuse_info:
+      _AddToZipHermeticFromZip(out_zip, zip_path, src_path, reuse_zip,
+                               reuse_info, compress=compress)
+      return
+    if async_result is None:
+      AddToZipHermetic(out_zip, zip_path, src_path=src_path, compress=compress)
+      return
+    zipinfo.CRC, zipinfo.file_size, chunks = async_result.get()
+    zipinfo.compress_size = sum(len(c) for c in chunks)
+    _WriteRawZipEntry(out_zip, zipinfo,
+                      lambda fileobj: fileobj.writelines(chunks))
+
+  try:
+    for zip_path, src_path, compress, reuse_info in entries:
+      zipinfo = None
+      async_result = None
+      if not reuse_info and not os.path.islink(src_path):
+        CheckZipPath(zip_path)
+        st = os.stat(src_path)
+        zipinfo = _CreateHermeticZipInfo(out_zip, zip_path, st.st_size,
+                                         st_mode=st.st_mode, compress=compress)
+        if zipinfo.compress_type == zipfile.ZIP_DEFLATED:
+          async_result = pool.apply_async(_DeflateFile, (src_path,))
+      pending.append((zip_path, src_path, compress, reuse_info, zipinfo,
+                      async_result))
+      if len(pending) > max_pending:
+        write_next()
+    while pending:
+      write_next()
+  finally:
+    pool.terminate()
+    pool.join()
 
 
 def DoZip(inputs, output, base_dir=None, compress_fn=None,
-          zip_prefix_path=None):
+          zip_prefix_path=None, reuse_zip=None, reuse_fn=None):
   """Creates a zip file from a list of files.
 
+  Entries are deflated on all cores when the output is seekable. The result
+  is identical to adding them one at a time.
+
   Args:
     inputs: A list of paths to zip, or a list of (zip_path, fs_path) tuples.
     output: Path, fileobj, or ZipFile instance to add files to.
@@ -413,9 +753,20 @@ def DoZip(inputs, output, base_dir=None, compress_fn=None,
     compress_fn: Applied to each input to determine whether or not to compress.
         By default, items will be |zipfile.ZIP_STORED|.
     zip_prefix_path: Path prepended to file path in zip file.
+    reuse_zip: Optional path to a zip (usually the previous version of
+        |output|) whose entries are copied rather than reading and compressing
+        their input again, when |reuse_fn| allows it. The result is the same.
+        Must not be |output| itself, unless |output| is written to a
+        temporary file (e.g. by AtomicOutput()).
+    reuse_fn: Called with (ZipFile of |reuse_zip|, zipinfo, fs_path) for inputs
+        whose zip path has an entry in |reuse_zip|. Returns whether the entry
+        holds the current contents of |fs_path|. Defaults to
+        ZipEntryMatchesPath(), which compares contents.
   """
   if base_dir is None:
     base_dir = '.'
+  if reuse_fn is None:
+    reuse_fn = ZipEntryMatchesPath
   input_tuples = []
   for tup in inputs:
     if isinstance(tup, str):
@@ -429,13 +780,43 @@ def DoZip(inputs, output, base_dir=None, compress_fn=None,
   if not isinstance(output, zipfile.ZipFile):
     out_zip = zipfile.ZipFile(output, 'w')
 
+  in_zip = None
+  # Raw entries can only be written identically when the output is seekable.
+  if reuse_zip and out_zip._seekable and os.path.exists(reuse_zip):
+    try:
+      in_zip = zipfile.ZipFile(reuse_zip)
+    except zipfile.BadZipFile:
+      pass
+
   try:
+    entries = []
     for zip_path, fs_path in input_tuples:
       if zip_prefix_path:
         zip_path = os.path.join(zip_prefix_path, zip_path)
       compress = compress_fn(zip_path) if compress_fn else None
-      AddToZipHermetic(out_zip, zip_path, src_path=fs_path, compress=compress)
+      reuse_info = in_zip and in_zip.NameToInfo.get(zip_path)
+      if (not reuse_info or os.path.islink(fs_path) or
+          not reuse_fn(in_zip, reuse_info, fs_path)):
+        reuse_info = None
+      entries.append((zip_path, fs_path, compress, reuse_info))
+
+    # Parallel deflating is only identical to zipfile's output when entries
+    # do not need data descriptors, i.e. when the output is seekable.
+    with trace_utils.Span('build_utils.DoZip', num_inputs=len(entries)):
+      if (len(entries) > 1 and multiprocessing.cpu_count() > 1 and
+          out_zip._seekable):
+        _AddFilesToZipHermeticInParallel(out_zip, entries, in_zip)
+      else:
+        for zip_path, fs_path, compress, reuse_info in entries:
+          if reuse_info:
+            _AddToZipHermeticFromZip(out_zip, zip_path, fs_path, in_zip,
+                                     reuse_info, compress=compress)
+          else:
+            AddToZipHermetic(out_zip, zip_path, src_path=fs_path,
+                             compress=compress)
   finally:
+    if in_zip:
+      in_zip.close()
     if output is not out_zip:
       out_zip.close()
 
@@ -465,7 +846,8 @@ def MergeZips(output, input_zips, path_transform=None, compress=None):
     input_zips: Iterable of paths to zip files to merge.
     path_transform: Called for each entry path. Returns a new path, or None to
         skip the file.
-    compress: Overrides compression setting from origin zip entries.
+    compress: Overrides compression setting from origin zip entries. Entries
+        whose compression already matches are copied without recompressing.
   """
   path_transform = path_transform or (lambda p: p)
   added_names = set()
@@ -475,29 +857,23 @@ def MergeZips(output, input_zips, path_transform=None, compress=None):
     out_zip = zipfile.ZipFile(output, 'w')
 
   try:
-    for in_file in input_zips:
-      with zipfile.ZipFile(in_file, 'r') as in_zip:
-        # ijar creates zips with null CRCs.
-        in_zip._expected_crc = None
-        for info in in_zip.infolist():
-          # Ignore directories.
-          if info.filename[-1] == '/':
-            continue
-          dst_name = path_transform(info.filename)
-          if not dst_name:
-            continue
-          already_added = dst_name in added_names
-          if not already_added:
-            if compress is not None:
-              compress_entry = compress
-            else:
-              compress_entry = info.compress_type != zipfile.ZIP_STORED
-            AddToZipHermetic(
-                out_zip,
-                dst_name,
-                data=in_zip.read(info),
-                compress=compress_entry)
-            added_names.add(dst_name)
+    with trace_utils.Span('build_utils.MergeZips'):
+      for in_file in input_zips:
+        with zipfile.ZipFile(in_file, 'r') as in_zip:
+          # ijar creates zips with null CRCs.
+          in_zip._expected_crc = None
+          for info in in_zip.infolist():
+            # Ignore directories.
+            if info.filename[-1] == '/':
+              continue
+            dst_name = path_transform(info.filename)
+            if not dst_name:
+              continue
+            already_added = dst_name in added_names
+            if not already_added:
+              CopyZipEntryHermetic(
+                  out_zip, in_zip, info, dst_name, compress=compress)
+              added_names.add(dst_name)
   finally:
     if output is not out_zip:
       out_zip.close()
@@ -726,6 +1102,9 @@ def CallAndWriteDepfileIfStale(function, options, record_path=None,
   in depfile_deps. It's important to write paths to the depfile that are already
   captured by GN deps since GN args can cause GN deps to change, and such
   changes are not immediately reflected in depfiles (http://crbug.com/589311).
+
+  When tracing is enabled (see util/trace_utils.py), the whole call and each of
+  its phases are recorded as spans.
   """
   if not output_paths:
     raise Exception('At least one output_path must be specified.')
@@ -733,27 +1112,32 @@ def CallAndWriteDepfileIfStale(function, options, record_path=None,
   input_strings = list(input_strings or [])
   output_paths = list(output_paths or [])
 
-  python_deps = None
-  if hasattr(options, 'depfile') and options.depfile:
-    python_deps = _ComputePythonDependencies()
-    input_paths += python_deps
-    output_paths += [options.depfile]
-
-  def on_stale_md5(changes):
-    args = (changes,) if pass_changes else ()
-    function(*args)
-    if python_deps is not None:
-      all_depfile_deps = list(python_deps) if add_pydeps else []
-      if depfile_deps:
-        all_depfile_deps.extend(depfile_deps)
-      WriteDepfile(options.depfile, output_paths[0], all_depfile_deps,
-                   add_pydeps=False)
-
-  md5_check.CallAndRecordIfStale(
-      on_stale_md5,
-      record_path=record_path,
-      input_paths=input_paths,
-      input_strings=input_strings,
-      output_paths=output_paths,
-      force=force,
-      pass_changes=True)
+  with trace_utils.Span('build_utils.CallAndWriteDepfileIfStale',
+                        output=output_paths[0]):
+    python_deps = None
+    if hasattr(options, 'depfile') and options.depfile:
+      with trace_utils.Span('build_utils.ComputePythonDependencies'):
+        python_deps = _ComputePythonDependencies()
+      input_paths += python_deps
+      output_paths += [options.depfile]
+
+    def on_stale_md5(changes):
+      args = (changes,) if pass_changes else ()
+      with trace_utils.Span('build_utils.Function'):
+        function(*args)
+      if python_deps is not None:
+        all_depfile_deps = list(python_deps) if add_pydeps else []
+        if depfile_deps:
+          all_depfile_deps.extend(depfile_deps)
+        with trace_utils.Span('build_utils.WriteDepfile'):
+          WriteDepfile(options.depfile, output_paths[0], all_depfile_deps,
+                       add_pydeps=False)
+
+    md5_check.CallAndRecordIfStale(
+        on_stale_md5,
+        record_path=record_path,
+        input_paths=input_paths,
+        input_strings=input_strings,
+        output_paths=output_paths,
+        force=force,
+        pass_changes=True)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# Copyright 2018 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Measures time and peak memory of build_utils zip helpers.
+
+Each measurement runs in a fresh subprocess so that peak RSS is not shared
+between modes.
+
+Example:
+  android/gyp/util/build_utils_benchmark.py --file-size-mb 300
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_utils
+
+
+def _AddFromData(zip_file, src_path, compress):
+  # How AddToZipHermetic() used to handle |src_path|.
+  with open(src_path, 'rb') as f:
+    build_utils.AddToZipHermetic(zip_file, 'lib.so', data=f.read(),
+                                 compress=compress)
+
+
+def _AddFromPath(zip_file, src_path, compress):
+  build_utils.AddToZipHermetic(zip_file, 'lib.so', src_path=src_path,
+                               compress=compress)
+
+
+_MODES = {
+    'read': _AddFromData,
+    'stream': _AddFromPath,
+}
+
+
+def _RunMode(mode, src_path, output_path, compress):
+  start = time.time()
+  with zipfile.ZipFile(output_path, 'w') as z:
+    _MODES[mode](z, src_path, compress)
+  elapsed = time.time() - start
+  # ru_maxrss is in KiB on Linux.
+  peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+  print('%.3f %.1f' % (elapsed, peak_rss_mb))
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--file-size-mb', type=int, default=200)
+  parser.add_argument('--compress', action='store_true')
+  parser.add_argument('--run-mode', choices=sorted(_MODES),
+                      help=argparse.SUPPRESS)
+  parser.add_argument('--src-path', help=argparse.SUPPRESS)
+  parser.add_argument('--output-path', help=argparse.SUPPRESS)
+  args = parser.parse_args(argv)
+
+  if args.run_mode:
+    _RunMode(args.run_mode, args.src_path, args.output_path, args.compress)
+    return
+
+  temp_dir = tempfile.mkdtemp()
+  try:
+    src_path = os.path.join(temp_dir, 'lib.so')
+    with open(src_path, 'wb') as f:
+      for _ in range(args.file_size_mb):
+        f.write(os.urandom(1024 * 1024))
+    output_path = os.path.join(temp_dir, 'out.apk')
+
+    print('Adding a %dMB file (compress=%s):' % (args.file_size_mb,
+                                                  args.compress))
+    for mode in sorted(_MODES):
+      cmd = [sys.executable, __file__, '--run-mode', mode,
+             '--src-path', src_path, '--output-path', output_path]
+      if args.compress:
+        cmd.append('--compress')
+      elapsed, peak_rss_mb = subprocess.check_output(cmd).split()
+      print('  %-8s %8ss %8sMB peak RSS' % (mode, elapsed.decode(),
+                                           peak_rss_mb.decode()))
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
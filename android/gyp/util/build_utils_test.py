@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# Copyright 2018 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_utils
+
+
+def _ZipContents(zip_file):
+  return [(i.filename, i.compress_type, i.date_time, i.external_attr,
+           zip_file.read(i)) for i in zip_file.infolist()]
+
+
+class BuildUtilsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def _Path(self, name):
+    return os.path.join(self.temp_dir, name)
+
+  def _WriteZip(self, name, entries):
+    path = self._Path(name)
+    with zipfile.ZipFile(path, 'w') as z:
+      for subpath, data, compress_type in entries:
+        z.writestr(subpath, data, compress_type)
+    return path
+
+  def testAddToZipHermeticStreamsSameBytesAsData(self):
+    for size in (0, 15, 16, 3 * 2**20 + 7):
+      data = os.urandom(size // 2) * 2
+      src_path = self._Path('src_%d' % size)
+      with open(src_path, 'wb') as f:
+        f.write(data)
+      for compress in (None, True, False):
+        from_path = io.BytesIO()
+        from_data = io.BytesIO()
+        with zipfile.ZipFile(from_path, 'w', zipfile.ZIP_DEFLATED) as z:
+          build_utils.AddToZipHermetic(z, 'a', src_path=src_path,
+                                       compress=compress)
+        with zipfile.ZipFile(from_data, 'w', zipfile.ZIP_DEFLATED) as z:
+          build_utils.AddToZipHermetic(z, 'a', data=data, compress=compress)
+        self.assertEqual(from_data.getvalue(), from_path.getvalue())
+
+  def testDoZipInParallelIsIdenticalToSerial(self):
+    base_dir = self._Path('base')
+    os.makedirs(os.path.join(base_dir, 'sub'))
+    for i, size in enumerate((0, 10, 100, 2**16, 3 * 2**20)):
+      with open(os.path.join(base_dir, 'sub', 'f%d' % i), 'wb') as f:
+        f.write(os.urandom(size // 2) + b'a' * (size - size // 2))
+    os.chmod(os.path.join(base_dir, 'sub', 'f2'), 0o755)
+    os.symlink('f3', os.path.join(base_dir, 'sub', 'link'))
+    inputs = [os.path.join(base_dir, 'sub', n)
+              for n in os.listdir(os.path.join(base_dir, 'sub'))]
+    compress_fn = lambda p: not p.endswith('f4')
+
+    old_cpu_count = build_utils.multiprocessing.cpu_count
+    old_add_files = build_utils._AddFilesToZipHermeticInParallel
+    calls = []
+    def add_files(*args):
+      calls.append(args)
+      old_add_files(*args)
+    build_utils._AddFilesToZipHermeticInParallel = add_files
+    try:
+      serial = io.BytesIO()
+      build_utils.multiprocessing.cpu_count = lambda: 1
+      build_utils.DoZip(inputs, serial, base_dir, compress_fn=compress_fn)
+      self.assertEqual(0, len(calls))
+
+      parallel = io.BytesIO()
+      build_utils.multiprocessing.cpu_count = lambda: 4
+      build_utils.DoZip(inputs, parallel, base_dir, compress_fn=compress_fn)
+      self.assertEqual(1, len(calls))
+    finally:
+      build_utils.multiprocessing.cpu_count = old_cpu_count
+      build_utils._AddFilesToZipHermeticInParallel = old_add_files
+
+    self.assertEqual(serial.getvalue(), parallel.getvalue())
+
+  def testDoZipReusesEntries(self):
+    base_dir = self._Path('base')
+    os.makedirs(base_dir)
+    inputs = []
+    for i, size in enumerate((0, 10, 100, 2**16)):
+      path = os.path.join(base_dir, 'f%d' % i)
+      with open(path, 'wb') as f:
+        f.write(os.urandom(size // 2) + b'a' * (size - size // 2))
+      inputs.append(path)
+    os.chmod(inputs[2], 0o755)
+    compress_fn = lambda p: not p.endswith('f1')
+    old_zip = self._Path('old.zip')
+    build_utils.DoZip(inputs, old_zip, base_dir, compress_fn=compress_fn)
+
+    with open(inputs[3], 'wb') as f:
+      f.write(b'changed' * 1000)
+    with open(inputs[0], 'wb') as f:
+      f.write(b'not reused')
+    old_cpu_count = build_utils.multiprocessing.cpu_count
+    try:
+      for cpu_count in (1, 4):
+        build_utils.multiprocessing.cpu_count = lambda: cpu_count
+        clean = io.BytesIO()
+        build_utils.DoZip(inputs, clean, base_dir, compress_fn=compress_fn)
+        reused = io.BytesIO()
+        build_utils.DoZip(inputs, reused, base_dir, compress_fn=compress_fn,
+                          reuse_zip=old_zip,
+                          reuse_fn=lambda _, __, p: p in (inputs[1], inputs[2]))
+        self.assertEqual(clean.getvalue(), reused.getvalue())
+
+        # Entries come from |reuse_zip| when |reuse_fn| says so.
+        stale = io.BytesIO()
+        build_utils.DoZip(inputs, stale, base_dir, compress_fn=compress_fn,
+                          reuse_zip=old_zip, reuse_fn=lambda *_: True)
+        with zipfile.ZipFile(stale) as z, zipfile.ZipFile(old_zip) as old:
+          self.assertEqual(_ZipContents(old), _ZipContents(z))
+
+        # By default, entries are reused when their contents match.
+        default = io.BytesIO()
+        build_utils.DoZip(inputs, default, base_dir, compress_fn=compress_fn,
+                          reuse_zip=old_zip)
+        self.assertEqual(clean.getvalue(), default.getvalue())
+    finally:
+      build_utils.multiprocessing.cpu_count = old_cpu_count
+
+  def testExtractAllIncrementally(self):
+    out_dir = self._Path('out')
+    srcjar1 = self._WriteZip('a.srcjar', [
+        ('org/a/A.java', b'A', zipfile.ZIP_DEFLATED),
+        ('org/a/B.java', b'B', zipfile.ZIP_DEFLATED),
+    ])
+    srcjar2 = self._WriteZip('b.srcjar', [
+        ('org/b/C.java', b'C', zipfile.ZIP_STORED),
+        ('org/b/README', b'not java', zipfile.ZIP_STORED),
+    ])
+    result = build_utils.ExtractAllIncrementally(
+        [srcjar1, srcjar2], out_dir, pattern='*.java')
+    a_path = os.path.join(out_dir, 'org', 'a', 'A.java')
+    b_path = os.path.join(out_dir, 'org', 'a', 'B.java')
+    c_path = os.path.join(out_dir, 'org', 'b', 'C.java')
+    self.assertEqual([[a_path, b_path], [c_path]], result)
+
+    old_time = os.stat(a_path).st_mtime - 100
+    for p in (a_path, b_path, c_path):
+      os.utime(p, (old_time, old_time))
+    stale_path = os.path.join(out_dir, 'org', 'stale', 'Stale.java')
+    os.makedirs(os.path.dirname(stale_path))
+    with open(stale_path, 'w') as f:
+      f.write('stale')
+
+    srcjar1 = self._WriteZip('a.srcjar', [
+        ('org/a/A.java', b'A', zipfile.ZIP_DEFLATED),
+        ('org/a/B.java', b'B2', zipfile.ZIP_DEFLATED),
+    ])
+    result = build_utils.ExtractAllIncrementally(
+        [srcjar1, srcjar2], out_dir, pattern='*.java')
+    self.assertEqual([[a_path, b_path], [c_path]], result)
+    self.assertEqual(old_time, os.stat(a_path).st_mtime)
+    self.assertEqual(old_time, os.stat(c_path).st_mtime)
+    self.assertNotEqual(old_time, os.stat(b_path).st_mtime)
+    with open(b_path) as f:
+      self.assertEqual('B2', f.read())
+    self.assertFalse(os.path.exists(os.path.dirname(stale_path)))
+
+  def testExtractAllIncrementallyReplacesDirectories(self):
+    out_dir = self._Path('out')
+    srcjar = self._WriteZip('a.srcjar', [
+        ('org/a/A.java', b'A', zipfile.ZIP_STORED),
+    ])
+    build_utils.ExtractAllIncrementally([srcjar], out_dir)
+    srcjar = self._WriteZip('a.srcjar', [
+        ('org/a', b'now a file', zipfile.ZIP_STORED),
+    ])
+    a_path = os.path.join(out_dir, 'org', 'a')
+    self.assertEqual([[a_path]],
+                     build_utils.ExtractAllIncrementally([srcjar], out_dir))
+    with open(a_path) as f:
+      self.assertEqual('now a file', f.read())
+
+  def testExtractAllIncrementallyRejectsDuplicates(self):
+    srcjar1 = self._WriteZip('a.srcjar', [('A.java', b'A', zipfile.ZIP_STORED)])
+    srcjar2 = self._WriteZip('b.srcjar', [('A.java', b'A', zipfile.ZIP_STORED)])
+    with self.assertRaises(Exception):
+      build_utils.ExtractAllIncrementally([srcjar1, srcjar2], self._Path('out'))
+
+  def testMergeZips(self):
+    big_data = b'0123456789' * 1000
+    in_zip1 = self._WriteZip('in1.zip', [
+        ('a/stored.txt', big_data, zipfile.ZIP_STORED),
+        ('a/deflated.txt', big_data, zipfile.ZIP_DEFLATED),
+        ('a/tiny.txt', b'tiny', zipfile.ZIP_DEFLATED),
+        ('a/empty.txt', b'', zipfile.ZIP_STORED),
+    ])
+    in_zip2 = self._WriteZip('in2.zip', [
+        ('a/stored.txt', b'duplicate', zipfile.ZIP_STORED),
+        ('b/other.txt', big_data, zipfile.ZIP_DEFLATED),
+    ])
+
+    for compress in (None, True, False):
+      out = io.BytesIO()
+      build_utils.MergeZips(out, [in_zip1, in_zip2], compress=compress)
+      with zipfile.ZipFile(out) as z:
+        self.assertIsNone(z.testzip())
+        contents = _ZipContents(z)
+
+      def compress_type(source_compress_type, data):
+        if compress is not None:
+          source_compress_type = (zipfile.ZIP_DEFLATED if compress
+                                  else zipfile.ZIP_STORED)
+        if len(data) < 16:
+          return zipfile.ZIP_STORED
+        return source_compress_type
+
+      attr = build_utils._HERMETIC_FILE_ATTR
+      timestamp = build_utils.HERMETIC_TIMESTAMP
+      self.assertEqual([
+          ('a/stored.txt', compress_type(zipfile.ZIP_STORED, big_data),
+           timestamp, attr, big_data),
+          ('a/deflated.txt', compress_type(zipfile.ZIP_DEFLATED, big_data),
+           timestamp, attr, big_data),
+          ('a/tiny.txt', zipfile.ZIP_STORED, timestamp, attr, b'tiny'),
+          ('a/empty.txt', zipfile.ZIP_STORED, timestamp, attr, b''),
+          ('b/other.txt', compress_type(zipfile.ZIP_DEFLATED, big_data),
+           timestamp, attr, big_data),
+      ], contents)
+
+  def testCopyZipEntryHermeticReusesCompressedBytes(self):
+    data = os.urandom(1000) * 10
+    in_zip = self._WriteZip('in.zip', [('a.bin', data, zipfile.ZIP_DEFLATED)])
+    out = io.BytesIO()
+    with zipfile.ZipFile(in_zip) as src, zipfile.ZipFile(out, 'w') as dst:
+      build_utils.CopyZipEntryHermetic(dst, src, src.getinfo('a.bin'), 'b.bin')
+      src_info = src.getinfo('a.bin')
+    with zipfile.ZipFile(out) as z:
+      info = z.getinfo('b.bin')
+      self.assertEqual(src_info.CRC, info.CRC)
+      self.assertEqual(src_info.compress_size, info.compress_size)
+      self.assertEqual(data, z.read(info))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,242 @@
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Reads the parts of .class files that build scripts care about.
+
+Only the constant pool, the class header, member declarations and a few
+attributes (ConstantValue, Signature, Exceptions, SourceFile) are decoded. Code
+and all other attributes are skipped without being parsed.
+
+See https://docs.oracle.com/javase/specs/jvms/se8/html/jvms-4.html
+"""
+
+import collections
+import re
+import struct
+
+ACC_PUBLIC = 0x0001
+ACC_PRIVATE = 0x0002
+ACC_PROTECTED = 0x0004
+ACC_STATIC = 0x0008
+ACC_FINAL = 0x0010
+
+_CONSTANT_UTF8 = 1
+_CONSTANT_INTEGER = 3
+_CONSTANT_FLOAT = 4
+_CONSTANT_LONG = 5
+_CONSTANT_DOUBLE = 6
+_CONSTANT_CLASS = 7
+_CONSTANT_STRING = 8
+
+# Sizes of the constant pool entries that are skipped, by tag.
+_CONSTANT_SIZES = {
+    9: 4,  # Fieldref
+    10: 4,  # Methodref
+    11: 4,  # InterfaceMethodref
+    12: 4,  # NameAndType
+    15: 3,  # MethodHandle
+    16: 2,  # MethodType
+    17: 4,  # Dynamic
+    18: 4,  # InvokeDynamic
+    19: 2,  # Module
+    20: 2,  # Package
+}
+
+# Class types within descriptors and signatures, e.g. "Lorg/chromium/Foo;".
+_RE_CLASS_TYPE = re.compile(r'L([^;<>:\[.]+)[;<]')
+
+_U2 = struct.Struct('>H')
+_CLASS_HEADER = struct.Struct('>HHHH')
+_MEMBER_HEADER = struct.Struct('>HHH')
+_ATTRIBUTE_HEADER = struct.Struct('>HI')
+
+# |constant_value| is None when the member has no ConstantValue attribute.
+# |signature| is None when the member has no Signature attribute.
+Member = collections.namedtuple(
+    'Member',
+    'access_flags name descriptor constant_value signature exceptions')
+
+
+class ClassFileError(Exception):
+  pass
+
+
+class ClassFile(object):
+  """The declarations of a single class.
+
+  Class names are in internal form, e.g. "org/chromium/Foo$Bar".
+  """
+
+  def __init__(self):
+    self.minor_version = 0
+    self.major_version = 0
+    self.access_flags = 0
+    self.name = None
+    self.super_name = None
+    self.interfaces = []
+    self.fields = []
+    self.methods = []
+    self.signature = None
+    self.source_file = None
+    # Every class that is named by the constant pool, including those only
+    # mentioned in descriptors and signatures. Approximate: string literals
+    # that look like descriptors are included too.
+    self.referenced_classes = set()
+
+
+def _DecodeUtf8(data):
+  """Decodes the "modified UTF-8" of class files."""
+  try:
+    return data.decode('utf-8')
+  except UnicodeDecodeError:
+    # NUL is encoded as two bytes, and supplementary characters as surrogate
+    # pairs.
+    return data.replace(b'\xc0\x80', b'\x00').decode('utf-8', 'surrogatepass')
+
+
+def ParseClassFile(data):
+  """Returns a ClassFile for the contents of a .class file.
+
+  Raises:
+    ClassFileError: If |data| is not a valid class file.
+  """
+  try:
+    return _ParseClassFile(data)
+  except (struct.error, IndexError, KeyError, TypeError) as e:
+    raise ClassFileError('Malformed class file: %s' % e)
+
+
+def _ParseClassFile(data):
+  if data[:4] != b'\xca\xfe\xba\xbe':
+    raise ClassFileError('Not a class file.')
+  ret = ClassFile()
+  ret.minor_version, ret.major_version, cp_count = struct.unpack_from(
+      '>HHH', data, 4)
+
+  # Index -> (tag, value). Class and String entries hold the index of their
+  # Utf8 entry.
+  pool = {}
+  offset = 10
+  index = 1
+  while index < cp_count:
+    tag = data[offset]
+    offset += 1
+    if tag == _CONSTANT_UTF8:
+      (length,) = _U2.unpack_from(data, offset)
+      offset += 2
+      pool[index] = (tag, _DecodeUtf8(data[offset:offset + length]))
+      offset += length
+    elif tag in (_CONSTANT_CLASS, _CONSTANT_STRING):
+      pool[index] = (tag, _U2.unpack_from(data, offset)[0])
+      offset += 2
+    elif tag == _CONSTANT_INTEGER:
+      pool[index] = (tag, struct.unpack_from('>i', data, offset)[0])
+      offset += 4
+    elif tag == _CONSTANT_FLOAT:
+      pool[index] = (tag, struct.unpack_from('>f', data, offset)[0])
+      offset += 4
+    elif tag == _CONSTANT_LONG:
+      pool[index] = (tag, struct.unpack_from('>q', data, offset)[0])
+      offset += 8
+      # 8-byte constants take up two entries.
+      index += 1
+    elif tag == _CONSTANT_DOUBLE:
+      pool[index] = (tag, struct.unpack_from('>d', data, offset)[0])
+      offset += 8
+      index += 1
+    elif tag in _CONSTANT_SIZES:
+      offset += _CONSTANT_SIZES[tag]
+    else:
+      raise ClassFileError('Unknown constant pool tag: %d' % tag)
+    index += 1
+
+  def utf8(i):
+    tag, value = pool[i]
+    if tag != _CONSTANT_UTF8:
+      raise ClassFileError('Expected Utf8 constant at #%d' % i)
+    return value
+
+  def class_name(i):
+    tag, value = pool[i]
+    if tag != _CONSTANT_CLASS:
+      raise ClassFileError('Expected Class constant at #%d' % i)
+    return utf8(value)
+
+  def constant_value(i):
+    tag, value = pool[i]
+    if tag == _CONSTANT_STRING:
+      return utf8(value)
+    if tag in (_CONSTANT_UTF8, _CONSTANT_CLASS):
+      raise ClassFileError('Expected a literal constant at #%d' % i)
+    return value
+
+  referenced_classes = ret.referenced_classes
+  for tag, value in pool.values():
+    if tag == _CONSTANT_CLASS:
+      name = utf8(value)
+      if not name.startswith('['):
+        referenced_classes.add(name)
+    elif tag == _CONSTANT_UTF8 and 'L' in value:
+      referenced_classes.update(_RE_CLASS_TYPE.findall(value))
+
+  ret.access_flags, this_class, super_class, interfaces_count = (
+      _CLASS_HEADER.unpack_from(data, offset))
+  offset += 8
+  ret.name = class_name(this_class)
+  if super_class:
+    ret.super_name = class_name(super_class)
+  for _ in range(interfaces_count):
+    ret.interfaces.append(class_name(_U2.unpack_from(data, offset)[0]))
+    offset += 2
+  referenced_classes.discard(ret.name)
+
+  def read_attributes(offset):
+    """Returns the offset past the attributes, and their offsets by name."""
+    (count,) = _U2.unpack_from(data, offset)
+    offset += 2
+    attributes = {}
+    for _ in range(count):
+      name_index, length = _ATTRIBUTE_HEADER.unpack_from(data, offset)
+      offset += 6
+      attributes[utf8(name_index)] = offset
+      offset += length
+    if offset > len(data):
+      raise ClassFileError('Truncated class file.')
+    return offset, attributes
+
+  def read_index(offset):
+    return _U2.unpack_from(data, offset)[0]
+
+  def read_members(offset, dest):
+    (count,) = _U2.unpack_from(data, offset)
+    offset += 2
+    for _ in range(count):
+      access_flags, name_index, descriptor_index = (
+          _MEMBER_HEADER.unpack_from(data, offset))
+      offset, attributes = read_attributes(offset + 6)
+      value = None
+      if 'ConstantValue' in attributes:
+        value = constant_value(read_index(attributes['ConstantValue']))
+      signature = None
+      if 'Signature' in attributes:
+        signature = utf8(read_index(attributes['Signature']))
+      exceptions = []
+      if 'Exceptions' in attributes:
+        exceptions_offset = attributes['Exceptions']
+        for i in range(read_index(exceptions_offset)):
+          exceptions.append(
+              class_name(read_index(exceptions_offset + 2 + 2 * i)))
+      dest.append(Member(access_flags, utf8(name_index),
+                         utf8(descriptor_index), value, signature, exceptions))
+    return offset
+
+  offset = read_members(offset, ret.fields)
+  offset = read_members(offset, ret.methods)
+
+  _, attributes = read_attributes(offset)
+  if 'Signature' in attributes:
+    ret.signature = utf8(read_index(attributes['Signature']))
+  if 'SourceFile' in attributes:
+    ret.source_file = utf8(read_index(attributes['SourceFile']))
+  return ret
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import class_file_utils
+
+
+class _ClassFileBuilder(object):
+  """Writes minimal class files."""
+
+  def __init__(self):
+    self._pool = []
+    self._indices = {}
+
+  def _Add(self, key, data, size=1):
+    if key not in self._indices:
+      self._indices[key] = len(self._pool) + 1
+      self._pool.append(data)
+      # 8-byte constants take up two entries.
+      self._pool.extend([b''] * (size - 1))
+    return self._indices[key]
+
+  def Utf8(self, value):
+    # Class files encode NUL as two bytes.
+    data = value.encode('utf-8').replace(b'\x00', b'\xc0\x80')
+    return self._Add(('utf8', value),
+                     struct.pack('>BH', 1, len(data)) + data)
+
+  def Class(self, name):
+    return self._Add(('class', name), struct.pack('>BH', 7, self.Utf8(name)))
+
+  def String(self, value):
+    return self._Add(('string', value),
+                     struct.pack('>BH', 8, self.Utf8(value)))
+
+  def Integer(self, value):
+    return self._Add(('int', value), struct.pack('>Bi', 3, value))
+
+  def Float(self, value):
+    return self._Add(('float', value), struct.pack('>Bf', 4, value))
+
+  def Long(self, value):
+    return self._Add(('long', value), struct.pack('>Bq', 5, value), size=2)
+
+  def Double(self, value):
+    return self._Add(('double', value), struct.pack('>Bd', 6, value), size=2)
+
+  def MethodRef(self, class_name, name, descriptor):
+    name_and_type = self._Add(
+        ('nat', name, descriptor),
+        struct.pack('>BHH', 12, self.Utf8(name), self.Utf8(descriptor)))
+    return self._Add(
+        ('method', class_name, name, descriptor),
+        struct.pack('>BHH', 10, self.Class(class_name), name_and_type))
+
+  def Attribute(self, name, data):
+    return struct.pack('>HI', self.Utf8(name), len(data)) + data
+
+  def Member(self, access_flags, name, descriptor, attributes=()):
+    return (struct.pack('>HHHH', access_flags, self.Utf8(name),
+                        self.Utf8(descriptor), len(attributes)) +
+            b''.join(attributes))
+
+  def Build(self, access_flags, name, super_name, interfaces, fields, methods,
+            attributes):
+    body = struct.pack('>HHHH', access_flags, self.Class(name),
+                       self.Class(super_name), len(interfaces))
+    body += b''.join(struct.pack('>H', self.Class(i)) for i in interfaces)
+    body += struct.pack('>H', len(fields)) + b''.join(fields)
+    body += struct.pack('>H', len(methods)) + b''.join(methods)
+    body += struct.pack('>H', len(attributes)) + b''.join(attributes)
+    header = b'\xca\xfe\xba\xbe' + struct.pack('>HHH', 0, 52,
+                                               len(self._pool) + 1)
+    return header + b''.join(self._pool) + body
+
+
+class ClassFileUtilsTest(unittest.TestCase):
+
+  def testParseClassFile(self):
+    b = _ClassFileBuilder()
+    fields = [
+        b.Member(0x19, 'INT', 'I',
+                 [b.Attribute('ConstantValue',
+                              struct.pack('>H', b.Integer(-5)))]),
+        b.Member(0x19, 'LONG', 'J',
+                 [b.Attribute('ConstantValue',
+                              struct.pack('>H', b.Long(2**40)))]),
+        b.Member(0x1a, 'STR', 'Ljava/lang/String;',
+                 [b.Attribute('ConstantValue',
+                              struct.pack('>H', b.String('a\x00é')))]),
+        b.Member(0x2, 'mList', 'Ljava/util/List;',
+                 [b.Attribute('Signature', struct.pack(
+                     '>H', b.Utf8('Ljava/util/List<Lorg/a/Item;>;')))]),
+    ]
+    b.MethodRef('org/a/Helper', 'help', '([Lorg/a/Arg;)V')
+    methods = [
+        b.Member(0x1, 'run', '()V', [
+            b.Attribute('Code', b'\x00' * 12),
+            b.Attribute('Exceptions', struct.pack(
+                '>HH', 1, b.Class('java/io/IOException'))),
+        ]),
+    ]
+    data = b.Build(
+        0x21, 'org/a/Foo', 'org/a/Base', ['java/lang/Runnable'], fields,
+        methods, [b.Attribute('SourceFile',
+                              struct.pack('>H', b.Utf8('Foo.java')))])
+
+    class_file = class_file_utils.ParseClassFile(data)
+    self.assertEqual(52, class_file.major_version)
+    self.assertEqual(0x21, class_file.access_flags)
+    self.assertEqual('org/a/Foo', class_file.name)
+    self.assertEqual('org/a/Base', class_file.super_name)
+    self.assertEqual(['java/lang/Runnable'], class_file.interfaces)
+    self.assertEqual('Foo.java', class_file.source_file)
+    self.assertEqual(
+        [('INT', 'I', -5, None), ('LONG', 'J', 2**40, None),
+         ('STR', 'Ljava/lang/String;', 'a\x00é', None),
+         ('mList', 'Ljava/util/List;', None, 'Ljava/util/List<Lorg/a/Item;>;')],
+        [(f.name, f.descriptor, f.constant_value, f.signature)
+         for f in class_file.fields])
+    self.assertEqual(1, len(class_file.methods))
+    self.assertEqual(('run', '()V', ['java/io/IOException']),
+                     (class_file.methods[0].name,
+                      class_file.methods[0].descriptor,
+                      class_file.methods[0].exceptions))
+    self.assertEqual({
+        'org/a/Base', 'org/a/Helper', 'org/a/Arg', 'org/a/Item',
+        'java/lang/Runnable', 'java/lang/String', 'java/util/List',
+        'java/io/IOException'
+    }, class_file.referenced_classes)
+
+  def testParseClassFileRejectsInvalidData(self):
+    with self.assertRaises(class_file_utils.ClassFileError):
+      class_file_utils.ParseClassFile(b'PK\x03\x04')
+    b = _ClassFileBuilder()
+    data = b.Build(0x21, 'org/a/Foo', 'java/lang/Object', [], [], [], [])
+    with self.assertRaises(class_file_utils.ClassFileError):
+      class_file_utils.ParseClassFile(data[:-4])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,148 @@
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""A size-bounded cache of files, shared between actions and builds.
+
+Entries are looked up by a key that the caller derives from everything that
+determines the file's contents (e.g. digests of inputs, tool versions and
+flags), so entries never need to be invalidated. Entries are written to a
+temporary file and renamed into place, so concurrent builds never see partially
+written entries. The least recently used entries are deleted by Trim() once the
+cache grows beyond its size limit.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+# Trim() walks the whole cache, so it runs at most this often. The cache may
+# exceed its size limit by what is written in between.
+_TRIM_INTERVAL_SECS = 10 * 60
+
+
+class FileCache(object):
+  """A directory of files, keyed by content-derived keys.
+
+  Args:
+    cache_dir: Directory to store entries in. Created on demand.
+    max_size: Trim() deletes entries until the cache is at most this many
+        bytes.
+  """
+
+  def __init__(self, cache_dir, max_size):
+    self._cache_dir = cache_dir
+    self._max_size = max_size
+
+  def _EntryPath(self, key):
+    return os.path.join(self._cache_dir, key[:2], key[2:])
+
+  def Get(self, key, dest_path):
+    """Places the entry for |key| at |dest_path|.
+
+    The entry is hard linked when possible, so |dest_path| must not be
+    modified in place.
+
+    Returns:
+      Whether there was an entry for |key|.
+    """
+    entry_path = self._EntryPath(key)
+    try:
+      # Entries are used in least recently used order by Trim().
+      os.utime(entry_path)
+    except OSError:
+      return False
+    if os.path.lexists(dest_path):
+      os.unlink(dest_path)
+    try:
+      os.link(entry_path, dest_path)
+    except OSError:
+      try:
+        shutil.copyfile(entry_path, dest_path)
+      except (IOError, OSError):
+        # Trimmed by a concurrent build.
+        return False
+    return True
+
+  def Put(self, key, src_path):
+    """Adds a copy of |src_path| as the entry for |key|.
+
+    Failures are silently ignored.
+    """
+    entry_path = self._EntryPath(key)
+    entry_dir = os.path.dirname(entry_path)
+    try:
+      if not os.path.isdir(entry_dir):
+        os.makedirs(entry_dir, exist_ok=True)
+      with tempfile.NamedTemporaryFile(dir=entry_dir, suffix='.tmp',
+                                       delete=False) as f:
+        with open(src_path, 'rb') as src:
+          shutil.copyfileobj(src, f)
+      os.replace(f.name, entry_path)
+    except (IOError, OSError):
+      pass
+
+  def Trim(self):
+    """Deletes least recently used entries while over the size limit.
+
+    Runs at most once per _TRIM_INTERVAL_SECS, since it stats every entry.
+    """
+    stamp_path = os.path.join(self._cache_dir, 'last_trim')
+    now = time.time()
+    try:
+      if now - os.stat(stamp_path).st_mtime < _TRIM_INTERVAL_SECS:
+        return
+    except OSError:
+      if not os.path.isdir(self._cache_dir):
+        return
+    try:
+      # Claims the pass, so concurrent actions do not all trim.
+      with open(stamp_path, 'w'):
+        pass
+    except (IOError, OSError):
+      return
+    entries = []
+    total_size = 0
+    for root, _, files in os.walk(self._cache_dir):
+      if root == self._cache_dir:
+        # Entries are all in subdirectories.
+        continue
+      for name in files:
+        path = os.path.join(root, name)
+        try:
+          st = os.stat(path)
+        except OSError:
+          continue
+        if name.endswith('.tmp'):
+          # Leftovers of interrupted writes.
+          if now - st.st_mtime > 3600:
+            _Unlink(path)
+          continue
+        entries.append((st.st_mtime, st.st_size, path))
+        total_size += st.st_size
+    if total_size <= self._max_size:
+      return
+    entries.sort()
+    for _, size, path in entries:
+      _Unlink(path)
+      total_size -= size
+      if total_size <= self._max_size:
+        break
+
+
+def HashFile(path, digest):
+  """Updates |digest|, a hashlib object, with the contents of |path|.
+
+  Used to derive keys from input files.
+  """
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(2**20), b''):
+      digest.update(chunk)
+
+
+def _Unlink(path):
+  try:
+    os.unlink(path)
+  except OSError:
+    pass
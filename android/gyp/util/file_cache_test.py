@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import file_cache
+
+
+class FileCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.cache_dir = os.path.join(self.temp_dir, 'cache')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def _Write(self, name, data):
+    path = os.path.join(self.temp_dir, name)
+    with open(path, 'w') as f:
+      f.write(data)
+    return path
+
+  def _Read(self, path):
+    with open(path) as f:
+      return f.read()
+
+  def testGetAndPut(self):
+    cache = file_cache.FileCache(self.cache_dir, 2**20)
+    dest = os.path.join(self.temp_dir, 'dest')
+    self.assertFalse(cache.Get('abcdef', dest))
+    self.assertFalse(os.path.exists(dest))
+
+    src = self._Write('src', 'contents')
+    cache.Put('abcdef', src)
+    # Entries are copies.
+    self._Write('src', 'changed')
+    self.assertTrue(cache.Get('abcdef', dest))
+    self.assertEqual('contents', self._Read(dest))
+    # Existing files are replaced.
+    self.assertTrue(cache.Get('abcdef', dest))
+    self.assertEqual('contents', self._Read(dest))
+
+  def testTrimDeletesLeastRecentlyUsed(self):
+    cache = file_cache.FileCache(self.cache_dir, 25)
+    dest = os.path.join(self.temp_dir, 'dest')
+    for i, key in enumerate(('aa1', 'bb2', 'cc3')):
+      cache.Put(key, self._Write('src', str(i) * 10))
+      entry_path = cache._EntryPath(key)
+      os.utime(entry_path, (1000 + i, 1000 + i))
+    # Makes 'aa1' the most recently used.
+    self.assertTrue(cache.Get('aa1', dest))
+
+    cache.Trim()
+    self.assertTrue(cache.Get('aa1', dest))
+    self.assertFalse(cache.Get('bb2', dest))
+    self.assertTrue(cache.Get('cc3', dest))
+
+  def testTrimIsRateLimited(self):
+    cache = file_cache.FileCache(self.cache_dir, 15)
+    dest = os.path.join(self.temp_dir, 'dest')
+    cache.Put('aa1', self._Write('src', '0' * 10))
+    cache.Trim()
+    self.assertTrue(cache.Get('aa1', dest))
+
+    cache.Put('bb2', self._Write('src', '1' * 10))
+    os.utime(cache._EntryPath('aa1'), (1000, 1000))
+    cache.Trim()
+    self.assertTrue(cache.Get('bb2', dest))
+    self.assertTrue(os.path.exists(cache._EntryPath('aa1')))
+
+    # Once the interval has passed, the next Trim() runs.
+    stamp_path = os.path.join(self.cache_dir, 'last_trim')
+    old_time = os.stat(stamp_path).st_mtime - file_cache._TRIM_INTERVAL_SECS
+    os.utime(stamp_path, (old_time, old_time))
+    cache.Trim()
+    self.assertFalse(cache.Get('aa1', dest))
+    self.assertTrue(cache.Get('bb2', dest))
+
+  def testHashFile(self):
+    digest = hashlib.sha1(b'salt')
+    file_cache.HashFile(self._Write('src', 'contents'), digest)
+    self.assertEqual(hashlib.sha1(b'saltcontents').hexdigest(),
+                     digest.hexdigest())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,275 @@
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Runs Java tools in long-lived JVMs.
+
+Actions such as dex.py and main_dex_list.py run a Java tool once per target,
+and much of each run is spent starting a JVM and warming up its JIT. Workers are
+enabled by setting the environment variable:
+    ANDROID_JVM_WORKER_DIR=/path/to/workers
+
+CheckOutput() then sends `java` commands to a worker JVM (see JvmWorker.java),
+which runs the tool's main() in-process and is reused by later actions. Workers
+require Java 11 to 23: they stop tools from exiting the JVM with a
+SecurityManager, which Java 24 removed. With Java 24+, workers fail to start,
+so every command runs in a subprocess.
+
+Workers are keyed by the java binary, JVM flags, classpath (including the
+classpath entries' timestamps) and working directory, listen on a loopback
+port, and exit after ANDROID_JVM_WORKER_IDLE_SECS (default 600) without
+requests. A worker runs one command at a time, so up to
+ANDROID_JVM_WORKER_COUNT (default: half the CPUs) workers are started per key.
+
+Commands run in a subprocess instead when they are not of a supported form, when
+all workers are busy, or when a worker fails to start or dies mid-command. Keys
+whose workers fail to start are not retried until the directory is deleted.
+"""
+
+import fcntl
+import hashlib
+import multiprocessing
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import time
+import zipfile
+
+from util import build_utils
+
+_WORKER_DIR = os.environ.get('ANDROID_JVM_WORKER_DIR')
+_IDLE_TIMEOUT_SECS = int(os.environ.get('ANDROID_JVM_WORKER_IDLE_SECS', 600))
+_MAX_WORKERS = int(
+    os.environ.get('ANDROID_JVM_WORKER_COUNT',
+                   max(1, multiprocessing.cpu_count() // 2)))
+
+_WORKER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'JvmWorker.java')
+
+# How long to wait for a worker to start listening.
+_START_TIMEOUT_SECS = 60
+
+# JvmWorker's exit code when it needs -Djava.security.manager=allow.
+_EXIT_NO_SECURITY_MANAGER = 3
+
+# JVM flags that do not take a separate value.
+_SIMPLE_JVM_FLAG_PREFIXES = ('-D', '-X', '-ea', '-da', '-server')
+
+_INT = struct.Struct('>i')
+
+
+def IsEnabled():
+  return bool(_WORKER_DIR)
+
+
+def CheckOutput(args, **kwargs):
+  """Like build_utils.CheckOutput(), but runs |args| in a worker if enabled."""
+  return build_utils.CheckOutput(args, run_func=RunCommand, **kwargs)
+
+
+def RunCommand(args, cwd=None, env=None):
+  """Like build_utils.RunCommand(), but runs |args| in a worker if enabled."""
+  if _WORKER_DIR and env is None:
+    result = _RunInWorker(args, os.path.abspath(cwd or os.getcwd()))
+    if result is not None:
+      return result
+  return build_utils.RunCommand(args, cwd=cwd, env=env)
+
+
+def _ReadMainClass(jar_path):
+  try:
+    with zipfile.ZipFile(jar_path) as z:
+      manifest = z.read('META-INF/MANIFEST.MF').decode('utf-8')
+  except (IOError, KeyError, zipfile.BadZipfile):
+    return None
+  # Long values are continued on lines that start with a space.
+  manifest = manifest.replace('\r\n', '\n').replace('\n ', '')
+  for line in manifest.splitlines():
+    if line.startswith('Main-Class:'):
+      return line.split(':', 1)[1].strip()
+  return None
+
+
+def _ParseJavaCommand(args, cwd):
+  """Returns (jvm_args, classpath, main_class, tool_args) for a java command.
+
+  Returns None if |args| is not a java command that workers can run.
+  """
+  if os.path.basename(args[0]) != 'java':
+    return None
+  jvm_args = []
+  classpath = None
+  i = 1
+  while i < len(args):
+    arg = args[i]
+    if arg == '-jar' and i + 1 < len(args):
+      main_class = _ReadMainClass(os.path.join(cwd, args[i + 1]))
+      if not main_class:
+        return None
+      return jvm_args, args[i + 1], main_class, args[i + 2:]
+    if arg in ('-cp', '-classpath', '--class-path') and i + 1 < len(args):
+      classpath = args[i + 1]
+      i += 2
+    elif arg.startswith(_SIMPLE_JVM_FLAG_PREFIXES):
+      jvm_args.append(arg)
+      i += 1
+    elif arg.startswith('-') or classpath is None:
+      return None
+    else:
+      return jvm_args, classpath, arg, args[i + 1:]
+  return None
+
+
+def _ComputeKey(java_cmd, cwd):
+  parts = [cwd] + java_cmd
+  classpath = java_cmd[java_cmd.index('-cp') + 1]
+  # Workers must be replaced when tools are rebuilt or updated.
+  for path in [java_cmd[0], _WORKER_SOURCE] + classpath.split(os.pathsep):
+    try:
+      st = os.stat(os.path.join(cwd, path))
+      parts.append('%d %d' % (st.st_size, st.st_mtime_ns))
+    except OSError:
+      parts.append('')
+  return hashlib.sha1('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _RunInWorker(args, cwd):
+  """Returns (returncode, stdout, stderr), or None if no worker ran |args|."""
+  command = _ParseJavaCommand(args, cwd)
+  if command is None:
+    return None
+  jvm_args, classpath, main_class, tool_args = command
+  java_path = shutil.which(args[0])
+  if not java_path:
+    return None
+  java_cmd = [java_path] + jvm_args + ['-cp', classpath]
+  key = _ComputeKey(java_cmd, cwd)
+  os.makedirs(_WORKER_DIR, mode=0o700, exist_ok=True)
+  failed_path = os.path.join(_WORKER_DIR, key + '.failed')
+  if os.path.exists(failed_path):
+    return None
+
+  for slot in range(_MAX_WORKERS):
+    worker = _Worker(java_cmd, cwd,
+                     os.path.join(_WORKER_DIR, '%s-%d' % (key, slot)))
+    if not worker.TryLock():
+      continue
+    try:
+      connection = worker.Connect()
+      if connection is None:
+        with open(failed_path, 'w') as f:
+          f.write(worker.log_path + '\n')
+        return None
+      with connection:
+        return worker.Run(connection, main_class, tool_args)
+    finally:
+      worker.Unlock()
+  return None
+
+
+def _EncodeString(value):
+  data = value.encode('utf-8')
+  return _INT.pack(len(data)) + data
+
+
+def _ReadExactly(f, size):
+  data = f.read(size)
+  if len(data) != size:
+    raise EOFError()
+  return data
+
+
+def _ReadBytes(f):
+  return _ReadExactly(f, _INT.unpack(_ReadExactly(f, _INT.size))[0])
+
+
+class _Worker(object):
+  """A slot for a worker JVM, used by one action at a time."""
+
+  def __init__(self, java_cmd, cwd, path_prefix):
+    self._java_cmd = java_cmd
+    self._cwd = cwd
+    self._port_path = path_prefix + '.port'
+    self._lock_path = path_prefix + '.lock'
+    self.log_path = path_prefix + '.log'
+    self._lock_file = None
+    self._token = None
+
+  def TryLock(self):
+    f = open(self._lock_path, 'a')
+    try:
+      fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+      f.close()
+      return False
+    self._lock_file = f
+    return True
+
+  def Unlock(self):
+    self._lock_file.close()
+
+  def _ReadPortFile(self):
+    try:
+      with open(self._port_path) as f:
+        port, self._token = f.read().split()
+      return int(port)
+    except (IOError, ValueError):
+      return None
+
+  def _TryConnect(self):
+    port = self._ReadPortFile()
+    if port is None:
+      return None
+    try:
+      return socket.create_connection(('127.0.0.1', port))
+    except OSError:
+      return None
+
+  def _Start(self):
+    """Starts a worker. Returns whether it is listening."""
+    if os.path.exists(self._port_path):
+      os.unlink(self._port_path)
+    for extra_args in ([], ['-Djava.security.manager=allow']):
+      cmd = self._java_cmd[:1] + extra_args + self._java_cmd[1:] + [
+          _WORKER_SOURCE, self._port_path, str(_IDLE_TIMEOUT_SECS)]
+      with open(self.log_path, 'wb') as log:
+        # Detached from the action, so that it outlives it without holding on
+        # to its output.
+        process = subprocess.Popen(cmd, cwd=self._cwd, stdin=subprocess.DEVNULL,
+                                   stdout=log, stderr=subprocess.STDOUT,
+                                   start_new_session=True)
+      deadline = time.time() + _START_TIMEOUT_SECS
+      while process.poll() is None:
+        if os.path.exists(self._port_path):
+          return True
+        if time.time() > deadline:
+          process.kill()
+          return False
+        time.sleep(0.02)
+      if process.returncode != _EXIT_NO_SECURITY_MANAGER:
+        return False
+    return False
+
+  def Connect(self):
+    """Returns a socket connected to the worker, starting it if necessary."""
+    connection = self._TryConnect()
+    if connection is None and self._Start():
+      connection = self._TryConnect()
+    return connection
+
+  def Run(self, connection, main_class, args):
+    """Returns (returncode, stdout, stderr), or None if the worker died."""
+    request = [_EncodeString(self._token), _EncodeString(main_class),
+               _INT.pack(len(args))]
+    request.extend(_EncodeString(a) for a in args)
+    try:
+      connection.sendall(b''.join(request))
+      with connection.makefile('rb') as f:
+        returncode = _INT.unpack(_ReadExactly(f, _INT.size))[0]
+        stdout = _ReadBytes(f)
+        stderr = _ReadBytes(f)
+    except (OSError, EOFError):
+      return None
+    return returncode, stdout, stderr
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import fcntl
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_utils
+from util import jvm_worker
+
+# Serves JvmWorker.java's protocol when started as a worker. Reports the pid
+# that ran each command, so that tests can tell whether workers are reused.
+_FAKE_JAVA = r'''#!%s
+import os
+import socket
+import struct
+import sys
+
+if not sys.argv[-3:][0].endswith('JvmWorker.java'):
+  sys.stdout.write('subprocess ' + ' '.join(sys.argv[1:]))
+  sys.exit(0)
+
+def read_string(f):
+  size = struct.unpack('>i', f.read(4))[0]
+  return f.read(size).decode('utf-8')
+
+def write_bytes(data):
+  return struct.pack('>i', len(data)) + data
+
+port_path = sys.argv[-2]
+server = socket.socket()
+server.bind(('127.0.0.1', 0))
+server.listen(5)
+server.settimeout(float(sys.argv[-1]))
+with open(port_path + '.tmp', 'w') as f:
+  f.write('%%d secret\n' %% server.getsockname()[1])
+os.rename(port_path + '.tmp', port_path)
+while True:
+  try:
+    connection = server.accept()[0]
+  except socket.timeout:
+    break
+  with connection, connection.makefile('rb') as f:
+    assert read_string(f) == 'secret'
+    main_class = read_string(f)
+    args = [read_string(f) for _ in range(struct.unpack('>i', f.read(4))[0])]
+    if main_class == 'Exit':
+      os._exit(1)
+    stdout = ' '.join(['worker', str(os.getpid()), main_class] + args)
+    connection.sendall(struct.pack('>i', len(args)) +
+                       write_bytes(stdout.encode('utf-8')) +
+                       write_bytes(b'stderr'))
+'''
+
+
+class JvmWorkerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    bin_dir = os.path.join(self.temp_dir, 'bin')
+    os.mkdir(bin_dir)
+    self.java_path = os.path.join(bin_dir, 'java')
+    with open(self.java_path, 'w') as f:
+      f.write(_FAKE_JAVA % sys.executable)
+    os.chmod(self.java_path, 0o755)
+    self.jar_path = os.path.join(self.temp_dir, 'tool.jar')
+    with zipfile.ZipFile(self.jar_path, 'w') as z:
+      z.writestr('META-INF/MANIFEST.MF',
+                 'Manifest-Version: 1.0\r\nMain-Class: org.chromium.Too\r\n'
+                 ' l\r\n\r\n')
+
+    self._old_values = (jvm_worker._WORKER_DIR, jvm_worker._MAX_WORKERS,
+                        jvm_worker._IDLE_TIMEOUT_SECS)
+    jvm_worker._WORKER_DIR = os.path.join(self.temp_dir, 'workers')
+    jvm_worker._MAX_WORKERS = 1
+    jvm_worker._IDLE_TIMEOUT_SECS = 5
+
+  def tearDown(self):
+    (jvm_worker._WORKER_DIR, jvm_worker._MAX_WORKERS,
+     jvm_worker._IDLE_TIMEOUT_SECS) = self._old_values
+    shutil.rmtree(self.temp_dir)
+
+  def _Run(self, args):
+    return jvm_worker.RunCommand([self.java_path] + args, cwd=self.temp_dir)
+
+  def testParseJavaCommand(self):
+    self.assertEqual(
+        ([], 'tool.jar', 'org.chromium.Tool', ['--flag']),
+        jvm_worker._ParseJavaCommand(['java', '-jar', 'tool.jar', '--flag'],
+                                     self.temp_dir))
+    self.assertEqual(
+        (['-Xmx1G'], 'a.jar:b.jar', 'org.Main', ['-x', 'y']),
+        jvm_worker._ParseJavaCommand(
+            ['java', '-Xmx1G', '-cp', 'a.jar:b.jar', 'org.Main', '-x', 'y'],
+            self.temp_dir))
+    for args in (['javac', '-cp', 'a.jar', 'org.Main'],
+                 ['java', '-javaagent:a.jar', '-cp', 'a.jar', 'org.Main'],
+                 ['java', 'org.Main'],
+                 ['java', '-jar', 'missing.jar']):
+      self.assertIsNone(jvm_worker._ParseJavaCommand(args, self.temp_dir))
+
+  def testWorkersAreReused(self):
+    returncode, stdout, stderr = self._Run(['-jar', 'tool.jar', 'a', 'b'])
+    self.assertEqual(2, returncode)
+    self.assertEqual(b'stderr', stderr)
+    _, pid, main_class, args = stdout.decode().split(' ', 3)
+    self.assertEqual('org.chromium.Tool', main_class)
+    self.assertEqual('a b', args)
+
+    _, stdout, _ = self._Run(['-cp', 'tool.jar', 'org.chromium.Tool', 'c'])
+    self.assertEqual('worker %s org.chromium.Tool c' % pid, stdout.decode())
+
+    # Changing the classpath's contents starts a new worker.
+    os.utime(self.jar_path, (0, 0))
+    _, stdout, _ = self._Run(['-cp', 'tool.jar', 'org.chromium.Tool', 'c'])
+    self.assertNotIn(pid, stdout.decode())
+
+  def testFallsBackToSubprocess(self):
+    # Unsupported command.
+    _, stdout, _ = self._Run(['-version'])
+    self.assertEqual(b'subprocess -version', stdout)
+
+    # Worker dies.
+    _, stdout, _ = self._Run(['-cp', 'tool.jar', 'Exit', 'a'])
+    self.assertEqual(b'subprocess -cp tool.jar Exit a', stdout)
+
+    # All workers are busy.
+    self.assertTrue(self._Run(['-jar', 'tool.jar'])[1].startswith(b'worker'))
+    for name in os.listdir(jvm_worker._WORKER_DIR):
+      if name.endswith('.lock'):
+        with open(os.path.join(jvm_worker._WORKER_DIR, name)) as f:
+          fcntl.flock(f, fcntl.LOCK_EX)
+          _, stdout, _ = self._Run(['-jar', 'tool.jar'])
+          self.assertEqual(b'subprocess -jar tool.jar', stdout)
+
+  def testCheckOutput(self):
+    with self.assertRaises(build_utils.CalledProcessError):
+      jvm_worker.CheckOutput([self.java_path, '-jar', 'tool.jar', 'a'],
+                             cwd=self.temp_dir, print_stderr=False)
+    self.assertEqual(
+        'subprocess -version',
+        jvm_worker.CheckOutput([self.java_path, '-version'], cwd=self.temp_dir))
+
+
+_TOOL_SOURCE = """
+public class Tool {
+    public static void main(String[] args) {
+        System.out.print("out " + String.join(" ", args));
+        System.err.print("err");
+        System.exit(args.length);
+    }
+}
+"""
+
+
+@unittest.skipUnless(
+    shutil.which('java') and shutil.which('javac'), 'requires java and javac')
+class JvmWorkerJavaTest(unittest.TestCase):
+  """Runs commands in real JvmWorker.java workers."""
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    with open(os.path.join(self.temp_dir, 'Tool.java'), 'w') as f:
+      f.write(_TOOL_SOURCE)
+    subprocess.check_call(['javac', 'Tool.java'], cwd=self.temp_dir)
+
+    self._old_values = (jvm_worker._WORKER_DIR, jvm_worker._MAX_WORKERS,
+                        jvm_worker._IDLE_TIMEOUT_SECS)
+    jvm_worker._WORKER_DIR = os.path.join(self.temp_dir, 'workers')
+    jvm_worker._MAX_WORKERS = 1
+    jvm_worker._IDLE_TIMEOUT_SECS = 5
+
+  def tearDown(self):
+    (jvm_worker._WORKER_DIR, jvm_worker._MAX_WORKERS,
+     jvm_worker._IDLE_TIMEOUT_SECS) = self._old_values
+    shutil.rmtree(self.temp_dir)
+
+  def testRunCommand(self):
+    for args in (['a', 'b'], ['c']):
+      self.assertEqual(
+          (len(args), ('out ' + ' '.join(args)).encode(), b'err'),
+          jvm_worker.RunCommand(['java', '-cp', '.', 'Tool'] + args,
+                                cwd=self.temp_dir))
+    names = os.listdir(jvm_worker._WORKER_DIR)
+    # Java 24+ cannot run workers, and falls back to subprocesses.
+    self.assertTrue(
+        any(n.endswith('.port') or n.endswith('.failed') for n in names),
+        names)
+
+
+if __name__ == '__main__':
+  unittest.main()
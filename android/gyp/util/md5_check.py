@@ -9,10 +9,17 @@ import difflib
 import hashlib
 import itertools
 import json
+import mmap
+import multiprocessing
+import multiprocessing.pool
 import os
 import sys
+import tempfile
+import time
 import zipfile
 
+from util import trace_utils
+
 
 # When set and a difference is detected, a diff of what changed is printed.
 PRINT_EXPLANATIONS = int(os.environ.get('PRINT_BUILD_EXPLANATIONS', 0))
@@ -20,6 +27,36 @@ PRINT_EXPLANATIONS = int(os.environ.get('PRINT_BUILD_EXPLANATIONS', 0))
 # An escape hatch that causes all targets to be rebuilt.
 _FORCE_REBUILD = int(os.environ.get('FORCE_REBUILD', 0))
 
+# When set, file digests and zip entry listings are cached in this directory
+# and reused by all actions for as long as a file's stat() info is unchanged.
+_DIGEST_CACHE_DIR = os.environ.get('MD5_CHECK_CACHE_DIR')
+
+# Files modified more recently than this many seconds are not cached, since a
+# second write within the same mtime granularity would go unnoticed.
+_DIGEST_CACHE_RACY_SECONDS = 2
+
+# Records of deleted files are dropped from the cache at most this often.
+_DIGEST_CACHE_PRUNE_INTERVAL_SECS = 24 * 60 * 60
+
+# Digest used to tag input files: one of _DIGEST_CONSTRUCTORS. The algorithm is
+# recorded in .md5.stamp files, so switching it causes one full rebuild rather
+# than comparing tags produced by different algorithms.
+_DIGEST_ALGORITHM = os.environ.get('MD5_CHECK_DIGEST_ALGORITHM', 'md5')
+
+_DIGEST_CONSTRUCTORS = {
+    'md5': hashlib.md5,
+    'sha1': hashlib.sha1,
+    'blake2b': lambda: hashlib.blake2b(digest_size=16),
+}
+
+# Files at least this large are hashed straight from an mmap() view rather
+# than by copying chunks of them into Python.
+_MMAP_THRESHOLD = 2**20
+
+# Upper bound on threads used to hash input files. hashlib releases the GIL
+# while digesting large buffers, so hashing scales with threads.
+_MAX_HASH_WORKERS = 8
+
 
 def CallAndRecordIfStale(
     function, record_path=None, input_paths=None, input_strings=None,
@@ -34,6 +71,15 @@ def CallAndRecordIfStale(
   To debug which files are out-of-date, set the environment variable:
       PRINT_MD5_DIFFS=1
 
+  To share file digests between actions, set the environment variable:
+      MD5_CHECK_CACHE_DIR=/path/to/cache
+
+  To tag input files with a digest other than md5, set the environment
+  variable (one of: md5, sha1, blake2b):
+      MD5_CHECK_DIGEST_ALGORITHM=blake2b
+
+  To record how long each step takes, see util/trace_utils.py.
+
   Args:
     function: The function to call.
     record_path: Path to record metadata.
@@ -58,26 +104,32 @@ def CallAndRecordIfStale(
   new_metadata = _Metadata(track_entries=pass_changes or PRINT_EXPLANATIONS)
   new_metadata.AddStrings(input_strings)
 
-  for path in input_paths:
-    if _IsZipFile(path):
-      entries = _ExtractZipEntries(path)
-      new_metadata.AddZipFile(path, entries)
-    else:
-      new_metadata.AddFile(path, _Md5ForPath(path))
+  # Results are added in the order of |input_paths|, regardless of which
+  # worker finishes first, so that stamp files stay deterministic.
+  with trace_utils.Span('md5_check.HashInputs', num_inputs=len(input_paths)):
+    for path, kind, value in _ComputeInputTags(input_paths):
+      if kind == 'zip':
+        new_metadata.AddZipFile(path, value)
+      elif kind == 'dir':
+        new_metadata.AddDirectory(path, value)
+      else:
+        new_metadata.AddFile(path, value)
 
   old_metadata = None
   force = force or _FORCE_REBUILD
   missing_outputs = [x for x in output_paths if force or not os.path.exists(x)]
-  # When outputs are missing, don't bother gathering change information.
-  if not missing_outputs and os.path.exists(record_path):
-    with open(record_path, 'r') as jsonfile:
-      try:
-        old_metadata = _Metadata.FromFile(jsonfile)
-      except:  # pylint: disable=bare-except
-        pass  # Not yet using new file format.
-
-  changes = Changes(old_metadata, new_metadata, force, missing_outputs)
-  if not changes.HasChanges():
+  with trace_utils.Span('md5_check.CompareStamp'):
+    # When outputs are missing, don't bother gathering change information.
+    if not missing_outputs and os.path.exists(record_path):
+      with open(record_path, 'r') as jsonfile:
+        try:
+          old_metadata = _Metadata.FromFile(jsonfile)
+        except:  # pylint: disable=bare-except
+          pass  # Not yet using new file format.
+
+    changes = Changes(old_metadata, new_metadata, force, missing_outputs)
+    has_changes = changes.HasChanges()
+  if not has_changes:
     return
 
   if PRINT_EXPLANATIONS:
@@ -87,10 +139,12 @@ def CallAndRecordIfStale(
     print(('=' * 80))
 
   args = (changes,) if pass_changes else ()
-  function(*args)
+  with trace_utils.Span('md5_check.OnStale'):
+    function(*args)
 
-  with open(record_path, 'w') as f:
-    new_metadata.ToFile(f)
+  with trace_utils.Span('md5_check.WriteStamp'):
+    with open(record_path, 'w') as f:
+      new_metadata.ToFile(f)
 
 
 class Changes(object):
@@ -105,10 +159,15 @@ class Changes(object):
   def _GetOldTag(self, path, subpath=None):
     return self.old_metadata and self.old_metadata.GetTag(path, subpath)
 
+  def _DigestAlgorithmChanged(self):
+    return (self.old_metadata.DigestAlgorithm() !=
+            self.new_metadata.DigestAlgorithm())
+
   def HasChanges(self):
     """Returns whether any changes exist."""
     return (self.force or
             not self.old_metadata or
+            self._DigestAlgorithmChanged() or
             self.old_metadata.StringsMd5() != self.new_metadata.StringsMd5() or
             self.old_metadata.FilesMd5() != self.new_metadata.FilesMd5())
 
@@ -119,6 +178,7 @@ class Changes(object):
     """
     if (self.force or
         not self.old_metadata or
+        self._DigestAlgorithmChanged() or
         self.old_metadata.StringsMd5() != self.new_metadata.StringsMd5()):
       return False
     if any(self.IterRemovedPaths()):
@@ -143,7 +203,7 @@ class Changes(object):
         yield path
 
   def IterAddedSubpaths(self, path):
-    """Generator for paths that were added within the given zip file."""
+    """Generator for paths that were added within the given zip or directory."""
     for subpath in self.new_metadata.IterSubpaths(path):
       if self._GetOldTag(path, subpath) is None:
         yield subpath
@@ -156,7 +216,7 @@ class Changes(object):
           yield path
 
   def IterRemovedSubpaths(self, path):
-    """Generator for paths that were removed within the given zip file."""
+    """Generator for paths that were removed from the given zip or directory."""
     if self.old_metadata:
       for subpath in self.old_metadata.IterSubpaths(path):
         if self.new_metadata.GetTag(path, subpath) is None:
@@ -171,7 +231,8 @@ class Changes(object):
         yield path
 
   def IterModifiedSubpaths(self, path):
-    """Generator for paths within a zip file whose contents have changed."""
+    """Generator for paths within a zip or directory whose contents have
+    changed."""
     for subpath in self.new_metadata.IterSubpaths(path):
       old_tag = self._GetOldTag(path, subpath)
       new_tag = self.new_metadata.GetTag(path, subpath)
@@ -185,7 +246,8 @@ class Changes(object):
                            self.IterAddedPaths())
 
   def IterChangedSubpaths(self, path):
-    """Generator for paths within a zip that were added/removed/modified."""
+    """Generator for paths within a zip or directory that were
+    added/removed/modified."""
     return itertools.chain(self.IterRemovedSubpaths(path),
                            self.IterModifiedSubpaths(path),
                            self.IterAddedSubpaths(path))
@@ -198,6 +260,10 @@ class Changes(object):
       return 'Outputs do not exist:\n  ' + '\n  '.join(self.missing_outputs)
     elif self.old_metadata is None:
       return 'Previous stamp file not found.'
+    elif self._DigestAlgorithmChanged():
+      return 'Digest algorithm changed: %s -> %s' % (
+          self.old_metadata.DigestAlgorithm(),
+          self.new_metadata.DigestAlgorithm())
 
     if self.old_metadata.StringsMd5() != self.new_metadata.StringsMd5():
       ndiff = difflib.ndiff(self.old_metadata.GetStrings(),
@@ -235,6 +301,7 @@ class _Metadata(object):
   # {
   #   "files-md5": "VALUE",
   #   "strings-md5": "VALUE",
+  #   "digest-algorithm": "md5",
   #   "input-files": [
   #     {
   #       "path": "path.jar",
@@ -243,14 +310,21 @@ class _Metadata(object):
   #         { "path": "org/chromium/base/Foo.class", "tag": "{CRC32}" }, ...
   #       ]
   #     }, {
+  #       "path": "path/to/dir",
+  #       "tag": "{MD5 of entries}",
+  #       "entries": [
+  #         { "path": "values/strings.xml", "tag": "{Digest}" }, ...
+  #       ]
+  #     }, {
   #       "path": "path.txt",
-  #       "tag": "{MD5}",
+  #       "tag": "{Digest using digest-algorithm}",
   #     }
   #   ],
   #   "input-strings": ["a", "b", ...],
   # }
-  def __init__(self, track_entries=False):
+  def __init__(self, track_entries=False, digest_algorithm=None):
     self._track_entries = track_entries
+    self._digest_algorithm = digest_algorithm or _DIGEST_ALGORITHM
     self._files_md5 = None
     self._strings_md5 = None
     self._files = []
@@ -265,6 +339,8 @@ class _Metadata(object):
     obj = json.load(fileobj)
     ret._files_md5 = obj['files-md5']
     ret._strings_md5 = obj['strings-md5']
+    # Stamps written before the algorithm was recorded always used md5.
+    ret._digest_algorithm = obj.get('digest-algorithm', 'md5')
     ret._files = obj.get('input-files', [])
     ret._strings = obj.get('input-strings', [])
     return ret
@@ -274,6 +350,7 @@ class _Metadata(object):
     obj = {
         'files-md5': self.FilesMd5(),
         'strings-md5': self.StringsMd5(),
+        'digest-algorithm': self._digest_algorithm,
     }
     if self._track_entries:
       obj['input-files'] = sorted(self._files, key=lambda e: e['path'])
@@ -310,6 +387,18 @@ class _Metadata(object):
       path: Path to the file.
       entries: List of (subpath, tag) tuples for entries within the zip.
     """
+    self._AddFileWithEntries(path, entries)
+
+  def AddDirectory(self, path, entries):
+    """Adds metadata for a directory.
+
+    Args:
+      path: Path to the directory.
+      entries: List of (subpath, tag) tuples for files within the directory.
+    """
+    self._AddFileWithEntries(path, entries)
+
+  def _AddFileWithEntries(self, path, entries):
     self._AssertNotQueried()
     tag = _ComputeInlineMd5(itertools.chain((e[0] for e in entries),
                                             (e[1] for e in entries)))
@@ -319,6 +408,10 @@ class _Metadata(object):
         'entries': [{"path": e[0], "tag": e[1]} for e in entries],
     })
 
+  def DigestAlgorithm(self):
+    """Returns the name of the digest used for non-zip file tags."""
+    return self._digest_algorithm
+
   def GetStrings(self):
     """Returns the list of input strings."""
     return self._strings
@@ -357,10 +450,10 @@ class _Metadata(object):
     return (e['path'] for e in self._files)
 
   def IterSubpaths(self, path):
-    """Returns a generator for all subpaths in the given zip.
+    """Returns a generator for all subpaths in the given zip or directory.
 
-    If the given path is not a zip file or doesn't exist, returns an empty
-    iterable.
+    If the given path is not a zip file or directory or doesn't exist, returns
+    an empty iterable.
     """
     outer_entry = self._GetEntry(path)
     if not outer_entry:
@@ -369,28 +462,240 @@ class _Metadata(object):
     return (entry['path'] for entry in subentries)
 
 
-def _UpdateMd5ForFile(md5, path, block_size=2**16):
+class _DigestCache(object):
+  """A persistent cache of per-file tags shared between actions.
+
+  Every cached path is stored as its own small JSON file, named after the md5
+  of the path's absolute location. A record is only used when the file's
+  (size, mtime_ns, inode) still match those recorded alongside it.
+
+  Records are written to a temporary file and renamed into place, so
+  concurrent writers (e.g. many ninja jobs hashing the same jar) never expose
+  partially written records. The last writer wins, which is fine since every
+  writer records a value that is valid for the stat key stored with it.
+
+  Args:
+    cache_dir: Directory to store records in. Created on demand.
+  """
+
+  def __init__(self, cache_dir):
+    self._cache_dir = cache_dir
+
+  @staticmethod
+  def StatKey(path):
+    """Returns the key that a cached record for |path| must match."""
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+  def _RecordPath(self, kind, abs_path):
+    name = hashlib.md5((kind + ':' + abs_path).encode()).hexdigest()
+    return os.path.join(self._cache_dir, name[:2], name[2:] + '.json')
+
+  def Get(self, kind, path, stat_key):
+    """Returns the cached value for |path|, or None if missing or stale."""
+    abs_path = os.path.abspath(path)
+    try:
+      with open(self._RecordPath(kind, abs_path)) as f:
+        record = json.load(f)
+    except (IOError, OSError, ValueError):
+      return None
+    if record.get('path') != abs_path or record.get('stat') != stat_key:
+      return None
+    return record.get('value')
+
+  def Put(self, kind, path, stat_key, value):
+    """Records |value| for |path|. Failures are silently ignored."""
+    # Recently modified files could be modified again without their mtime
+    # changing. Wait until they settle before trusting their stat key.
+    if time.time_ns() - stat_key[1] < _DIGEST_CACHE_RACY_SECONDS * 10**9:
+      return
+    abs_path = os.path.abspath(path)
+    record_path = self._RecordPath(kind, abs_path)
+    record_dir = os.path.dirname(record_path)
+    temp_path = None
+    try:
+      if not os.path.isdir(record_dir):
+        os.makedirs(record_dir, exist_ok=True)
+      with tempfile.NamedTemporaryFile('w', dir=record_dir, suffix='.tmp',
+                                       delete=False) as f:
+        temp_path = f.name
+        json.dump({'path': abs_path, 'stat': stat_key, 'value': value}, f)
+      os.replace(temp_path, record_path)
+      temp_path = None
+    except (IOError, OSError):
+      pass
+    finally:
+      if temp_path:
+        _UnlinkIfExists(temp_path)
+
+  def Prune(self):
+    """Deletes records of paths that no longer exist.
+
+    Runs at most once per _DIGEST_CACHE_PRUNE_INTERVAL_SECS, since it reads
+    every record.
+    """
+    stamp_path = os.path.join(self._cache_dir, 'last_prune')
+    now = time.time()
+    try:
+      if now - os.stat(stamp_path).st_mtime < _DIGEST_CACHE_PRUNE_INTERVAL_SECS:
+        return
+    except OSError:
+      if not os.path.isdir(self._cache_dir):
+        return
+    try:
+      # Claims the pass, so concurrent actions do not all prune.
+      with open(stamp_path, 'w'):
+        pass
+    except (IOError, OSError):
+      return
+    for root, _, files in os.walk(self._cache_dir):
+      for name in files:
+        path = os.path.join(root, name)
+        if name.endswith('.tmp'):
+          # Leftovers of writers that were killed.
+          try:
+            if now - os.stat(path).st_mtime > 3600:
+              _UnlinkIfExists(path)
+          except OSError:
+            pass
+          continue
+        if not name.endswith('.json'):
+          continue
+        try:
+          with open(path) as f:
+            record_path = json.load(f).get('path')
+        except (IOError, OSError, ValueError, AttributeError):
+          record_path = None
+        if not record_path or not os.path.exists(record_path):
+          _UnlinkIfExists(path)
+
+  def GetOrCompute(self, kind, path, compute_func):
+    """Returns the cached value for |path|, calling |compute_func| if needed."""
+    stat_key = self.StatKey(path)
+    value = self.Get(kind, path, stat_key)
+    if value is None:
+      value = compute_func(path)
+      self.Put(kind, path, stat_key, value)
+    return value
+
+
+def _UnlinkIfExists(path):
+  try:
+    os.unlink(path)
+  except OSError:
+    pass
+
+
+def _GetDigestCache():
+  """Returns the shared _DigestCache, or None if caching is not enabled."""
+  if not _DIGEST_CACHE_DIR:
+    return None
+  return _DigestCache(_DIGEST_CACHE_DIR)
+
+
+def _ListDirectory(dir_path):
+  """Returns the sorted paths of all files within |dir_path|, relative to it."""
+  ret = []
+  for root, _, files in os.walk(dir_path):
+    ret.extend(os.path.relpath(os.path.join(root, f), dir_path) for f in files)
+  ret.sort()
+  return ret
+
+
+def _ComputeInputTags(input_paths):
+  """Computes tags for all |input_paths| using a pool of threads.
+
+  Directories are expanded up front so that the files within them are hashed
+  (and cached) individually, in parallel with all other inputs.
+
+  Returns:
+    A list of (path, kind, value) tuples, in the same order as |input_paths|.
+    For zip files, |kind| is 'zip' and |value| is the list of entries from
+    _ExtractZipEntries(). For directories, |kind| is 'dir' and |value| is a
+    list of (subpath, digest). Otherwise, |kind| is 'file' and |value| is the
+    digest of the file.
+  """
+  digest_cache = _GetDigestCache()
+  # List of (path, kind, subpaths).
+  inputs = []
+  # List of (file path, is_zip).
+  tasks = []
+  for path in input_paths:
+    if os.path.isdir(path):
+      subpaths = _ListDirectory(path)
+      inputs.append((path, 'dir', subpaths))
+      tasks.extend((os.path.join(path, s), False) for s in subpaths)
+    else:
+      is_zip = _IsZipFile(path)
+      inputs.append((path, 'zip' if is_zip else 'file', None))
+      tasks.append((path, is_zip))
+
+  def compute_func(task):
+    path, is_zip = task
+    if is_zip:
+      return _ExtractZipEntries(path, digest_cache=digest_cache)
+    return _DigestForPath(path, digest_cache=digest_cache)
+
+  num_workers = min(len(tasks), multiprocessing.cpu_count(), _MAX_HASH_WORKERS)
+  if num_workers <= 1:
+    values = [compute_func(t) for t in tasks]
+  else:
+    pool = multiprocessing.pool.ThreadPool(num_workers)
+    try:
+      # map() preserves the order of its inputs.
+      values = pool.map(compute_func, tasks, chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+
+  ret = []
+  values = iter(values)
+  for path, kind, subpaths in inputs:
+    if kind == 'dir':
+      ret.append((path, kind, [(s, next(values)) for s in subpaths]))
+    else:
+      ret.append((path, kind, next(values)))
+  if digest_cache:
+    digest_cache.Prune()
+  return ret
+
+
+def _NewDigest():
+  """Returns a new hashlib object for _DIGEST_ALGORITHM."""
+  constructor = _DIGEST_CONSTRUCTORS.get(_DIGEST_ALGORITHM)
+  if constructor is None:
+    raise Exception('Unknown digest algorithm: %s (expected one of: %s)' % (
+        _DIGEST_ALGORITHM, ', '.join(sorted(_DIGEST_CONSTRUCTORS))))
+  return constructor()
+
+
+def _UpdateDigestForFile(digest, path, block_size=2**16):
   with open(path, 'rb') as infile:
+    if os.fstat(infile.fileno()).st_size >= _MMAP_THRESHOLD:
+      # Hashing the mapping in a single update() avoids copying the file into
+      # Python buffers, and lets hashlib drop the GIL for the whole file.
+      with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        digest.update(view)
+      return
     while True:
       data = infile.read(block_size)
       if not data:
         break
-      md5.update(data)
+      digest.update(data)
 
 
-def _UpdateMd5ForDirectory(md5, dir_path):
-  for root, _, files in os.walk(dir_path):
-    for f in files:
-      _UpdateMd5ForFile(md5, os.path.join(root, f))
+def _DigestForFile(path):
+  digest = _NewDigest()
+  _UpdateDigestForFile(digest, path)
+  return digest.hexdigest()
 
 
-def _Md5ForPath(path):
-  md5 = hashlib.md5()
-  if os.path.isdir(path):
-    _UpdateMd5ForDirectory(md5, path)
-  else:
-    _UpdateMd5ForFile(md5, path)
-  return md5.hexdigest()
+def _DigestForPath(path, digest_cache=None):
+  """Returns the digest of a (non-directory) file, using |digest_cache|."""
+  if digest_cache:
+    return digest_cache.GetOrCompute(
+        'digest-' + _DIGEST_ALGORITHM, path, _DigestForFile)
+  return _DigestForFile(path)
 
 
 def _ComputeInlineMd5(iterable):
@@ -409,8 +714,12 @@ def _IsZipFile(path):
   return path[-4:] in ('.zip', '.apk', '.jar') or path.endswith('.srcjar')
 
 
-def _ExtractZipEntries(path):
+def _ExtractZipEntries(path, digest_cache=None):
   """Returns a list of (path, CRC32) of all files within |path|."""
+  if digest_cache:
+    entries = digest_cache.GetOrCompute('zip', path, _ExtractZipEntries)
+    # JSON turns tuples into lists.
+    return [tuple(e) for e in entries]
   entries = []
   with zipfile.ZipFile(path) as zip_file:
     for zip_info in zip_file.infolist():
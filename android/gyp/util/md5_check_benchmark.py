@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# Copyright 2018 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Measures the cost of md5_check staleness checks on synthetic inputs.
+
+Examples:
+  android/gyp/util/md5_check_benchmark.py --num-jars 50 --jar-size-mb 20
+  android/gyp/util/md5_check_benchmark.py --compare-backends
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import md5_check
+
+
+def _CreateInputs(temp_dir, num_jars, jar_size, num_files, file_size):
+  inputs = []
+  for i in range(num_jars):
+    path = os.path.join(temp_dir, 'lib%d.jar' % i)
+    with zipfile.ZipFile(path, 'w') as z:
+      # Random data, so that the jar really is |jar_size| on disk.
+      entry_size = 256 * 1024
+      for j in range(max(1, jar_size // entry_size)):
+        z.writestr('org/chromium/C%d.class' % j, os.urandom(entry_size))
+    inputs.append(path)
+  for i in range(num_files):
+    path = os.path.join(temp_dir, 'lib%d.so' % i)
+    with open(path, 'wb') as f:
+      f.write(os.urandom(file_size))
+    inputs.append(path)
+  # Keep files out of the digest cache's racy window.
+  old_time = time.time() - 60
+  for path in inputs:
+    os.utime(path, (old_time, old_time))
+  return inputs
+
+
+def _TimeNoOpChecks(inputs, record_path, iterations):
+  md5_check.CallAndRecordIfStale(
+      lambda: None, record_path=record_path, input_paths=inputs, force=True)
+  start = time.time()
+  for _ in range(iterations):
+    md5_check.CallAndRecordIfStale(
+        lambda: None, record_path=record_path, input_paths=inputs)
+  return (time.time() - start) / iterations
+
+
+def _CompareBackends(temp_dir, iterations):
+  # Roughly: a library jar, a large classpath jar and a native library.
+  sizes_mb = (2, 40, 150)
+  paths = []
+  for size_mb in sizes_mb:
+    path = os.path.join(temp_dir, 'input_%dmb' % size_mb)
+    with open(path, 'wb') as f:
+      f.write(os.urandom(size_mb * 1024 * 1024))
+    paths.append(path)
+
+  print('%-8s %-8s' % ('digest', 'reader') +
+        ''.join('%10dMB' % s for s in sizes_mb))
+  old_algorithm = md5_check._DIGEST_ALGORITHM
+  old_threshold = md5_check._MMAP_THRESHOLD
+  try:
+    for algorithm in sorted(md5_check._DIGEST_CONSTRUCTORS):
+      md5_check._DIGEST_ALGORITHM = algorithm
+      for reader, threshold in (('read', 2**62), ('mmap', 0)):
+        md5_check._MMAP_THRESHOLD = threshold
+        timings = []
+        for path in paths:
+          start = time.time()
+          for _ in range(iterations):
+            md5_check._DigestForFile(path)
+          timings.append((time.time() - start) / iterations)
+        print('%-8s %-8s' % (algorithm, reader) +
+              ''.join('%11.3fs' % t for t in timings))
+  finally:
+    md5_check._DIGEST_ALGORITHM = old_algorithm
+    md5_check._MMAP_THRESHOLD = old_threshold
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--num-jars', type=int, default=20)
+  parser.add_argument('--jar-size-mb', type=int, default=10)
+  parser.add_argument('--num-files', type=int, default=20)
+  parser.add_argument('--file-size-mb', type=int, default=10)
+  parser.add_argument('--iterations', type=int, default=5)
+  parser.add_argument('--compare-backends', action='store_true',
+                      help='Compare digest algorithms and file readers.')
+  args = parser.parse_args(argv)
+
+  temp_dir = tempfile.mkdtemp()
+  try:
+    if args.compare_backends:
+      _CompareBackends(temp_dir, args.iterations)
+      return
+
+    inputs = _CreateInputs(temp_dir, args.num_jars,
+                           args.jar_size_mb * 1024 * 1024, args.num_files,
+                           args.file_size_mb * 1024 * 1024)
+    record_path = os.path.join(temp_dir, 'out.md5.stamp')
+
+    md5_check._DIGEST_CACHE_DIR = None
+    uncached = _TimeNoOpChecks(inputs, record_path, args.iterations)
+
+    md5_check._DIGEST_CACHE_DIR = os.path.join(temp_dir, 'cache')
+    cached = _TimeNoOpChecks(inputs, record_path, args.iterations)
+
+    print('No-op check over %d inputs:' % len(inputs))
+    print('  without digest cache: %.3fs' % uncached)
+    print('  with digest cache:    %.3fs' % cached)
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# Copyright 2013 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import md5_check
+
+
+def _WriteZipFile(path, entries):
+  with zipfile.ZipFile(path, 'w') as zip_file:
+    for subpath, data in entries:
+      zip_file.writestr(subpath, data)
+
+
+def _MakeOld(path):
+  """Moves the mtime of |path| outside of the digest cache racy window."""
+  old_time = os.stat(path).st_mtime - 60
+  os.utime(path, (old_time, old_time))
+
+
+class TestMd5Check(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.called = False
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def _Path(self, name):
+    return os.path.join(self.temp_dir, name)
+
+  def _Write(self, name, data):
+    path = self._Path(name)
+    with open(path, 'w') as f:
+      f.write(data)
+    return path
+
+  def _OnStale(self, *_):
+    self.called = True
+
+  def _Check(self, input_paths, input_strings=None, digest_cache=None):
+    self.called = False
+    old_get_digest_cache = md5_check._GetDigestCache
+    md5_check._GetDigestCache = lambda: digest_cache
+    try:
+      md5_check.CallAndRecordIfStale(
+          self._OnStale,
+          record_path=self._Path('out.md5.stamp'),
+          input_paths=input_paths,
+          input_strings=input_strings)
+    finally:
+      md5_check._GetDigestCache = old_get_digest_cache
+    return self.called
+
+  def testCallAndRecordIfStale(self):
+    input_file = self._Write('input.txt', 'a')
+    input_zip = self._Path('input.zip')
+    _WriteZipFile(input_zip, [('a.txt', 'a')])
+
+    self.assertTrue(self._Check([input_file, input_zip], ['s']))
+    self.assertFalse(self._Check([input_file, input_zip], ['s']))
+    self.assertTrue(self._Check([input_file, input_zip], ['t']))
+    self._Write('input.txt', 'b')
+    self.assertTrue(self._Check([input_file, input_zip], ['t']))
+    _WriteZipFile(input_zip, [('a.txt', 'b')])
+    self.assertTrue(self._Check([input_file, input_zip], ['t']))
+    self.assertFalse(self._Check([input_file, input_zip], ['t']))
+
+  def testDirectoryChangesArePerFile(self):
+    input_dir = self._Path('res')
+    os.makedirs(os.path.join(input_dir, 'values'))
+    self._Write(os.path.join('res', 'values', 'strings.xml'), 'a')
+    self._Write(os.path.join('res', 'values', 'colors.xml'), 'a')
+    record_path = self._Path('out.md5.stamp')
+    all_changes = []
+
+    def check():
+      md5_check.CallAndRecordIfStale(
+          all_changes.append,
+          record_path=record_path,
+          input_paths=[input_dir],
+          pass_changes=True)
+
+    check()
+    self._Write(os.path.join('res', 'values', 'strings.xml'), 'b')
+    self._Write(os.path.join('res', 'values', 'dimens.xml'), 'b')
+    check()
+    self.assertEqual(2, len(all_changes))
+    changes = all_changes[-1]
+    self.assertTrue(changes.AddedOrModifiedOnly())
+    self.assertEqual([input_dir], list(changes.IterModifiedPaths()))
+    self.assertEqual([os.path.join('values', 'strings.xml')],
+                     list(changes.IterModifiedSubpaths(input_dir)))
+    self.assertEqual([os.path.join('values', 'dimens.xml')],
+                     list(changes.IterAddedSubpaths(input_dir)))
+
+    os.unlink(os.path.join(input_dir, 'values', 'colors.xml'))
+    check()
+    self.assertEqual(3, len(all_changes))
+    self.assertEqual([os.path.join('values', 'colors.xml')],
+                     list(all_changes[-1].IterRemovedSubpaths(input_dir)))
+
+  def testDigestAlgorithmChangeForcesRebuild(self):
+    input_file = self._Write('input.txt', 'a')
+    old_algorithm = md5_check._DIGEST_ALGORITHM
+    try:
+      self.assertTrue(self._Check([input_file]))
+      self.assertFalse(self._Check([input_file]))
+      md5_check._DIGEST_ALGORITHM = 'blake2b'
+      self.assertTrue(self._Check([input_file]))
+      self.assertFalse(self._Check([input_file]))
+    finally:
+      md5_check._DIGEST_ALGORITHM = old_algorithm
+
+  def testMmapDigestMatchesChunkedDigest(self):
+    input_file = self._Write('input.txt', 'abc' * 100000)
+    old_threshold = md5_check._MMAP_THRESHOLD
+    try:
+      md5_check._MMAP_THRESHOLD = 1
+      mmap_digest = md5_check._DigestForFile(input_file)
+      md5_check._MMAP_THRESHOLD = 2**62
+      chunked_digest = md5_check._DigestForFile(input_file)
+    finally:
+      md5_check._MMAP_THRESHOLD = old_threshold
+    self.assertEqual(mmap_digest, chunked_digest)
+
+  def testComputeInputTagsKeepsInputOrder(self):
+    input_paths = [self._Write('input%d.txt' % i, 'x' * i) for i in range(50)]
+    input_paths.reverse()
+    tags = md5_check._ComputeInputTags(input_paths)
+    self.assertEqual(input_paths, [t[0] for t in tags])
+    self.assertEqual([md5_check._DigestForFile(p) for p in input_paths],
+                     [t[2] for t in tags])
+
+  def testDigestCacheSkipsUnchangedFiles(self):
+    digest_cache = md5_check._DigestCache(self._Path('cache'))
+    input_file = self._Write('input.txt', 'a')
+    input_zip = self._Path('input.zip')
+    _WriteZipFile(input_zip, [('a.txt', 'a')])
+    _MakeOld(input_file)
+    _MakeOld(input_zip)
+
+    self.assertTrue(
+        self._Check([input_file, input_zip], digest_cache=digest_cache))
+    self.assertIsNotNone(digest_cache.Get(
+        'digest-md5', input_file, md5_check._DigestCache.StatKey(input_file)))
+    self.assertIsNotNone(digest_cache.Get(
+        'zip', input_zip, md5_check._DigestCache.StatKey(input_zip)))
+
+    # Cached values are used without re-reading the files.
+    old_md5_for_file = md5_check._DigestForFile
+    md5_check._DigestForFile = None
+    try:
+      self.assertFalse(
+          self._Check([input_file, input_zip], digest_cache=digest_cache))
+    finally:
+      md5_check._DigestForFile = old_md5_for_file
+
+  def testDigestCacheDetectsChanges(self):
+    digest_cache = md5_check._DigestCache(self._Path('cache'))
+    input_file = self._Write('input.txt', 'a')
+    _MakeOld(input_file)
+    self.assertTrue(self._Check([input_file], digest_cache=digest_cache))
+
+    self._Write('input.txt', 'bb')
+    _MakeOld(input_file)
+    self.assertTrue(self._Check([input_file], digest_cache=digest_cache))
+    self.assertFalse(self._Check([input_file], digest_cache=digest_cache))
+
+  def testDigestCacheIgnoresRecentFiles(self):
+    digest_cache = md5_check._DigestCache(self._Path('cache'))
+    input_file = self._Write('input.txt', 'a')
+    self.assertTrue(self._Check([input_file], digest_cache=digest_cache))
+    self.assertIsNone(digest_cache.Get(
+        'digest-md5', input_file, md5_check._DigestCache.StatKey(input_file)))
+
+  def _PutOld(self, digest_cache, name):
+    path = self._Write(name + '.txt', name)
+    _MakeOld(path)
+    digest_cache.Put('digest-md5', path,
+                     md5_check._DigestCache.StatKey(path), name)
+    return path
+
+  def _CachedValues(self, digest_cache):
+    """Returns the sorted values of all records in |digest_cache|."""
+    values = []
+    for root, _, files in os.walk(digest_cache._cache_dir):
+      for name in files:
+        if name.endswith('.json'):
+          with open(os.path.join(root, name)) as f:
+            values.append(json.load(f)['value'])
+    return sorted(values)
+
+  def testDigestCacheRemovesTempFileOnFailure(self):
+    cache_dir = self._Path('cache')
+    digest_cache = md5_check._DigestCache(cache_dir)
+    input_file = self._Write('input.txt', 'a')
+    _MakeOld(input_file)
+    stat_key = md5_check._DigestCache.StatKey(input_file)
+
+    def replace(*_):
+      raise OSError('replace failed')
+
+    old_replace = md5_check.os.replace
+    md5_check.os.replace = replace
+    try:
+      digest_cache.Put('digest-md5', input_file, stat_key, 'abc')
+    finally:
+      md5_check.os.replace = old_replace
+    self.assertEqual([], [f for _, _, files in os.walk(cache_dir)
+                          for f in files])
+
+  def testDigestCachePrunesDeletedFiles(self):
+    digest_cache = md5_check._DigestCache(self._Path('cache'))
+    self._PutOld(digest_cache, 'kept')
+    os.unlink(self._PutOld(digest_cache, 'deleted'))
+    digest_cache.Prune()
+    self.assertEqual(['kept'], self._CachedValues(digest_cache))
+
+    # Pruning is rate limited.
+    os.unlink(self._PutOld(digest_cache, 'deleted'))
+    digest_cache.Prune()
+    self.assertEqual(['deleted', 'kept'], self._CachedValues(digest_cache))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -5,11 +5,13 @@
 import argparse
 import collections
 import contextlib
+import hashlib
 import os
 import re
 import shutil
 import sys
 import tempfile
+import time
 from xml.etree import ElementTree
 
 import util.build_utils as build_utils
@@ -168,28 +170,52 @@ def CreateResourceInfoFile(files_to_zip, zip_path):
       info_file.write('{},{}\n'.format(archive_path, source_path))
 
 
+_RE_TEXT_SYMBOL = re.compile(r'(int(?:\[\])?) (\w+) (\w+) (.+)$')
+_RE_SHARED_PACKAGE_ID = re.compile(r'0x(?:00|02)')
+
+# Parsed R.txt files, by (path, fix_package_ids). Each value is a
+# (stat key, tuple of _TextSymbolEntry) pair. R.txt files are parsed several
+# times per action (e.g. the main one is also the R.txt of its own package),
+# and the entries are shared by all callers.
+_parsed_text_symbols_files = {}
+
+
 def _ParseTextSymbolsFile(path, fix_package_ids=False):
-  """Given an R.txt file, returns a list of _TextSymbolEntry.
+  """Given an R.txt file, returns a tuple of _TextSymbolEntry.
+
+  Results are cached for as long as the file is unchanged.
 
   Args:
     path: Input file path.
     fix_package_ids: if True, 0x00 and 0x02 package IDs read from the file
       will be fixed to 0x7f.
   Returns:
-    A list of _TextSymbolEntry instances.
+    A tuple of _TextSymbolEntry instances.
   Raises:
     Exception: An unexpected line was detected in the input.
   """
-  ret = []
-  with open(path) as f:
-    for line in f:
-      m = re.match(r'(int(?:\[\])?) (\w+) (\w+) (.+)$', line)
-      if not m:
-        raise Exception('Unexpected line in R.txt: %s' % line)
-      java_type, resource_type, name, value = m.groups()
-      if fix_package_ids:
-        value = _FixPackageIds(value)
-      ret.append(_TextSymbolEntry(java_type, resource_type, name, value))
+  st = os.stat(path)
+  stat_key = (st.st_size, st.st_mtime_ns, st.st_ino)
+  cache_key = (os.path.abspath(path), fix_package_ids)
+  cached = _parsed_text_symbols_files.get(cache_key)
+  if cached and cached[0] == stat_key:
+    return cached[1]
+
+  if fix_package_ids:
+    ret = tuple(
+        entry._replace(value=_FixPackageIds(entry.value))
+        for entry in _ParseTextSymbolsFile(path))
+  else:
+    ret = []
+    match = _RE_TEXT_SYMBOL.match
+    with open(path) as f:
+      for line in f:
+        m = match(line)
+        if not m:
+          raise Exception('Unexpected line in R.txt: %s' % line)
+        ret.append(_TextSymbolEntry(*m.groups()))
+    ret = tuple(ret)
+  _parsed_text_symbols_files[cache_key] = (stat_key, ret)
   return ret
 
 
@@ -202,7 +228,7 @@ def _FixPackageIds(resource_value):
   # code in R.java changes to the correct package id at runtime.
   # resource_value is a string with either, a single value '0x12345678', or an
   # array of values like '{ 0xfedcba98, 0x01234567, 0x56789abc }'
-  return re.sub(r'0x(?:00|02)', r'0x7f', resource_value)
+  return _RE_SHARED_PACKAGE_ID.sub('0x7f', resource_value)
 
 
 def _GetRTxtResourceNames(r_txt_path):
@@ -210,13 +236,21 @@ def _GetRTxtResourceNames(r_txt_path):
   return {entry.name for entry in _ParseTextSymbolsFile(r_txt_path)}
 
 
-def GetRTxtStringResourceNames(r_txt_path):
-  """Parse an R.txt file and the list of its string resource names."""
-  return sorted({
+def GetRTxtResourceNamesOfType(r_txt_path, resource_type):
+  """Parse an R.txt file and list its resource names of a given type.
+
+  Names are listed in the order of the file.
+  """
+  return [
       entry.name
       for entry in _ParseTextSymbolsFile(r_txt_path)
-      if entry.resource_type == 'string'
-  })
+      if entry.resource_type == resource_type
+  ]
+
+
+def GetRTxtStringResourceNames(r_txt_path):
+  """Parse an R.txt file and the list of its string resource names."""
+  return sorted(set(GetRTxtResourceNamesOfType(r_txt_path, 'string')))
 
 
 def GenerateStringResourcesWhitelist(module_r_txt_path, whitelist_r_txt_path):
@@ -393,19 +427,17 @@ def CreateRJavaFiles(srcjar_dir, package, main_r_txt_file, extra_res_packages,
       if entry:
         resources_by_type[entry.resource_type].append(entry)
 
+  renderer = _RJavaRenderer(rjava_build_options)
   for package, resources_by_type in resources_by_package.items():
-    _CreateRJavaSourceFile(srcjar_dir, package, resources_by_type,
-                           rjava_build_options)
+    _CreateRJavaSourceFile(srcjar_dir, package, resources_by_type, renderer)
 
 
-def _CreateRJavaSourceFile(srcjar_dir, package, resources_by_type,
-                           rjava_build_options):
+def _CreateRJavaSourceFile(srcjar_dir, package, resources_by_type, renderer):
   """Generates an R.java source file."""
   package_r_java_dir = os.path.join(srcjar_dir, *package.split('.'))
   build_utils.MakeDirectory(package_r_java_dir)
   package_r_java_path = os.path.join(package_r_java_dir, 'R.java')
-  java_file_contents = _RenderRJavaSource(package, resources_by_type,
-                                          rjava_build_options)
+  java_file_contents = renderer.Render(package, resources_by_type)
   with open(package_r_java_path, 'w') as f:
     f.write(java_file_contents)
 
@@ -425,43 +457,21 @@ def _GetNonSystemIndex(entry):
   return len(res_ids)
 
 
-def _RenderRJavaSource(package, resources_by_type, rjava_build_options):
-  """Render an R.java source file. See _CreateRJaveSourceFile for args info."""
-  final_resources_by_type = collections.defaultdict(list)
-  non_final_resources_by_type = collections.defaultdict(list)
-  for res_type, resources in resources_by_type.items():
-    for entry in resources:
-      # Entries in stylable that are not int[] are not actually resource ids
-      # but constants.
-      if rjava_build_options._IsResourceFinal(entry):
-        final_resources_by_type[res_type].append(entry)
-      else:
-        non_final_resources_by_type[res_type].append(entry)
-
-  # Keep these assignments all on one line to make diffing against regular
-  # aapt-generated files easier.
-  create_id = ('{{ e.resource_type }}.{{ e.name }} ^= packageIdTransform;')
-  create_id_arr = ('{{ e.resource_type }}.{{ e.name }}[i] ^='
-                   ' packageIdTransform;')
-  for_loop_condition  = ('int i = {{ startIndex(e) }}; i < '
-                         '{{ e.resource_type }}.{{ e.name }}.length; ++i')
-
-  # Here we diverge from what aapt does. Because we have so many
-  # resources, the onResourcesLoaded method was exceeding the 64KB limit that
-  # Java imposes. For this reason we split onResourcesLoaded into different
-  # methods for each resource type.
-  template = Template("""/* AUTO-GENERATED FILE.  DO NOT MODIFY. */
-
-package {{ package }};
-
-public final class R {
-    private static boolean sResourcesDidLoad;
-    {% for resource_type in resource_types %}
+# Keep these assignments all on one line to make diffing against regular
+# aapt-generated files easier.
+_CREATE_ID = ('{{ e.resource_type }}.{{ e.name }} ^= packageIdTransform;')
+_CREATE_ID_ARR = ('{{ e.resource_type }}.{{ e.name }}[i] ^='
+                  ' packageIdTransform;')
+_FOR_LOOP_CONDITION = ('int i = {{ startIndex(e) }}; i < '
+                       '{{ e.resource_type }}.{{ e.name }}.length; ++i')
+
+# The nested class holding the IDs of one resource type.
+_R_JAVA_CLASS_TEMPLATE = """\
     public static final class {{ resource_type }} {
-        {% for e in final_resources[resource_type] %}
+        {% for e in final_resources %}
         public static final {{ e.java_type }} {{ e.name }} = {{ e.value }};
         {% endfor %}
-        {% for e in non_final_resources[resource_type] %}
+        {% for e in non_final_resources %}
             {% if e.value != '0' %}
         public static {{ e.java_type }} {{ e.name }} = {{ e.value }};
             {% else %}
@@ -469,44 +479,118 @@ public final class R {
             {% endif %}
         {% endfor %}
     }
-    {% endfor %}
-    {% if has_on_resources_loaded %}
-    public static void onResourcesLoaded(int packageId) {
-        assert !sResourcesDidLoad;
-        sResourcesDidLoad = true;
-        int packageIdTransform = (packageId ^ 0x7f) << 24;
-        {% for resource_type in resource_types %}
+"""
+
+# The part of onResourcesLoaded() that handles one resource type.
+_R_JAVA_ON_RESOURCES_LOADED_TEMPLATE = """\
         onResourcesLoaded{{ resource_type|title }}(packageIdTransform);
-        {% for e in non_final_resources[resource_type] %}
+        {% for e in non_final_resources %}
         {% if e.java_type == 'int[]' %}
-        for(""" + for_loop_condition + """) {
-            """ + create_id_arr + """
+        for(""" + _FOR_LOOP_CONDITION + """) {
+            """ + _CREATE_ID_ARR + """
         }
         {% endif %}
         {% endfor %}
-        {% endfor %}
-    }
-    {% for res_type in resource_types %}
-    private static void onResourcesLoaded{{ res_type|title }} (
+"""
+
+# Here we diverge from what aapt does. Because we have so many
+# resources, the onResourcesLoaded method was exceeding the 64KB limit that
+# Java imposes. For this reason we split onResourcesLoaded into different
+# methods for each resource type.
+_R_JAVA_ON_RESOURCES_LOADED_TYPE_TEMPLATE = """\
+    private static void onResourcesLoaded{{ resource_type|title }} (
             int packageIdTransform) {
-        {% for e in non_final_resources[res_type] %}
-        {% if res_type != 'styleable' and e.java_type != 'int[]' %}
-        """ + create_id + """
+        {% for e in non_final_resources %}
+        {% if resource_type != 'styleable' and e.java_type != 'int[]' %}
+        """ + _CREATE_ID + """
         {% endif %}
         {% endfor %}
     }
-    {% endfor %}
-    {% endif %}
-}
-""", trim_blocks=True, lstrip_blocks=True)
+"""
+
+
+class _RJavaRenderer(object):
+  """Renders the R.java files of packages that share an RJavaBuildOptions.
+
+  Packages usually have most of their resources in common (e.g. those of
+  support libraries that they all depend on), so the code of each resource
+  type is rendered once for each distinct list of entries, and reused by all
+  packages with the same list.
+
+  Args:
+    rjava_build_options: An RJavaBuildOptions instance that controls how
+      exactly the R.java files are generated.
+  """
+
+  def __init__(self, rjava_build_options):
+    self._rjava_build_options = rjava_build_options
+    self._templates = [
+        Template(t, trim_blocks=True, lstrip_blocks=True,
+                 keep_trailing_newline=True)
+        for t in (_R_JAVA_CLASS_TEMPLATE, _R_JAVA_ON_RESOURCES_LOADED_TEMPLATE,
+                  _R_JAVA_ON_RESOURCES_LOADED_TYPE_TEMPLATE)
+    ]
+    # Map of (resource_type, entries) -> rendered code, one item per template.
+    self._blocks = {}
+
+  def _RenderBlocks(self, resource_type, entries):
+    key = (resource_type, entries)
+    blocks = self._blocks.get(key)
+    if blocks:
+      return blocks
+    final_resources = []
+    non_final_resources = []
+    for entry in entries:
+      # Entries in stylable that are not int[] are not actually resource ids
+      # but constants.
+      if self._rjava_build_options._IsResourceFinal(entry):
+        final_resources.append(entry)
+      else:
+        non_final_resources.append(entry)
+    has_on_resources_loaded = self._rjava_build_options.has_on_resources_loaded
+    blocks = tuple(
+        template.render(
+            resource_type=resource_type,
+            final_resources=final_resources,
+            non_final_resources=non_final_resources,
+            startIndex=_GetNonSystemIndex)
+        if i == 0 or has_on_resources_loaded else ''
+        for i, template in enumerate(self._templates))
+    self._blocks[key] = blocks
+    return blocks
+
+  def Render(self, package, resources_by_type):
+    """Returns the R.java source of |package|.
 
-  return template.render(
-      package=package,
-      resource_types=sorted(resources_by_type),
-      has_on_resources_loaded=rjava_build_options.has_on_resources_loaded,
-      final_resources=final_resources_by_type,
-      non_final_resources=non_final_resources_by_type,
-      startIndex=_GetNonSystemIndex)
+    Args:
+      package: Java package name.
+      resources_by_type: A dict mapping resource types to lists of
+        _TextSymbolEntry.
+    """
+    all_blocks = [
+        self._RenderBlocks(resource_type,
+                           tuple(resources_by_type[resource_type]))
+        for resource_type in sorted(resources_by_type)
+    ]
+    parts = [
+        '/* AUTO-GENERATED FILE.  DO NOT MODIFY. */\n',
+        '\n',
+        'package %s;\n' % package,
+        '\n',
+        'public final class R {\n',
+        '    private static boolean sResourcesDidLoad;\n',
+    ]
+    parts.extend(blocks[0] for blocks in all_blocks)
+    if self._rjava_build_options.has_on_resources_loaded:
+      parts.append('    public static void onResourcesLoaded(int packageId) {\n'
+                   '        assert !sResourcesDidLoad;\n'
+                   '        sResourcesDidLoad = true;\n'
+                   '        int packageIdTransform = (packageId ^ 0x7f) << 24;\n')
+      parts.extend(blocks[1] for blocks in all_blocks)
+      parts.append('    }\n')
+      parts.extend(blocks[2] for blocks in all_blocks)
+    parts.append('}')
+    return ''.join(parts)
 
 
 def ExtractPackageFromManifest(manifest_path):
@@ -515,9 +599,135 @@ def ExtractPackageFromManifest(manifest_path):
   return doc.getroot().get('package')
 
 
+# When set, dependency resource zips are extracted once into this directory,
+# keyed by their contents, and hard linked into each action's deps_dir.
+_EXTRACTION_STORE_DIR = os.environ.get('RESOURCE_EXTRACTION_STORE_DIR')
+
+# Size limit of _EXTRACTION_STORE_DIR.
+_EXTRACTION_STORE_MAX_SIZE_MB = int(
+    os.environ.get('RESOURCE_EXTRACTION_STORE_MAX_SIZE_MB', 4096))
+
+# Entries used more recently than this are never trimmed, since actions may
+# still be linking them.
+_EXTRACTION_STORE_MIN_AGE_SECS = 3600
+
+
+def _ExtractToStore(zip_path, store_dir):
+  """Returns a read-only directory holding the contents of |zip_path|.
+
+  Directories in the store are never modified once they are renamed into
+  place, so concurrent actions can share them.
+  """
+  digest = hashlib.sha1()
+  with open(zip_path, 'rb') as f:
+    for chunk in iter(lambda: f.read(2**20), b''):
+      digest.update(chunk)
+  entry_dir = os.path.join(store_dir, digest.hexdigest())
+  try:
+    # Entries are trimmed in least recently used order by _TrimStore().
+    os.utime(entry_dir)
+    return entry_dir
+  except OSError:
+    pass
+
+  build_utils.MakeDirectory(store_dir)
+  temp_dir = tempfile.mkdtemp(dir=store_dir, suffix='.tmp')
+  try:
+    build_utils.ExtractAll(zip_path, path=temp_dir)
+    # Guards against writing through the hard links made by _LinkTree().
+    for root, _, files in os.walk(temp_dir):
+      for name in files:
+        path = os.path.join(root, name)
+        if not os.path.islink(path):
+          os.chmod(path, os.stat(path).st_mode & ~0o222)
+    try:
+      os.rename(temp_dir, entry_dir)
+    except OSError:
+      # Another action stored the same zip first.
+      if not os.path.isdir(entry_dir):
+        raise
+  finally:
+    if os.path.exists(temp_dir):
+      shutil.rmtree(temp_dir)
+  return entry_dir
+
+
+def _DirectorySize(path):
+  size = 0
+  for root, _, files in os.walk(path):
+    for name in files:
+      try:
+        size += os.lstat(os.path.join(root, name)).st_size
+      except OSError:
+        pass
+  return size
+
+
+def _TrimStore(store_dir, max_size):
+  """Deletes least recently used entries of |store_dir| while over |max_size|.
+
+  Entries are deleted only once they have not been used for a while. Files
+  already linked into actions' deps_dirs are unaffected.
+  """
+  entries = []
+  total_size = 0
+  now = time.time()
+  for name in os.listdir(store_dir):
+    path = os.path.join(store_dir, name)
+    try:
+      mtime = os.stat(path).st_mtime
+    except OSError:
+      continue
+    if name.endswith('.tmp'):
+      # Leftovers of interrupted extractions.
+      if now - mtime > _EXTRACTION_STORE_MIN_AGE_SECS:
+        shutil.rmtree(path, ignore_errors=True)
+      continue
+    size = _DirectorySize(path)
+    entries.append((mtime, size, path))
+    total_size += size
+  if total_size <= max_size:
+    return
+  entries.sort()
+  for mtime, size, path in entries:
+    if now - mtime <= _EXTRACTION_STORE_MIN_AGE_SECS:
+      break
+    shutil.rmtree(path, ignore_errors=True)
+    total_size -= size
+    if total_size <= max_size:
+      break
+
+
+def _LinkTree(src_dir, dest_dir):
+  """Mirrors |src_dir| into |dest_dir| using hard links to its files.
+
+  Files are copied if they cannot be linked (e.g. across file systems). Links
+  must not be written to in place: replace them instead (e.g. with
+  build_utils.AtomicOutput()).
+  """
+  for root, dirs, files in os.walk(src_dir):
+    dest_root = os.path.join(dest_dir, os.path.relpath(root, src_dir))
+    build_utils.MakeDirectory(dest_root)
+    # os.walk() lists symlinks to directories as directories.
+    symlinks = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+    for name in files + symlinks:
+      src = os.path.join(root, name)
+      dest = os.path.join(dest_root, name)
+      try:
+        os.link(src, dest, follow_symlinks=False)
+      except OSError:
+        shutil.copy2(src, dest, follow_symlinks=False)
+
+
 def ExtractDeps(dep_zips, deps_dir):
   """Extract a list of resource dependency zip files.
 
+  When RESOURCE_EXTRACTION_STORE_DIR is set, each zip is extracted only once
+  per build (and across builds), and its files are hard linked into |deps_dir|.
+  The least recently used extractions are deleted once the store grows beyond
+  RESOURCE_EXTRACTION_STORE_MAX_SIZE_MB.
+  Callers must then replace files rather than modify them in place.
+
   Args:
      dep_zips: A list of zip file paths, each one will be extracted to
        a subdirectory of |deps_dir|, named after the zip file's path (e.g.
@@ -535,8 +745,13 @@ def ExtractDeps(dep_zips, deps_dir):
     subdir = os.path.join(deps_dir, subdirname)
     if os.path.exists(subdir):
       raise Exception('Resource zip name conflict: ' + subdirname)
-    build_utils.ExtractAll(z, path=subdir)
+    if _EXTRACTION_STORE_DIR:
+      _LinkTree(_ExtractToStore(z, _EXTRACTION_STORE_DIR), subdir)
+    else:
+      build_utils.ExtractAll(z, path=subdir)
     dep_subdirs.append(subdir)
+  if _EXTRACTION_STORE_DIR and dep_zips:
+    _TrimStore(_EXTRACTION_STORE_DIR, _EXTRACTION_STORE_MAX_SIZE_MB * 2**20)
   return dep_subdirs
 
 
@@ -675,6 +890,13 @@ def HandleCommonOptions(options):
     options.aapt2_path = options.aapt_path + '2'
 
 
+_RE_RESOURCES_START = re.compile('<resources([^>]*)>', re.MULTILINE)
+_RE_NAMESPACE = re.compile(r'\s*(xmlns:(\w+)="([^"]+)")')
+_RE_STRING_ELEMENT_START = re.compile(
+    '<string ([^>]* )?name="([^">]+)"[^>]*>')
+_RE_STRING_ELEMENT_END = re.compile('</string>')
+
+
 def ParseAndroidResourceStringsFromXml(xml_data):
   """Parse and Android xml resource file and extract strings from it.
 
@@ -692,37 +914,37 @@ def ParseAndroidResourceStringsFromXml(xml_data):
   #         name="abc_shareactionprovider_share_with_application">\
   #             "Condividi tramite <ns1:g id="APPLICATION_NAME">%s</ns1:g>"\
   #      </string>
+  #
+  # Matching resumes from an offset rather than slicing off what was already
+  # parsed, so that large translation files are not copied once per string.
   result = {}
 
   # Find <resources> start tag and extract namespaces from it.
-  m = re.search('<resources([^>]*)>', xml_data, re.MULTILINE)
+  m = _RE_RESOURCES_START.search(xml_data)
   if not m:
     raise Exception('<resources> start tag expected: ' + xml_data)
-  input_data = xml_data[m.end():]
+  pos = m.end()
   resource_attrs = m.group(1)
-  re_namespace = re.compile('\s*(xmlns:(\w+)="([^"]+)")')
   namespaces = {}
-  while resource_attrs:
-    m = re_namespace.match(resource_attrs)
+  attrs_pos = 0
+  while attrs_pos < len(resource_attrs):
+    m = _RE_NAMESPACE.match(resource_attrs, attrs_pos)
     if not m:
       break
     namespaces[m.group(2)] = m.group(3)
-    resource_attrs = resource_attrs[m.end(1):]
+    attrs_pos = m.end(1)
 
   # Find each string element now.
-  re_string_element_start = re.compile('<string ([^>]* )?name="([^">]+)"[^>]*>')
-  re_string_element_end = re.compile('</string>')
-  while input_data:
-    m = re_string_element_start.search(input_data)
+  while pos < len(xml_data):
+    m = _RE_STRING_ELEMENT_START.search(xml_data, pos)
     if not m:
       break
     name = m.group(2)
-    input_data = input_data[m.end():]
-    m2 = re_string_element_end.search(input_data)
+    m2 = _RE_STRING_ELEMENT_END.search(xml_data, m.end())
     if not m2:
-      raise Exception('Expected closing string tag: ' + input_data)
-    text = input_data[:m2.start()]
-    input_data = input_data[m2.end():]
+      raise Exception('Expected closing string tag: ' + xml_data[m.end():])
+    text = xml_data[m.end():m2.start()]
+    pos = m2.end()
     if len(text) and text[0] == '"' and text[-1] == '"':
       text = text[1:-1]
     result[name] = text
@@ -741,19 +963,18 @@ def GenerateAndroidResourceStringsXml(names_to_utf8_text, namespaces=None):
     New non-Unicode string containing an XML data structure describing the
     input as an Android resource .xml file.
   """
-  result = '<?xml version="1.0" encoding="utf-8"?>\n'
-  result += '<resources'
+  result = ['<?xml version="1.0" encoding="utf-8"?>\n', '<resources']
   if namespaces:
     for prefix, url in sorted(namespaces.items()):
-      result += ' xmlns:%s="%s"' % (prefix, url)
-  result += '>\n'
+      result.append(' xmlns:%s="%s"' % (prefix, url))
+  result.append('>\n')
   if not names_to_utf8_text:
-    result += '<!-- this file intentionally empty -->\n'
+    result.append('<!-- this file intentionally empty -->\n')
   else:
     for name, utf8_text in sorted(names_to_utf8_text.items()):
-      result += '<string name="%s">"%s"</string>\n' % (name, utf8_text)
-  result += '</resources>\n'
-  return result
+      result.append('<string name="%s">"%s"</string>\n' % (name, utf8_text))
+  result.append('</resources>\n')
+  return ''.join(result)
 
 
 def FilterAndroidResourceStringsXml(xml_file_path, string_predicate):
@@ -768,7 +989,7 @@ def FilterAndroidResourceStringsXml(xml_file_path, string_predicate):
     string_predicate: A predicate function which will receive the string name
       and shal
   """
-  with open(xml_file_path) as f:
+  with open(xml_file_path, encoding='utf-8') as f:
     xml_data = f.read()
   strings_map, namespaces = ParseAndroidResourceStringsFromXml(xml_data)
 
@@ -780,5 +1001,7 @@ def FilterAndroidResourceStringsXml(xml_file_path, string_predicate):
 
   if string_deletion:
     new_xml_data = GenerateAndroidResourceStringsXml(strings_map, namespaces)
-    with open(xml_file_path, 'wb') as f:
-      f.write(new_xml_data)
+    # Replaces rather than rewrites the file, which may be a hard link into
+    # ExtractDeps()'s store.
+    with build_utils.AtomicOutput(xml_file_path) as f:
+      f.write(new_xml_data.encode('utf-8'))
@@ -0,0 +1,90 @@
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Records timed spans of build actions as Chrome trace events.
+
+Tracing is enabled by setting the environment variable:
+    ANDROID_ACTION_TRACE_DIR=/path/to/traces
+
+Each action process then writes one JSON trace event per line to its own
+<dir>/<pid>-<start time>.trace (pids are reused during long builds). Use
+build/android/merge_action_traces.py to combine them into a single trace that
+can be loaded in chrome://tracing or Perfetto.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+
+_TRACE_DIR = os.environ.get('ANDROID_ACTION_TRACE_DIR')
+
+# The (pid, file) that events are written to. Reopened after a fork.
+_trace_file = None
+
+
+def IsEnabled():
+  return bool(_TRACE_DIR)
+
+
+def _Now():
+  # Wall-clock microseconds, so that events from different processes line up.
+  return int(time.time() * 1000000)
+
+
+def _GetTraceFile():
+  global _trace_file
+  pid = os.getpid()
+  if _trace_file and _trace_file[0] == pid:
+    return _trace_file[1]
+  if not os.path.isdir(_TRACE_DIR):
+    os.makedirs(_TRACE_DIR, exist_ok=True)
+  f = open(os.path.join(_TRACE_DIR, '%d-%d.trace' % (pid, time.time_ns())),
+           'w')
+  _trace_file = (pid, f)
+  _WriteEvent(f, {
+      'ph': 'M',
+      'name': 'process_name',
+      'pid': pid,
+      'tid': 0,
+      'args': {'name': os.path.basename(sys.argv[0])},
+  })
+  return f
+
+
+def _WriteEvent(f, event):
+  # One write() per line, so that a partially written trace can still be read.
+  f.write(json.dumps(event, sort_keys=True, default=str) + '\n')
+  f.flush()
+
+
+@contextlib.contextmanager
+def Span(name, **kwargs):
+  """Records the time spent in the with-block as a complete ("X") event.
+
+  Args:
+    name: Name of the span, e.g. "md5_check".
+    kwargs: JSON-serializable values shown as the event's arguments.
+  """
+  if not _TRACE_DIR:
+    yield
+    return
+  start = _Now()
+  try:
+    yield
+  finally:
+    end = _Now()
+    _WriteEvent(_GetTraceFile(), {
+        'ph': 'X',
+        'name': name,
+        'cat': 'action',
+        'ts': start,
+        'dur': end - start,
+        'pid': os.getpid(),
+        'tid': threading.current_thread().ident,
+        'args': kwargs,
+    })
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_utils
+from util import trace_utils
+
+
+class TraceUtilsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.trace_dir = os.path.join(self.temp_dir, 'traces')
+    self.old_trace_dir = trace_utils._TRACE_DIR
+    trace_utils._TRACE_DIR = self.trace_dir
+
+  def tearDown(self):
+    trace_utils._TRACE_DIR = self.old_trace_dir
+    if trace_utils._trace_file:
+      trace_utils._trace_file[1].close()
+      trace_utils._trace_file = None
+    shutil.rmtree(self.temp_dir)
+
+  def _ReadEvents(self):
+    names = os.listdir(self.trace_dir)
+    self.assertEqual(1, len(names))
+    self.assertTrue(names[0].startswith('%d-' % os.getpid()))
+    with open(os.path.join(self.trace_dir, names[0])) as f:
+      return [json.loads(l) for l in f]
+
+  def testDisabledWritesNothing(self):
+    trace_utils._TRACE_DIR = None
+    with trace_utils.Span('span'):
+      pass
+    self.assertFalse(os.path.exists(self.trace_dir))
+
+  def testSpanRecordsCompleteEvent(self):
+    with trace_utils.Span('outer', arg='value'):
+      with trace_utils.Span('inner'):
+        pass
+    events = self._ReadEvents()
+    self.assertEqual(['M', 'X', 'X'], [e['ph'] for e in events])
+    inner, outer = events[1:]
+    self.assertEqual(('inner', 'outer'), (inner['name'], outer['name']))
+    self.assertEqual({'arg': 'value'}, outer['args'])
+    self.assertLessEqual(outer['ts'], inner['ts'])
+    self.assertGreaterEqual(outer['ts'] + outer['dur'],
+                            inner['ts'] + inner['dur'])
+
+  def testReusedPidsWriteSeparateFiles(self):
+    with trace_utils.Span('first'):
+      pass
+    # As when a later action gets the same pid.
+    trace_utils._trace_file[1].close()
+    trace_utils._trace_file = None
+    with trace_utils.Span('second'):
+      pass
+    self.assertEqual(2, len(os.listdir(self.trace_dir)))
+
+  def testCallAndWriteDepfileIfStale(self):
+    output = os.path.join(self.temp_dir, 'out.txt')
+    options = argparse.Namespace(depfile=output + '.d')
+
+    def on_stale():
+      build_utils.CheckOutput(['true'])
+      build_utils.Touch(output)
+
+    for _ in range(2):
+      build_utils.CallAndWriteDepfileIfStale(
+          on_stale, options, output_paths=[output], add_pydeps=False)
+    names = [e['name'] for e in self._ReadEvents() if e['ph'] == 'X']
+    self.assertEqual([
+        'build_utils.ComputePythonDependencies',
+        'md5_check.HashInputs',
+        'md5_check.CompareStamp',
+        'build_utils.CheckOutput',
+        'build_utils.Function',
+        'build_utils.WriteDepfile',
+        'md5_check.OnStale',
+        'md5_check.WriteStamp',
+        'build_utils.CallAndWriteDepfileIfStale',
+        # Up-to-date the second time.
+        'build_utils.ComputePythonDependencies',
+        'md5_check.HashInputs',
+        'md5_check.CompareStamp',
+        'build_utils.CallAndWriteDepfileIfStale',
+    ], names)
+
+
+if __name__ == '__main__':
+  unittest.main()
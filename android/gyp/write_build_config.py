@@ -548,6 +548,7 @@ import os
 import sys
 import xml.dom.minidom
 
+from util import build_config_index
 from util import build_utils
 
 # Types that should never be used as a dependency of another build config.
@@ -606,11 +607,18 @@ class AndroidManifest(object):
     return self.manifest.getAttribute('package')
 
 
+# Set BUILD_CONFIG_INDEX_DIR to share parsed deps_info and transitive deps
+# between invocations. See util/build_config_index.py.
+_build_config_index = build_config_index.GetIndex()
+
 dep_config_cache = {}
 def GetDepConfig(path):
   if not path in dep_config_cache:
-    with open(path) as jsonfile:
-      dep_config_cache[path] = json.load(jsonfile)['deps_info']
+    if _build_config_index:
+      dep_config_cache[path] = _build_config_index.GetDepsInfo(path)
+    else:
+      with open(path) as jsonfile:
+        dep_config_cache[path] = json.load(jsonfile)['deps_info']
   return dep_config_cache[path]
 
 
@@ -619,54 +627,70 @@ def DepsOfType(wanted_type, configs):
 
 
 def GetAllDepsConfigsInOrder(deps_config_paths):
+  if _build_config_index:
+    return _build_config_index.GetAllDepsInOrder(deps_config_paths)
+
   def GetDeps(path):
     return GetDepConfig(path)['deps_configs']
   return build_utils.GetSortedTransitiveDependencies(deps_config_paths, GetDeps)
 
 
 class Deps(object):
+  """The transitive deps of a target, in dependency order.
+
+  Configs are indexed by path and by type, so that lookups and removals do not
+  scan the whole list.
+  """
+
   def __init__(self, direct_deps_config_paths):
-    self.all_deps_config_paths = GetAllDepsConfigsInOrder(
-        direct_deps_config_paths)
-    self.direct_deps_configs = [
-        GetDepConfig(p) for p in direct_deps_config_paths]
-    self.all_deps_configs = [
-        GetDepConfig(p) for p in self.all_deps_config_paths]
     self.direct_deps_config_paths = direct_deps_config_paths
+    self._direct_deps_config_paths_set = set(direct_deps_config_paths)
+    # Dicts keep insertion (i.e. dependency) order.
+    self._all_deps_configs = collections.OrderedDict(
+        (p, GetDepConfig(p))
+        for p in GetAllDepsConfigsInOrder(direct_deps_config_paths))
+    self._all_deps_configs_by_type = collections.defaultdict(
+        collections.OrderedDict)
+    for path, config in self._all_deps_configs.items():
+      self._all_deps_configs_by_type[config['type']][path] = config
+    self._direct_deps_configs = [
+        GetDepConfig(p) for p in direct_deps_config_paths]
+    self._direct_deps_configs_by_type = collections.defaultdict(list)
+    for config in self._direct_deps_configs:
+      self._direct_deps_configs_by_type[config['type']].append(config)
 
   def All(self, wanted_type=None):
-    if type is None:
-      return self.all_deps_configs
-    return DepsOfType(wanted_type, self.all_deps_configs)
+    if wanted_type is None:
+      return list(self._all_deps_configs.values())
+    return list(self._all_deps_configs_by_type.get(wanted_type, {}).values())
 
   def Direct(self, wanted_type=None):
     if wanted_type is None:
-      return self.direct_deps_configs
-    return DepsOfType(wanted_type, self.direct_deps_configs)
+      return list(self._direct_deps_configs)
+    return list(self._direct_deps_configs_by_type.get(wanted_type, []))
 
   def AllConfigPaths(self):
-    return self.all_deps_config_paths
+    return list(self._all_deps_configs)
 
   def RemoveNonDirectDep(self, path):
-    if path in self.direct_deps_config_paths:
+    if path in self._direct_deps_config_paths_set:
       raise Exception('Cannot remove direct dep.')
-    self.all_deps_config_paths.remove(path)
-    self.all_deps_configs.remove(GetDepConfig(path))
+    config = self._all_deps_configs.pop(path)
+    del self._all_deps_configs_by_type[config['type']][path]
 
   def GradlePrebuiltJarPaths(self):
-    ret = []
+    ret = collections.OrderedDict()
 
     def helper(cur):
       for config in cur.Direct('java_library'):
         if config['is_prebuilt'] or config['gradle_treat_as_prebuilt']:
-          if config['jar_path'] not in ret:
-            ret.append(config['jar_path'])
+          ret[config['jar_path']] = None
 
     helper(self)
-    return ret
+    return list(ret)
 
   def GradleLibraryProjectDeps(self):
-    ret = []
+    ret = collections.OrderedDict()
 
     def helper(cur):
       for config in cur.Direct('java_library'):
@@ -674,11 +698,11 @@ class Deps(object):
           pass
         elif config['gradle_treat_as_prebuilt']:
           helper(Deps(config['deps_configs']))
-        elif config not in ret:
-          ret.append(config)
+        else:
+          ret.setdefault(config['path'], config)
 
     helper(self)
-    return ret
+    return list(ret.values())
 
 
 def _MergeAssets(all_assets):
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Measures write_build_config.Deps on a synthetic dependency graph.
+
+Compares against the previous list-based implementation.
+
+Example:
+  android/gyp/write_build_config_benchmark.py --num-deps 10000
+"""
+
+import argparse
+import random
+import sys
+import time
+
+import write_build_config
+
+
+_TYPES = ('java_library', 'android_resources', 'android_assets', 'group',
+          'system_java_library', 'android_app_bundle_module')
+
+
+class _ListDeps(object):
+  """write_build_config.Deps as it was before it was indexed.
+
+  Copied verbatim, apart from module prefixes and the recursive Deps(), so
+  that it keeps its quirks: All() with no type compares the builtin "type"
+  against None, so it returns no configs.
+  """
+
+  def __init__(self, direct_deps_config_paths):
+    self.all_deps_config_paths = write_build_config.GetAllDepsConfigsInOrder(
+        direct_deps_config_paths)
+    self.direct_deps_configs = [
+        write_build_config.GetDepConfig(p) for p in direct_deps_config_paths]
+    self.all_deps_configs = [
+        write_build_config.GetDepConfig(p) for p in self.all_deps_config_paths]
+    self.direct_deps_config_paths = direct_deps_config_paths
+
+  def All(self, wanted_type=None):
+    if type is None:
+      return self.all_deps_configs
+    return write_build_config.DepsOfType(wanted_type, self.all_deps_configs)
+
+  def Direct(self, wanted_type=None):
+    if wanted_type is None:
+      return self.direct_deps_configs
+    return write_build_config.DepsOfType(wanted_type, self.direct_deps_configs)
+
+  def AllConfigPaths(self):
+    return self.all_deps_config_paths
+
+  def RemoveNonDirectDep(self, path):
+    if path in self.direct_deps_config_paths:
+      raise Exception('Cannot remove direct dep.')
+    self.all_deps_config_paths.remove(path)
+    self.all_deps_configs.remove(write_build_config.GetDepConfig(path))
+
+  def GradlePrebuiltJarPaths(self):
+    ret = []
+
+    def helper(cur):
+      for config in cur.Direct('java_library'):
+        if config['is_prebuilt'] or config['gradle_treat_as_prebuilt']:
+          if config['jar_path'] not in ret:
+            ret.append(config['jar_path'])
+
+    helper(self)
+    return ret
+
+  def GradleLibraryProjectDeps(self):
+    ret = []
+
+    def helper(cur):
+      for config in cur.Direct('java_library'):
+        if config['is_prebuilt']:
+          pass
+        elif config['gradle_treat_as_prebuilt']:
+          helper(_ListDeps(config['deps_configs']))
+        elif config not in ret:
+          ret.append(config)
+
+    helper(self)
+    return ret
+
+
+def _CreateGraph(num_deps, num_direct_deps):
+  """Adds configs to write_build_config's cache. Returns the direct deps."""
+  rand = random.Random(0)
+  paths = ['gen/dep%d.build_config' % i for i in range(num_deps)]
+  for i, path in enumerate(paths):
+    write_build_config.dep_config_cache[path] = {
+        'path': path,
+        'type': rand.choice(_TYPES),
+        'deps_configs': rand.sample(paths[:i], min(i, 3)),
+        'jar_path': path + '.jar',
+        'is_prebuilt': rand.random() < 0.2,
+        'gradle_treat_as_prebuilt': rand.random() < 0.05,
+    }
+  return paths[-num_direct_deps:]
+
+
+def _Exercise(deps_class, direct_paths, num_removals):
+  deps = deps_class(direct_paths)
+  # Roughly the queries that main() makes for an android_apk.
+  for _ in range(3):
+    for t in _TYPES:
+      deps.All(t)
+      deps.Direct(t)
+    deps.AllConfigPaths()
+  results = [
+      deps.GradlePrebuiltJarPaths(),
+      [c['path'] for c in deps.GradleLibraryProjectDeps()],
+  ]
+  direct = set(direct_paths)
+  removable = [p for p in deps.AllConfigPaths() if p not in direct]
+  for path in removable[:num_removals]:
+    deps.RemoveNonDirectDep(path)
+  # All() is not compared without a type, since _ListDeps returns no configs.
+  results.append(list(deps.AllConfigPaths()))
+  results.extend([c['path'] for c in deps.All(t)] for t in _TYPES)
+  return results
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--num-deps', type=int, default=10000)
+  parser.add_argument('--num-direct-deps', type=int, default=3000)
+  parser.add_argument('--num-removals', type=int, default=5000)
+  parser.add_argument('--iterations', type=int, default=3)
+  args = parser.parse_args(argv)
+
+  direct_paths = _CreateGraph(args.num_deps, args.num_direct_deps)
+  num_transitive = len(
+      write_build_config.GetAllDepsConfigsInOrder(direct_paths))
+  print('%d direct deps, %d transitive deps' % (len(direct_paths),
+                                                num_transitive))
+  results = {}
+  for name, deps_class in (('list', _ListDeps),
+                           ('indexed', write_build_config.Deps)):
+    start = time.time()
+    for _ in range(args.iterations):
+      results[name] = _Exercise(deps_class, direct_paths, args.num_removals)
+    elapsed = (time.time() - start) / args.iterations
+    print('%-8s %.3fs' % (name, elapsed))
+  assert results['list'] == results['indexed']
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
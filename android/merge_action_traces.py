@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+#
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Merges per-action trace files into a single Chrome trace-event JSON file.
+
+Usage:
+  ANDROID_ACTION_TRACE_DIR=/tmp/traces autoninja -C out/Debug chrome_public_apk
+  build/android/merge_action_traces.py /tmp/traces --output trace.json \\
+      --summary 20
+
+The output can be loaded in chrome://tracing or https://ui.perfetto.dev.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import sys
+
+# Top-level span of build_utils.CallAndWriteDepfileIfStale().
+_ACTION_SPAN_NAME = 'build_utils.CallAndWriteDepfileIfStale'
+
+
+def _ReadEvents(trace_paths):
+  """Reads trace files, giving the events of each file a pid of their own.
+
+  Each file holds the events of a single process, but pids are reused during
+  long builds, so unrelated actions may have the same pid.
+  """
+  events = []
+  for trace_pid, path in enumerate(trace_paths, 1):
+    with open(path) as f:
+      for line in f:
+        try:
+          event = json.loads(line)
+        except ValueError:
+          # The last line of an action that was killed may be truncated.
+          logging.warning('Skipping malformed line in %s', path)
+          continue
+        event['pid'] = trace_pid
+        events.append(event)
+  return events
+
+
+def _ListTraceFiles(paths):
+  trace_paths = []
+  for path in paths:
+    if os.path.isdir(path):
+      trace_paths.extend(
+          os.path.join(path, n) for n in sorted(os.listdir(path))
+          if n.endswith('.trace'))
+    else:
+      trace_paths.append(path)
+  return trace_paths
+
+
+def _NameProcesses(events):
+  """Includes each action's output in its process name."""
+  outputs = {}
+  for e in events:
+    if e['ph'] == 'X' and e['name'] == _ACTION_SPAN_NAME:
+      outputs.setdefault(e['pid'], e['args'].get('output'))
+  for e in events:
+    if e['ph'] == 'M' and e['name'] == 'process_name':
+      output = outputs.get(e['pid'])
+      if output:
+        e['args']['name'] = '%s %s' % (e['args']['name'], output)
+
+
+def MergeEvents(events):
+  """Returns a trace-event JSON object with timestamps relative to the start.
+
+  Args:
+    events: Trace events as written by util/trace_utils.py.
+  """
+  events = sorted(events, key=lambda e: (e.get('ts', 0), -e.get('dur', 0)))
+  start = min([e['ts'] for e in events if 'ts' in e] or [0])
+  for e in events:
+    if 'ts' in e:
+      e['ts'] -= start
+  _NameProcesses(events)
+  return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def _PrintSummary(events, count):
+  totals = collections.defaultdict(int)
+  for e in events:
+    if e['ph'] == 'X':
+      totals[e['name']] += e['dur']
+  print('Total time by span (s):')
+  for name, dur in sorted(totals.items(), key=lambda x: -x[1])[:count]:
+    print('  %10.3f  %s' % (dur / 1e6, name))
+
+  actions = [e for e in events
+             if e['ph'] == 'X' and e['name'] == _ACTION_SPAN_NAME]
+  print('Slowest actions (s):')
+  for e in sorted(actions, key=lambda e: -e['dur'])[:count]:
+    print('  %10.3f  %s' % (e['dur'] / 1e6, e['args'].get('output')))
+
+
+def main(args):
+  parser = argparse.ArgumentParser(description=__doc__,
+      formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('inputs', nargs='+',
+                      help='Trace directories or .trace files.')
+  parser.add_argument('--output', help='Path to write the merged trace to.')
+  parser.add_argument('--summary', type=int, metavar='N',
+                      help='Print the N most expensive spans and actions.')
+  options = parser.parse_args(args)
+
+  events = _ReadEvents(_ListTraceFiles(options.inputs))
+  trace = MergeEvents(events)
+  if options.output:
+    with open(options.output, 'w') as f:
+      json.dump(trace, f)
+  if options.summary:
+    _PrintSummary(trace['traceEvents'], options.summary)
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))